@@ -0,0 +1,78 @@
+import json
+import time
+import argparse
+from typing import Dict, List, Optional
+import numpy as np
+import faiss
+from .bank_index import INDEX_TYPES, search_params, train_index
+
+# Offline recall/latency benchmark for the BankANN index types on synthetic clustered banks.
+# Ground truth is exact inner-product search (flat); no DB, LLM or embedding calls.
+
+def synthetic_vectors(n: int, dim: int, n_clusters: int = 256, spread: float = 0.35, seed: int = 0) -> np.ndarray:
+    # Clustered like real question embeddings (many paraphrases per concept), L2-normalized
+    rng = np.random.default_rng(seed)
+    centres = rng.normal(size=(n_clusters, dim)).astype(np.float32)
+    X = centres[rng.integers(0, n_clusters, n)] + spread * rng.normal(size=(n, dim)).astype(np.float32)
+    faiss.normalize_L2(X)
+    return X
+
+def index_bytes(index) -> int:
+    return int(faiss.serialize_index(index).nbytes)
+
+def recall_at_k(found: np.ndarray, truth: np.ndarray) -> float:
+    hits = sum(len(np.intersect1d(f[f != -1], t)) for f, t in zip(found, truth))
+    return hits / max(1, truth.size)
+
+def _timed_search(index, Q: np.ndarray, k: int, params=None):
+    t0 = time.perf_counter()
+    _, I = index.search(Q, k, params=params) if params is not None else index.search(Q, k)
+    return I, time.perf_counter() - t0
+
+def bench(n: int, dim: int = 256, n_queries: int = 1000, k: int = 10, kinds: Optional[List[str]] = None,
+          nprobes: List[int] = (1, 4, 16, 64), ef_searches: List[int] = (16, 64, 256), seed: int = 0) -> List[Dict]:
+    X = synthetic_vectors(n + n_queries, dim, seed=seed)
+    X, Q = X[:n], X[n:]  # held-out queries from the same clusters
+    rows: List[Dict] = []
+
+    flat = faiss.IndexFlatIP(dim)
+    t0 = time.perf_counter()
+    flat.add(X)
+    build = time.perf_counter() - t0
+    truth, el = _timed_search(flat, Q, k)
+    base = {"n": n, "dim": dim, "k": k, "queries": n_queries}
+    rows.append({**base, "index": "flat", "param": None, "build_s": build, "bytes": index_bytes(flat),
+                 "recall": 1.0, "qps": n_queries / el})
+
+    for kind in kinds or [t for t in INDEX_TYPES if t != "flat"]:
+        t0 = time.perf_counter()
+        index = train_index(kind, X, seed=seed)
+        build = time.perf_counter() - t0
+        size = index_bytes(index)
+        sweep = [("nprobe", p, search_params(index, nprobe=p)) for p in nprobes] if kind.startswith("ivf") \
+            else [("efSearch", e, search_params(index, ef_search=e)) for e in ef_searches]
+        for name, value, params in sweep:
+            found, el = _timed_search(index, Q, k, params)
+            rows.append({**base, "index": kind, "param": f"{name}={value}", "build_s": build, "bytes": size,
+                         "recall": recall_at_k(found, truth), "qps": n_queries / el})
+    return rows
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark BankANN index types: recall@k vs flat, QPS and memory.")
+    ap.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 1000000])
+    ap.add_argument("--dim", type=int, default=256, help="synthetic embedding dim (1536 for production vectors)")
+    ap.add_argument("--queries", type=int, default=1000)
+    ap.add_argument("--k", type=int, default=10)
+    ap.add_argument("--kinds", nargs="+", choices=INDEX_TYPES[1:], default=None)
+    ap.add_argument("--nprobe", type=int, nargs="+", default=[1, 4, 16, 64])
+    ap.add_argument("--ef-search", type=int, nargs="+", default=[16, 64, 256])
+    ap.add_argument("--seed", type=int, default=0)
+    args = ap.parse_args()
+
+    report = []
+    for n in args.sizes:
+        report.extend(bench(n, args.dim, args.queries, args.k, args.kinds, args.nprobe, args.ef_search, args.seed))
+    print(json.dumps(report, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+import time
+import sqlite3
+import hashlib
+import threading
+from typing import Dict, List
+import numpy as np
+from .config import EMBED_CACHE_PATH, EMBED_CACHE_MAX_ITEMS
+
+class EmbeddingCache:
+    # Disk-backed LRU of float32 vectors keyed by sha256(model, text); safe to share across threads
+
+    def __init__(self, path: str = EMBED_CACHE_PATH, max_items: int = EMBED_CACHE_MAX_ITEMS):
+        self.max_items = max_items
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vec BLOB NOT NULL, last_used REAL NOT NULL)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS ix_embeddings_last_used ON embeddings (last_used)")
+        self.conn.commit()
+        self.count = self.conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    @staticmethod
+    def key(model: str, text: str) -> str:
+        return hashlib.sha256(f"{model}\x00{text}".encode("utf-8")).hexdigest()
+
+    def get_many(self, keys: List[str], chunk: int = 900) -> Dict[str, np.ndarray]:
+        found: Dict[str, np.ndarray] = {}
+        uniq = list(dict.fromkeys(keys))
+        with self.lock:
+            for i in range(0, len(uniq), chunk):
+                part = uniq[i:i + chunk]
+                marks = ",".join("?" * len(part))
+                for k, blob in self.conn.execute(f"SELECT key, vec FROM embeddings WHERE key IN ({marks})", part):
+                    found[k] = np.frombuffer(blob, dtype="<f4")
+            if found:
+                now = time.time()
+                self.conn.executemany("UPDATE embeddings SET last_used = ? WHERE key = ?", [(now, k) for k in found])
+                self.conn.commit()
+        return found
+
+    def put_many(self, items: Dict[str, List[float]]):
+        if not items:
+            return
+        now = time.time()
+        rows = [(k, np.asarray(v, dtype="<f4").tobytes(), now) for k, v in items.items()]
+        with self.lock:
+            before = self.conn.total_changes
+            self.conn.executemany("INSERT OR IGNORE INTO embeddings (key, vec, last_used) VALUES (?, ?, ?)", rows)
+            self.count += self.conn.total_changes - before
+            if self.count > self.max_items:
+                self._evict(self.count - int(self.max_items * 0.9))
+            self.conn.commit()
+
+    def _evict(self, n: int):
+        # Drop the n least recently used vectors (caller holds the lock)
+        self.conn.execute(
+            "DELETE FROM embeddings WHERE key IN (SELECT key FROM embeddings ORDER BY last_used ASC LIMIT ?)", (n,)
+        )
+        self.count = self.conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
@@ -1,21 +1,182 @@
-from typing import List
-import numpy as np
-from langchain_openai import OpenAIEmbeddings
-from .config import OPENAI_API_KEY, EMBED_MODEL
-
-def embed_texts(texts: List[str]) -> List[List[float]]:
-    emb = OpenAIEmbeddings(model=EMBED_MODEL, api_key=OPENAI_API_KEY)
-    return emb.embed_documents(texts)
-
-def cosine(a: np.ndarray, b: np.ndarray) -> float:
-    denom = (np.linalg.norm(a) * np.linalg.norm(b)) + 1e-12
-    return float(np.dot(a, b) / denom)
-
-def max_cosine(new_vec: List[float], prior_vecs: List[List[float]]) -> float:
-    if not prior_vecs:
-        return 0.0
-    a = np.array(new_vec, dtype=np.float32)
-    prior = np.array(prior_vecs, dtype=np.float32)
-    sims = prior @ a / (np.linalg.norm(prior, axis=1) * np.linalg.norm(a) + 1e-12)
-    return float(np.max(sims))
-
+import asyncio
+import threading
+from typing import Dict, Iterator, List, Tuple
+import numpy as np
+from langchain_openai import OpenAIEmbeddings
+from .embed_cache import EmbeddingCache
+from .config import OPENAI_API_KEY, EMBED_MODEL, EMBED_CACHE_PATH, EMBED_BATCH_SIZE
+from .metrics import count_embed, timed
+
+_CLIENT: OpenAIEmbeddings | None = None
+_CACHE: EmbeddingCache | None = None
+_LOCK = threading.Lock()
+
+def get_embeddings_client() -> OpenAIEmbeddings:
+    global _CLIENT
+    if _CLIENT is None:
+        with _LOCK:
+            if _CLIENT is None:
+                _CLIENT = OpenAIEmbeddings(model=EMBED_MODEL, api_key=OPENAI_API_KEY)
+    return _CLIENT
+
+def get_embedding_cache() -> EmbeddingCache | None:
+    global _CACHE
+    if _CACHE is None and EMBED_CACHE_PATH:
+        with _LOCK:
+            if _CACHE is None:
+                _CACHE = EmbeddingCache(EMBED_CACHE_PATH)
+    return _CACHE
+
+def _lookup(texts: List[str]) -> Tuple[List[str], Dict[str, np.ndarray], Dict[str, str]]:
+    # Cache keys for `texts`, the cached vectors, and the misses (key -> text, deduplicated)
+    cache = get_embedding_cache()
+    keys = [EmbeddingCache.key(EMBED_MODEL, t) for t in texts]
+    found = cache.get_many(keys) if cache else {}
+    missing = {k: t for k, t in zip(keys, texts) if k not in found}
+    return keys, found, missing
+
+def _miss_batches(missing: Dict[str, str]) -> Iterator[Tuple[List[str], List[str]]]:
+    miss_keys = list(missing)
+    for i in range(0, len(miss_keys), EMBED_BATCH_SIZE):
+        batch = miss_keys[i:i + EMBED_BATCH_SIZE]
+        yield batch, [missing[k] for k in batch]
+
+def _store(batch: List[str], vecs: List[List[float]]) -> Dict[str, List[float]]:
+    fresh = dict(zip(batch, vecs))
+    cache = get_embedding_cache()
+    if cache:
+        cache.put_many(fresh)
+    return fresh
+
+def _as_lists(keys: List[str], found: Dict) -> List[List[float]]:
+    return [np.asarray(found[k], dtype=np.float32).tolist() for k in keys]
+
+@timed("embed_texts")
+def embed_texts(texts: List[str]) -> List[List[float]]:
+    # Only cache misses go to the provider, deduplicated and in EMBED_BATCH_SIZE batches
+    if not texts:
+        return []
+    keys, found, missing = _lookup(texts)
+    if missing:
+        client = get_embeddings_client()
+        for batch, texts_batch in _miss_batches(missing):
+            vecs = client.embed_documents(texts_batch)
+            count_embed(texts_batch)
+            found.update(_store(batch, vecs))
+    return _as_lists(keys, found)
+
+@timed("embed_texts")
+async def aembed_texts(texts: List[str]) -> List[List[float]]:
+    # embed_texts for the async nodes: provider batches are awaited and the (sqlite) cache is read and
+    # written on a worker thread, so neither blocks the event loop
+    if not texts:
+        return []
+    keys, found, missing = await asyncio.to_thread(_lookup, texts)
+    if missing:
+        client = get_embeddings_client()
+        for batch, texts_batch in _miss_batches(missing):
+            vecs = await client.aembed_documents(texts_batch)
+            count_embed(texts_batch)
+            found.update(await asyncio.to_thread(_store, batch, vecs))
+    return _as_lists(keys, found)
+
+def cosine(a: np.ndarray, b: np.ndarray) -> float:
+    denom = (np.linalg.norm(a) * np.linalg.norm(b)) + 1e-12
+    return float(np.dot(a, b) / denom)
+
+def max_cosine(new_vec: List[float], prior_vecs: List[List[float]]) -> float:
+    if not prior_vecs:
+        return 0.0
+    a = np.array(new_vec, dtype=np.float32)
+    prior = np.array(prior_vecs, dtype=np.float32)
+    sims = prior @ a / (np.linalg.norm(prior, axis=1) * np.linalg.norm(a) + 1e-12)
+    return float(np.max(sims))
+
+
+class SeenMatrix:
+    # Pre-normalized float32 vectors already served in an attempt; grows by doubling.
+    # Serialized as float16 (uint32 dim header) so it can ride along in the graph checkpoint.
+
+    def __init__(self, dim: int = 0, capacity: int = 16):
+        self._buf = np.zeros((capacity, dim), dtype=np.float32)
+        self.n = 0
+
+    def __len__(self) -> int:
+        return self.n
+
+    @property
+    def dim(self) -> int:
+        return self._buf.shape[1]
+
+    @property
+    def matrix(self) -> np.ndarray:
+        return self._buf[:self.n]
+
+    @staticmethod
+    def _normalize(vecs) -> np.ndarray:
+        X = np.atleast_2d(np.asarray(vecs, dtype=np.float32))
+        return X / np.maximum(np.linalg.norm(X, axis=1, keepdims=True), 1e-12)
+
+    def add(self, vecs, normalized: bool = False):
+        X = np.atleast_2d(np.asarray(vecs, dtype=np.float32)) if normalized else self._normalize(vecs)
+        if not X.size:
+            return
+        if self.n == 0 and self.dim != X.shape[1]:
+            self._buf = np.zeros((max(len(self._buf), len(X)), X.shape[1]), dtype=np.float32)
+        if X.shape[1] != self.dim:
+            return  # different embedding model; cannot compare
+        if self.n + len(X) > len(self._buf):
+            grown = np.zeros((max(2 * len(self._buf), self.n + len(X)), self.dim), dtype=np.float32)
+            grown[:self.n] = self._buf[:self.n]
+            self._buf = grown
+        self._buf[self.n:self.n + len(X)] = X
+        self.n += len(X)
+
+    def max_sims(self, cands, normalized: bool = False) -> np.ndarray:
+        # Max cosine of each candidate against everything seen: one (C x dim) @ (dim x n) matmul
+        C = np.atleast_2d(np.asarray(cands, dtype=np.float32)) if normalized else self._normalize(cands)
+        if self.n == 0 or C.shape[1] != self.dim:
+            return np.zeros(len(C), dtype=np.float32)
+        return (C @ self.matrix.T).max(axis=1)
+
+    def max_sim(self, vec) -> float:
+        return float(self.max_sims(vec)[0])
+
+    def take_unique(self, cands, threshold: float, limit: int, add: bool = True) -> List[int]:
+        # Greedily accept candidates below threshold vs. seen and vs. each other
+        C = self._normalize(cands)
+        base = self.max_sims(C, normalized=True)
+        accepted: List[int] = []
+        for i in range(len(C)):
+            if len(accepted) >= limit:
+                break
+            if base[i] >= threshold:
+                continue
+            if accepted and float((C[accepted] @ C[i]).max()) >= threshold:
+                continue
+            accepted.append(i)
+        if add and accepted:
+            self.add(C[accepted], normalized=True)
+        return accepted
+
+    def to_state(self) -> bytes:
+        header = np.array([self.dim], dtype="<u4").tobytes()
+        return header + self.matrix.astype("<f2").tobytes()
+
+    @classmethod
+    def from_state(cls, blob: bytes | None) -> "SeenMatrix":
+        if not blob:
+            return cls()
+        dim = int(np.frombuffer(blob[:4], dtype="<u4")[0])
+        data = np.frombuffer(blob[4:], dtype="<f2").astype(np.float32).reshape(-1, dim) if dim else np.zeros((0, 0))
+        m = cls(dim, max(16, len(data)))
+        m.add(data, normalized=True)
+        return m
+
+    @classmethod
+    def from_items(cls, items: List[Dict]) -> "SeenMatrix":
+        m = cls()
+        vecs = [it["embedding"] for it in items if it.get("embedding") is not None]
+        if vecs:
+            m.add(vecs)
+        return m
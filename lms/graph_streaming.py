@@ -1,147 +1,301 @@
-from typing import TypedDict, List, Dict, Annotated
-import operator
-from datetime import datetime
-from sqlalchemy.orm import Session
-from langgraph.graph import StateGraph, START, END
-from langgraph.types import Command
-from langgraph.types import interrupt
-from .db import SessionLocal, QuizAttempt, AttemptResponse
-from .quiz import select_unique_items_for_attempt
-from .config import QUIZ_LENGTH, CHECKPOINTER_BACKEND, REDIS_URL, SQLITE_CP_PATH
-from .progress import is_unlocked, record_attempt
-
-def make_checkpointer():
-    if CHECKPOINTER_BACKEND == "redis":
-        from langgraph.checkpoint.redis import RedisSaver
-        return RedisSaver.from_conn_string(REDIS_URL)
-    if CHECKPOINTER_BACKEND == "sqlite":
-        from langgraph.checkpoint.sqlite import SqliteSaver
-        return SqliteSaver.from_conn_string(f"sqlite:///{SQLITE_CP_PATH}")
-    from langgraph.checkpoint.memory import InMemorySaver
-    return InMemorySaver()
-
-class AttemptState(TypedDict):
-    user_id: int
-    topic: str
-    subtopic: str
-    difficulty: str
-    needed: int
-    served: Annotated[List[Dict], operator.add]
-    current_index: int
-    current_answer: int | None
-    correct_count: int
-    complete: bool
-
-def _db() -> Session:
-    return SessionLocal()
-
-def node_gate_unlock(s: AttemptState):
-    db = SessionLocal()
-    ok, unmet = is_unlocked(db, s["user_id"], s["topic"], s["subtopic"])
-    if ok:
-        return {}
-    _ = interrupt({
-        "type": "locked",
-        "message": "This subtopic is locked. Complete prerequisites first.",
-        "unmet": unmet
-    })
-    return {}
-
-def node_init(s: AttemptState):
-    return {
-        "needed": QUIZ_LENGTH if not s.get("needed") else s["needed"],
-        "served": s.get("served", []),
-        "current_index": s.get("current_index", 0),
-        "current_answer": None,
-        "correct_count": s.get("correct_count", 0),
-        "complete": False
-    }
-
-def node_maybe_generate_next(s: AttemptState):
-    if len(s["served"]) > s["current_index"]:
-        return {}
-    more = select_unique_items_for_attempt(
-        db=_db(),
-        topic=s["topic"],
-        subtopic=s["subtopic"],
-        difficulty=s["difficulty"],
-        needed=1,
-        attempt_seen_items=s["served"]
-    )
-    batch = []
-    for it in more:
-        batch.append({
-            "item_id": it["item_id"],
-            "question": it["question"],
-            "choices": it["choices"],
-            "correct_index": it["correct_index"],
-            "embedding": it.get("embedding"),
-        })
-    return {"served": batch}
-
-def node_emit_and_wait(s: AttemptState):
-    idx = s["current_index"]
-    if idx >= s["needed"]:
-        return {}
-    q = s["served"][idx]
-    _ = interrupt({
-        "type": "await_answer",
-        "index": idx,
-        "question": q["question"],
-        "choices": q["choices"],
-    })
-    return {}
-
-def node_validate_and_advance(s: AttemptState):
-    idx = s["current_index"]
-    if idx >= len(s["served"]):
-        return {}
-    q = s["served"][idx]
-    ans = s.get("current_answer", None)
-    correct_count = s["correct_count"]
-    if ans is not None and ans == q["correct_index"]:
-        correct_count += 1
-    next_idx = idx + 1
-    done = next_idx >= s["needed"]
-    return {"correct_count": correct_count, "current_index": next_idx, "current_answer": None, "complete": done}
-
-def build_quiz_graph_streaming():
-    g = StateGraph(AttemptState)
-    g.add_node("gate", node_gate_unlock)
-    g.add_node("init", node_init)
-    g.add_node("maybe_generate_next", node_maybe_generate_next)
-    g.add_node("emit_and_wait", node_emit_and_wait)
-    g.add_node("validate_and_advance", node_validate_and_advance)
-    g.add_edge(START, "gate")
-    g.add_edge("gate", "init")
-    g.add_edge("init", "maybe_generate_next")
-    g.add_edge("maybe_generate_next", "emit_and_wait")
-    g.add_edge("emit_and_wait", "validate_and_advance")
-    g.add_conditional_edges("validate_and_advance", lambda s: "end" if s["complete"] else "loop",
-                            {"end": END, "loop": "maybe_generate_next"})
-    checkpointer = make_checkpointer()
-    return g.compile(checkpointer=checkpointer)
-
-def persist_attempt(user_id: int, topic: str, subtopic: str, served: List[Dict], answers: List[int], pass_mark: float = 0.6):
-    db = _db()
-    att = QuizAttempt(user_id=user_id, topic=topic, subtopic=subtopic, created_at=datetime.utcnow())
-    db.add(att); db.flush()
-    correct = 0
-    for i, it in enumerate(served):
-        ui = answers[i] if i < len(answers) else None
-        is_correct = (ui == it["correct_index"]) if ui is not None else None
-        if is_correct:
-            correct += 1
-        db.add(AttemptResponse(
-            attempt_id=att.id,
-            item_id=it["item_id"], question=it["question"], choices=it["choices"],
-            correct_index=it["correct_index"], user_index=ui, correct=is_correct
-        ))
-    score = correct / max(1, len(served))
-    att.score = score * 100.0
-    att.passed = bool(score >= pass_mark)
-    att.finished_at = datetime.utcnow()
-    db.commit()
-    # Update progression
-    record_attempt(db, user_id, topic, subtopic, att.score, pass_mark)
-    return att.id
+from typing import TypedDict, List, Dict, Annotated
+import operator
+import threading
+from functools import partial
+from datetime import datetime
+from sqlalchemy.orm import Session
+from langgraph.graph import StateGraph, START, END
+from langgraph.graph.state import CompiledStateGraph
+from langgraph.checkpoint.base import BaseCheckpointSaver
+from langgraph.types import Command
+from langgraph.types import interrupt
+from .db import SessionLocal, QuizAttempt, AttemptResponse, get_async_session, arun
+from .quiz import select_unique_items_for_attempt, aselect_unique_items_for_attempt
+from .embeddings import SeenMatrix
+from .prefetch import get_prefetcher
+from .item_cache import get_item_cache, rehydrate, arehydrate
+from .retention import compact_thread, acompact_thread
+from .checkpointer import get_checkpointer, shutdown_checkpointer, aget_checkpointer, ashutdown_checkpointer
+from .config import QUIZ_LENGTH, PREFETCH_ENABLED, CHECKPOINT_SLIM, CHECKPOINT_COMPACT
+from .progress import is_unlocked, record_attempt
+from .metrics import instrument
+
+GRAPH_NAME = "quiz_streaming"  # `graph` label in metrics.py
+
+class AttemptState(TypedDict):
+    user_id: int
+    topic: str
+    subtopic: str
+    difficulty: str
+    needed: int
+    served: Annotated[List[Dict], operator.add]  # {"item_id"} refs when CHECKPOINT_SLIM, else full items
+    seen_matrix: bytes | None  # SeenMatrix.to_state() of everything served so far (full mode only)
+    current_index: int
+    current_answer: int | None
+    correct_count: int
+    complete: bool
+
+def _db() -> Session:
+    return SessionLocal()
+
+# Nodes prefixed with `a` are the async variants used by graphs built with aio=True: the same steps,
+# with DB work on an AsyncSession and provider calls awaited, so one event loop can drive many attempts.
+
+def _gate(ok: bool, unmet: List[Dict]):
+    if ok:
+        return {}
+    _ = interrupt({
+        "type": "locked",
+        "message": "This subtopic is locked. Complete prerequisites first.",
+        "unmet": unmet
+    })
+    return {}
+
+def node_gate_unlock(s: AttemptState):
+    db = SessionLocal()
+    return _gate(*is_unlocked(db, s["user_id"], s["topic"], s["subtopic"]))
+
+async def anode_gate_unlock(s: AttemptState):
+    async with get_async_session()() as adb:
+        ok, unmet = await arun(adb, is_unlocked, s["user_id"], s["topic"], s["subtopic"])
+    return _gate(ok, unmet)
+
+def node_init(s: AttemptState):
+    return {
+        "needed": QUIZ_LENGTH if not s.get("needed") else s["needed"],
+        "served": s.get("served", []),
+        "current_index": s.get("current_index", 0),
+        "current_answer": None,
+        "correct_count": s.get("correct_count", 0),
+        "complete": False
+    }
+
+def _prefetch_key(s: AttemptState):
+    # The next item depends only on the attempt and what it has served so far
+    return (s["user_id"], s["topic"], s["subtopic"], s["difficulty"], tuple(it["item_id"] for it in s["served"]))
+
+def _generate_next(s: AttemptState, bank_only: bool = False) -> Dict:
+    served = rehydrate(s["served"])
+    seen = SeenMatrix.from_state(s["seen_matrix"]) if s.get("seen_matrix") else SeenMatrix.from_items(served)
+    db = _db()
+    try:
+        more = select_unique_items_for_attempt(
+            db=db,
+            topic=s["topic"],
+            subtopic=s["subtopic"],
+            difficulty=s["difficulty"],
+            needed=1,
+            attempt_seen_items=served,
+            seen=seen,
+            bank_only=bank_only,
+        )
+    finally:
+        db.close()
+    if bank_only and not more:
+        return {}  # taken as a miss; the node generates
+    return _next_update(seen, more)
+
+async def _agenerate_next(s: AttemptState) -> Dict:
+    async with get_async_session()() as adb:
+        served = await arehydrate(s["served"], adb)
+        seen = SeenMatrix.from_state(s["seen_matrix"]) if s.get("seen_matrix") else SeenMatrix.from_items(served)
+        more = await aselect_unique_items_for_attempt(
+            adb,
+            topic=s["topic"],
+            subtopic=s["subtopic"],
+            difficulty=s["difficulty"],
+            needed=1,
+            attempt_seen_items=served,
+            seen=seen,
+        )
+    return _next_update(seen, more)
+
+def _next_update(seen: SeenMatrix, more: List[Dict]) -> Dict:
+    batch = []
+    for it in more:
+        batch.append({
+            "item_id": it["item_id"],
+            "question": it["question"],
+            "choices": it["choices"],
+            "correct_index": it["correct_index"],
+            "embedding": it.get("embedding"),
+        })
+    if CHECKPOINT_SLIM:
+        # Only ids are checkpointed; the attempt's dedup matrix is rebuilt from the cached vectors
+        get_item_cache().put(batch)
+        return {"served": [{"item_id": it["item_id"]} for it in batch], "seen_matrix": None}
+    return {"served": batch, "seen_matrix": seen.to_state()}
+
+def node_maybe_generate_next(s: AttemptState, prefetch: bool = False):
+    if len(s["served"]) > s["current_index"]:
+        return {}
+    if prefetch:
+        ready = get_prefetcher().take(_prefetch_key(s))
+        if ready is not None:
+            return ready
+    return _generate_next(s)
+
+async def anode_maybe_generate_next(s: AttemptState, prefetch: bool = False):
+    if len(s["served"]) > s["current_index"]:
+        return {}
+    if prefetch:
+        ready = await get_prefetcher().atake(_prefetch_key(s))
+        if ready is not None:
+            return ready
+    return await _agenerate_next(s)
+
+def node_emit_and_wait(s: AttemptState, prefetch: bool = False):
+    idx = s["current_index"]
+    if idx >= s["needed"]:
+        return {}
+    return _emit(s, rehydrate(s["served"][idx:idx + 1])[0], prefetch)
+
+async def anode_emit_and_wait(s: AttemptState, prefetch: bool = False):
+    idx = s["current_index"]
+    if idx >= s["needed"]:
+        return {}
+    async with get_async_session()() as adb:
+        q = (await arehydrate(s["served"][idx:idx + 1], adb))[0]
+    return _emit(s, q, prefetch)
+
+def _emit(s: AttemptState, q: Dict, prefetch: bool):
+    idx = s["current_index"]
+    if prefetch and idx + 1 < s["needed"] and len(s["served"]) == idx + 1:
+        # Select item idx+1 while the learner answers; picked up by maybe_generate_next after the resume.
+        # Prefetch jobs run on the prefetcher's worker threads with the sync path, also for async graphs.
+        # They only draw from the bank: if it is short, maybe_generate_next generates as without prefetch.
+        get_prefetcher().submit(_prefetch_key(s), _generate_next, dict(s), True)
+    resume = interrupt({
+        "type": "await_answer",
+        "index": idx,
+        "question": q["question"],
+        "choices": q["choices"],
+    })
+    # Resumed with Command(resume={"current_answer": i}) or a bare index
+    ans = resume.get("current_answer") if isinstance(resume, dict) else resume
+    return {"current_answer": ans}
+
+def node_validate_and_advance(s: AttemptState):
+    idx = s["current_index"]
+    if idx >= len(s["served"]):
+        return {}
+    return _advance(s, rehydrate(s["served"][idx:idx + 1])[0])
+
+async def anode_validate_and_advance(s: AttemptState):
+    idx = s["current_index"]
+    if idx >= len(s["served"]):
+        return {}
+    async with get_async_session()() as adb:
+        q = (await arehydrate(s["served"][idx:idx + 1], adb))[0]
+    return _advance(s, q)
+
+def _advance(s: AttemptState, q: Dict):
+    idx = s["current_index"]
+    ans = s.get("current_answer", None)
+    correct_count = s["correct_count"]
+    if ans is not None and ans == q["correct_index"]:
+        correct_count += 1
+    next_idx = idx + 1
+    done = next_idx >= s["needed"]
+    return {"correct_count": correct_count, "current_index": next_idx, "current_answer": None, "complete": done}
+
+def build_quiz_graph_streaming(prefetch: bool | None = None, checkpointer: BaseCheckpointSaver | None = None,
+                               aio: bool = False):
+    # aio=True builds the async variant (drive it with ainvoke/astream); pass it an async-capable
+    # checkpointer (aget_checkpointer()) unless the backend is in-memory
+    prefetch = PREFETCH_ENABLED if prefetch is None else prefetch
+    g = StateGraph(AttemptState)
+    nodes = {
+        "gate": anode_gate_unlock if aio else node_gate_unlock,
+        "init": node_init,
+        "maybe_generate_next": partial(anode_maybe_generate_next if aio else node_maybe_generate_next, prefetch=prefetch),
+        "emit_and_wait": partial(anode_emit_and_wait if aio else node_emit_and_wait, prefetch=prefetch),
+        "validate_and_advance": anode_validate_and_advance if aio else node_validate_and_advance,
+    }
+    for name, fn in nodes.items():
+        g.add_node(name, instrument(GRAPH_NAME, name, fn))
+    g.add_edge(START, "gate")
+    g.add_edge("gate", "init")
+    g.add_edge("init", "maybe_generate_next")
+    g.add_edge("maybe_generate_next", "emit_and_wait")
+    g.add_edge("emit_and_wait", "validate_and_advance")
+    g.add_conditional_edges("validate_and_advance", lambda s: "end" if s["complete"] else "loop",
+                            {"end": END, "loop": "maybe_generate_next"})
+    return g.compile(checkpointer=checkpointer or get_checkpointer())
+
+_GRAPHS: Dict[bool, CompiledStateGraph] = {}
+_GRAPHS_LOCK = threading.Lock()
+
+def get_quiz_graph_streaming(prefetch: bool | None = None) -> CompiledStateGraph:
+    # Compiled once per process and shared by all requests; per-attempt state lives in the checkpointer
+    prefetch = PREFETCH_ENABLED if prefetch is None else prefetch
+    graph = _GRAPHS.get(prefetch)
+    if graph is None:
+        with _GRAPHS_LOCK:
+            graph = _GRAPHS.get(prefetch)
+            if graph is None:
+                graph = _GRAPHS[prefetch] = build_quiz_graph_streaming(prefetch)
+    return graph
+
+def shutdown_quiz_graphs():
+    with _GRAPHS_LOCK:
+        _GRAPHS.clear()
+    shutdown_checkpointer()
+
+_AGRAPHS: Dict[bool, CompiledStateGraph] = {}
+
+async def aget_quiz_graph_streaming(prefetch: bool | None = None) -> CompiledStateGraph:
+    # Async counterpart of get_quiz_graph_streaming, over the event loop's checkpointer
+    prefetch = PREFETCH_ENABLED if prefetch is None else prefetch
+    graph = _AGRAPHS.get(prefetch)
+    if graph is None:
+        checkpointer = await aget_checkpointer()
+        graph = _AGRAPHS.setdefault(prefetch, build_quiz_graph_streaming(prefetch, checkpointer, aio=True))
+    return graph
+
+async def ashutdown_quiz_graphs():
+    _AGRAPHS.clear()
+    await ashutdown_checkpointer()
+
+def persist_attempt(user_id: int, topic: str, subtopic: str, served: List[Dict], answers: List[int], pass_mark: float = 0.6,
+                    checkpointer: BaseCheckpointSaver | None = None, thread_id: str | None = None):
+    # Pass the graph's checkpointer and the attempt's thread_id to drop its intermediate checkpoints
+    served = rehydrate(served)
+    att_id = _write_attempt(_db(), user_id, topic, subtopic, served, answers, pass_mark)
+    if CHECKPOINT_COMPACT and checkpointer is not None and thread_id:
+        compact_thread(checkpointer, thread_id)
+    return att_id
+
+async def apersist_attempt(user_id: int, topic: str, subtopic: str, served: List[Dict], answers: List[int],
+                           pass_mark: float = 0.6, checkpointer: BaseCheckpointSaver | None = None,
+                           thread_id: str | None = None):
+    async with get_async_session()() as adb:
+        served = await arehydrate(served, adb)
+        att_id = await arun(adb, _write_attempt, user_id, topic, subtopic, served, answers, pass_mark)
+    if CHECKPOINT_COMPACT and checkpointer is not None and thread_id:
+        await acompact_thread(checkpointer, thread_id)
+    return att_id
+
+def _write_attempt(db: Session, user_id: int, topic: str, subtopic: str, served: List[Dict], answers: List[int],
+                   pass_mark: float) -> int:
+    att = QuizAttempt(user_id=user_id, topic=topic, subtopic=subtopic, created_at=datetime.utcnow())
+    db.add(att); db.flush()
+    correct = 0
+    for i, it in enumerate(served):
+        ui = answers[i] if i < len(answers) else None
+        is_correct = (ui == it["correct_index"]) if ui is not None else None
+        if is_correct:
+            correct += 1
+        db.add(AttemptResponse(
+            attempt_id=att.id,
+            item_id=it["item_id"], question=it["question"], choices=it["choices"],
+            correct_index=it["correct_index"], user_index=ui, correct=is_correct
+        ))
+    score = correct / max(1, len(served))
+    att.score = score * 100.0
+    att.passed = bool(score >= pass_mark)
+    att.finished_at = datetime.utcnow()
+    db.commit()
+    # Update progression
+    record_attempt(db, user_id, topic, subtopic, att.score, pass_mark)
+    return att.id
@@ -0,0 +1,157 @@
+import os
+import csv
+import json
+import argparse
+from typing import Dict, Iterator, List, Optional, Tuple
+from .db import SessionLocal, QuestionItem, vec_to_blob, bulk_upsert_question_items, init_db
+from .embeddings import embed_texts
+from .bank_index import get_bank_ann
+from .quiz import stable_item_id
+from .config import IMPORT_CHUNK_SIZE, FAISS_DIR
+
+# Bulk import of curated MCQ banks: records are streamed in chunks, validated, embedded in batches
+# and inserted with one statement per batch; the shared bank index is updated per chunk.
+# Memory is bounded by the chunk size, not the file size.
+
+FORMATS = ("jsonl", "csv", "parquet")
+
+def detect_format(path: str) -> str:
+    ext = os.path.splitext(path)[1].lower().lstrip(".")
+    fmt = {"json": "jsonl", "ndjson": "jsonl", "pq": "parquet", "tsv": "csv"}.get(ext, ext)
+    if fmt not in FORMATS:
+        raise ValueError(f"cannot infer format from {path!r}; pass --format")
+    return fmt
+
+def iter_records(path: str, fmt: str, chunk: int = IMPORT_CHUNK_SIZE) -> Iterator[List[Dict]]:
+    # Lists of raw records, at most `chunk` long; blank and unparsable JSONL lines become None (counted invalid)
+    if fmt == "parquet":
+        import pyarrow.parquet as pq  # optional dependency, only needed for parquet
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk):
+            yield batch.to_pylist()
+        return
+    with open(path, newline="", encoding="utf-8") as f:
+        if fmt == "csv":
+            rows = csv.DictReader(f, dialect="excel-tab" if path.lower().endswith(".tsv") else "excel")
+        else:
+            rows = (_json_line(line) for line in f if line.strip())
+        buf: List[Dict] = []
+        for r in rows:
+            buf.append(r)
+            if len(buf) >= chunk:
+                yield buf
+                buf = []
+        if buf:
+            yield buf
+
+def _json_line(line: str) -> Optional[Dict]:
+    try:
+        return json.loads(line)
+    except ValueError:
+        return None
+
+def _choices(v) -> Optional[List[str]]:
+    # JSON/Parquet lists as-is; CSV cells hold a JSON array or "|"-separated choices
+    if isinstance(v, str):
+        v = v.strip()
+        if v.startswith("["):
+            try:
+                v = json.loads(v)
+            except ValueError:
+                return None
+        else:
+            v = [c.strip() for c in v.split("|")]
+    if not isinstance(v, (list, tuple)) or len(v) < 2:
+        return None
+    if not all(isinstance(c, str) and c.strip() for c in v):
+        return None
+    return [str(c) for c in v]
+
+def validate_record(rec, defaults: Dict[str, str]) -> Optional[Dict]:
+    # Normalized QuestionItem row (without embedding), or None if the record is not a usable MCQ
+    if not isinstance(rec, dict):
+        return None
+    question = rec.get("question")
+    choices = _choices(rec.get("choices"))
+    try:
+        answer = int(rec.get("answer_index"))
+    except (TypeError, ValueError):
+        return None
+    if not isinstance(question, str) or not question.strip() or choices is None or not 0 <= answer < len(choices):
+        return None
+    meta = {k: rec.get(k) or defaults.get(k) for k in ("topic", "subtopic", "difficulty")}
+    if not all(isinstance(v, str) and v for v in meta.values()):
+        return None
+    return {
+        "item_id": stable_item_id(question),
+        "source": rec.get("source") or defaults.get("source") or "curated",
+        **meta,
+        "payload": {"question": question, "choices": choices, "answer_index": answer,
+                    "explanation": rec.get("explanation") or ""},
+    }
+
+def import_chunk(db, ann, records: List, defaults: Dict[str, str]) -> Tuple[int, int, int]:
+    # -> (invalid, already banked, inserted). Stems already in the bank are dropped before embedding.
+    rows: Dict[str, Dict] = {}
+    invalid = 0
+    for rec in records:
+        row = validate_record(rec, defaults)
+        if row is None:
+            invalid += 1
+        else:
+            rows.setdefault(row["item_id"], row)
+    dupes = len(records) - invalid - len(rows)
+    if rows:
+        for (item_id,) in db.query(QuestionItem.item_id).filter(QuestionItem.item_id.in_(list(rows))).all():
+            del rows[item_id]
+            dupes += 1
+    if not rows:
+        return invalid, dupes, 0
+    batch = list(rows.values())
+    vecs = embed_texts([r["payload"]["question"] for r in batch])
+    for r, v in zip(batch, vecs):
+        r["embedding_f32"] = vec_to_blob(v)
+    new_ids = set(bulk_upsert_question_items(db, batch))
+    db.commit()
+    added = [(r, v) for r, v in zip(batch, vecs) if r["item_id"] in new_ids]
+    if ann is not None and added:
+        ann.add([r["item_id"] for r, _ in added], [v for _, v in added],
+                [(r["topic"], r["subtopic"], r["difficulty"]) for r, _ in added])
+    return invalid, dupes + len(batch) - len(added), len(added)
+
+def import_bank(path: str, fmt: Optional[str] = None, chunk: int = IMPORT_CHUNK_SIZE,
+                defaults: Optional[Dict[str, str]] = None, update_ann: bool = True) -> Dict:
+    fmt = fmt or detect_format(path)
+    defaults = defaults or {}
+    init_db()
+    ann = get_bank_ann() if update_ann else None
+    db = SessionLocal()
+    report = {"records": 0, "invalid": 0, "duplicates": 0, "inserted": 0}
+    try:
+        for records in iter_records(path, fmt, chunk):
+            invalid, dupes, inserted = import_chunk(db, ann, records, defaults)
+            report["records"] += len(records)
+            report["invalid"] += invalid
+            report["duplicates"] += dupes
+            report["inserted"] += inserted
+    finally:
+        db.close()
+    if ann is not None and report["inserted"]:
+        ann.save(FAISS_DIR)  # other workers map the new snapshot on their next load
+    return report
+
+def main():
+    ap = argparse.ArgumentParser(description="Import a curated MCQ bank (JSONL, CSV or Parquet) into QuestionItem.")
+    ap.add_argument("path")
+    ap.add_argument("--format", choices=FORMATS, default=None, help="default: from the file extension")
+    ap.add_argument("--chunk", type=int, default=IMPORT_CHUNK_SIZE, help="records per validate/embed/insert batch")
+    ap.add_argument("--topic", help="for records without a topic")
+    ap.add_argument("--subtopic", help="for records without a subtopic")
+    ap.add_argument("--difficulty", help="for records without a difficulty")
+    ap.add_argument("--source", default="curated")
+    ap.add_argument("--no-ann", action="store_true", help="skip the bank index (rebuilt on next worker start)")
+    args = ap.parse_args()
+    defaults = {"topic": args.topic, "subtopic": args.subtopic, "difficulty": args.difficulty, "source": args.source}
+    print(json.dumps(import_bank(args.path, args.format, args.chunk, defaults, not args.no_ann)))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+import json
+from typing import Any, List
+
+class JSONArrayStream:
+    # Incremental parser for a JSON array streamed in arbitrary text chunks: feed() returns each
+    # top-level element as soon as its closing bracket arrives. Text before the first '[' (e.g. a
+    # ```json fence, or an {"items": wrapper) and anything after the closing ']' is ignored;
+    # an element that fails to parse is skipped without stopping the stream.
+
+    def __init__(self):
+        self.buf = ""
+        self.pos = 0  # next char of buf to scan
+        self.start = 0  # where the element being scanned begins in buf
+        self.depth = 0
+        self.in_str = False
+        self.escape = False
+        self.started = False
+        self.done = False
+
+    def feed(self, text: str) -> List[Any]:
+        out: List[Any] = []
+        if self.done or not text:
+            return out
+        buf = self.buf + text
+        i = self.pos
+        while i < len(buf) and not self.done:
+            ch = buf[i]
+            if self.in_str:
+                if self.escape:
+                    self.escape = False
+                elif ch == "\\":
+                    self.escape = True
+                elif ch == '"':
+                    self.in_str = False
+            elif not self.started:
+                self.started = ch == "["
+            elif ch == '"':
+                self.in_str = True
+            elif ch in "{[":
+                if self.depth == 0:
+                    self.start = i
+                self.depth += 1
+            elif ch in "}]":
+                if self.depth == 0:
+                    self.done = ch == "]"
+                else:
+                    self.depth -= 1
+                    if self.depth == 0:
+                        try:
+                            out.append(json.loads(buf[self.start:i + 1]))
+                        except ValueError:
+                            pass
+            i += 1
+        # Keep only the unfinished element so the buffer never holds more than one item
+        keep = self.start if self.depth > 0 else i
+        self.buf = "" if self.done else buf[keep:]
+        self.pos = i - keep
+        self.start = 0
+        return out
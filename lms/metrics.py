@@ -0,0 +1,298 @@
+import json
+import time
+import atexit
+import inspect
+import threading
+from bisect import bisect_left
+from contextvars import ContextVar
+from functools import wraps
+from typing import Callable, Dict, List, Optional, Tuple
+from .config import METRICS_ENABLED, METRICS_DUMP_PATH
+
+# Per-node instrumentation for the quiz graphs. Each node run is a step: its wall time and what it
+# spent (DB queries, LLM/embedding calls and tokens) go into in-process histograms labelled by graph
+# and node; checkpoint writes are measured in the saver. Dump with dump_json() / dump_prometheus().
+# With METRICS_ENABLED off, instrument()/timed()/instrument_saver() return their argument unchanged
+# and the counters below are one context-variable lookup.
+
+TIME_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 500)
+TOKEN_BUCKETS = (0, 100, 250, 500, 1000, 2000, 4000, 8000, 16000, 64000)
+BYTE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+STEP_FIELDS = ("db_queries", "llm_calls", "llm_tokens", "embed_calls", "embed_tokens")
+
+_BUCKETS = {
+    "quiz_node_seconds": TIME_BUCKETS,
+    "quiz_node_db_queries": COUNT_BUCKETS,
+    "quiz_node_llm_calls": COUNT_BUCKETS,
+    "quiz_node_llm_tokens": TOKEN_BUCKETS,
+    "quiz_node_embed_calls": COUNT_BUCKETS,
+    "quiz_node_embed_tokens": TOKEN_BUCKETS,
+    "quiz_call_seconds": TIME_BUCKETS,
+    "quiz_checkpoint_seconds": TIME_BUCKETS,
+    "quiz_checkpoint_bytes": BYTE_BUCKETS,
+}
+
+Labels = Tuple[Tuple[str, str], ...]
+
+class Histogram:
+    # Prometheus-style: counts[i] holds observations <= buckets[i] (and above the previous bound),
+    # the last slot everything larger
+
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, v: float):
+        self.counts[bisect_left(self.buckets, v)] += 1
+        self.sum += v
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        # Linear interpolation inside the bucket holding the q-th observation
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, c in enumerate(self.counts):
+            if c and seen + c >= rank:
+                lo = self.buckets[i - 1] if i > 0 else 0.0
+                hi = self.buckets[i] if i < len(self.buckets) else self.buckets[-1]
+                return lo + (hi - lo) * (rank - seen) / c
+            seen += c
+        return self.buckets[-1]
+
+    def cumulative(self) -> List[int]:
+        out, total = [], 0
+        for c in self.counts:
+            total += c
+            out.append(total)
+        return out
+
+class Metrics:
+    def __init__(self):
+        self.hists: Dict[Tuple[str, Labels], Histogram] = {}
+        self.lock = threading.Lock()
+
+    def observe(self, name: str, labels: Labels, value: float):
+        key = (name, labels)
+        with self.lock:
+            h = self.hists.get(key)
+            if h is None:
+                h = self.hists[key] = Histogram(_BUCKETS[name])
+            h.observe(value)
+
+    def reset(self):
+        with self.lock:
+            self.hists.clear()
+
+    def snapshot(self) -> Dict[str, List[Dict]]:
+        out: Dict[str, List[Dict]] = {}
+        with self.lock:
+            for (name, labels), h in sorted(self.hists.items()):
+                out.setdefault(name, []).append({
+                    "labels": dict(labels),
+                    "count": h.count,
+                    "sum": h.sum,
+                    "p50": h.quantile(0.5),
+                    "p95": h.quantile(0.95),
+                    "p99": h.quantile(0.99),
+                    "buckets": dict(zip([*map(str, h.buckets), "+Inf"], h.cumulative())),
+                })
+        return out
+
+    def prometheus(self) -> str:
+        lines: List[str] = []
+        last = None
+        with self.lock:
+            for (name, labels), h in sorted(self.hists.items()):
+                if name != last:
+                    lines.append(f"# TYPE {name} histogram")
+                    last = name
+                base = ",".join(f'{k}="{v}"' for k, v in labels)
+                sep = "," if base else ""
+                for le, n in zip([*map(str, h.buckets), "+Inf"], h.cumulative()):
+                    lines.append(f'{name}_bucket{{{base}{sep}le="{le}"}} {n}')
+                lines.append(f"{name}_sum{{{base}}} {h.sum}")
+                lines.append(f"{name}_count{{{base}}} {h.count}")
+        return "\n".join(lines) + "\n"
+
+_METRICS = Metrics()
+_STEP: ContextVar[Optional[Dict[str, int]]] = ContextVar("quiz_step", default=None)
+_CP_BYTES: ContextVar[Optional[List[int]]] = ContextVar("quiz_checkpoint_bytes", default=None)
+
+def get_metrics() -> Metrics:
+    return _METRICS
+
+def dump_json() -> str:
+    return json.dumps(_METRICS.snapshot())
+
+def dump_prometheus() -> str:
+    return _METRICS.prometheus()
+
+def count(field: str, n: int = 1):
+    # Add to the current node step's counter; no-op outside an instrumented node
+    step = _STEP.get()
+    if step is not None:
+        step[field] += n
+
+def count_llm(usage: Optional[Dict]):
+    # One provider call; `usage` is the message's usage_metadata (absent if the provider sent none)
+    step = _STEP.get()
+    if step is not None:
+        step["llm_calls"] += 1
+        step["llm_tokens"] += (usage or {}).get("total_tokens", 0)
+
+def count_embed(texts: List[str]):
+    # One provider batch. The embeddings API response is not surfaced by the client, so tokens are
+    # estimated at ~4 characters each.
+    step = _STEP.get()
+    if step is not None:
+        step["embed_calls"] += 1
+        step["embed_tokens"] += sum(len(t) for t in texts) // 4
+
+def _finish(labels: Labels, t0: float, step: Dict[str, int]):
+    _METRICS.observe("quiz_node_seconds", labels, time.perf_counter() - t0)
+    for field in STEP_FIELDS:
+        _METRICS.observe(f"quiz_node_{field}", labels, step[field])
+
+def instrument(graph: str, node: str, fn: Callable) -> Callable:
+    # Wrap a graph node (sync or async) so each run is recorded as one step. Interrupts and errors
+    # propagate unchanged; the time up to them is still recorded.
+    if not METRICS_ENABLED:
+        return fn
+    labels = (("graph", graph), ("node", node))
+    if inspect.iscoroutinefunction(fn):
+        async def anode(state):
+            token = _STEP.set(dict.fromkeys(STEP_FIELDS, 0))
+            t0 = time.perf_counter()
+            try:
+                return await fn(state)
+            finally:
+                _finish(labels, t0, _STEP.get())
+                _STEP.reset(token)
+        return anode
+
+    def node(state):
+        token = _STEP.set(dict.fromkeys(STEP_FIELDS, 0))
+        t0 = time.perf_counter()
+        try:
+            return fn(state)
+        finally:
+            _finish(labels, t0, _STEP.get())
+            _STEP.reset(token)
+    return node
+
+def timed(name: str) -> Callable[[Callable], Callable]:
+    # Decorator: wall time of a function the nodes call, as quiz_call_seconds{fn=name}
+    def wrap(fn: Callable) -> Callable:
+        if not METRICS_ENABLED:
+            return fn
+        labels = (("fn", name),)
+        if inspect.iscoroutinefunction(fn):
+            @wraps(fn)
+            async def acall(*args, **kwargs):
+                t0 = time.perf_counter()
+                try:
+                    return await fn(*args, **kwargs)
+                finally:
+                    _METRICS.observe("quiz_call_seconds", labels, time.perf_counter() - t0)
+            return acall
+
+        @wraps(fn)
+        def call(*args, **kwargs):
+            t0 = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                _METRICS.observe("quiz_call_seconds", labels, time.perf_counter() - t0)
+        return call
+    return wrap
+
+class _MeasuredSerde:
+    # Wraps a saver's serializer; everything it produces inside a measured write is counted
+    def __init__(self, serde):
+        self.serde = serde
+
+    def dumps_typed(self, obj):
+        typ, data = self.serde.dumps_typed(obj)
+        box = _CP_BYTES.get()
+        if box is not None:
+            box[0] += len(data)
+        return typ, data
+
+    def __getattr__(self, name):
+        return getattr(self.serde, name)
+
+def _write_labels(op: str, args: tuple, kwargs: Dict) -> Labels:
+    # put_writes(config, writes, task_id, task_path): the path ends with the node that produced them
+    path = args[3] if len(args) > 3 else kwargs.get("task_path")
+    if op == "put_writes" and isinstance(path, str) and path:
+        return (("op", op), ("node", path.rsplit(", ", 1)[-1]))
+    return (("op", op),)
+
+def _measured(op: str, fn: Callable) -> Callable:
+    # wraps() keeps the saver's signature visible: langgraph checks it for `task_path`
+    @wraps(fn)
+    def call(*args, **kwargs):
+        if _CP_BYTES.get() is not None:  # nested (e.g. a saver's aput delegating to put)
+            return fn(*args, **kwargs)
+        box = [0]
+        token = _CP_BYTES.set(box)
+        t0 = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _CP_BYTES.reset(token)
+            labels = _write_labels(op, args, kwargs)
+            _METRICS.observe("quiz_checkpoint_seconds", labels, time.perf_counter() - t0)
+            _METRICS.observe("quiz_checkpoint_bytes", labels, box[0])
+    return call
+
+def _ameasured(op: str, fn: Callable) -> Callable:
+    @wraps(fn)
+    async def call(*args, **kwargs):
+        if _CP_BYTES.get() is not None:
+            return await fn(*args, **kwargs)
+        box = [0]
+        token = _CP_BYTES.set(box)
+        t0 = time.perf_counter()
+        try:
+            return await fn(*args, **kwargs)
+        finally:
+            _CP_BYTES.reset(token)
+            labels = _write_labels(op, args, kwargs)
+            _METRICS.observe("quiz_checkpoint_seconds", labels, time.perf_counter() - t0)
+            _METRICS.observe("quiz_checkpoint_bytes", labels, box[0])
+    return call
+
+def instrument_saver(saver):
+    # Measure checkpoint writes (serialized bytes and latency) on this saver instance. Writes run on
+    # the graph loop's background threads, so they are recorded per write, not inside the node step.
+    if not METRICS_ENABLED or isinstance(saver.serde, _MeasuredSerde):
+        return saver
+    saver.serde = _MeasuredSerde(saver.serde)
+    for op in ("put", "put_writes"):
+        setattr(saver, op, _measured(op, getattr(saver, op)))
+        setattr(saver, "a" + op, _ameasured(op, getattr(saver, "a" + op)))
+    return saver
+
+def _count_query(conn, cursor, statement, parameters, context, executemany):
+    count("db_queries")
+
+def _dump_at_exit():
+    with open(METRICS_DUMP_PATH, "w", encoding="utf-8") as f:
+        f.write(dump_prometheus() if METRICS_DUMP_PATH.endswith((".prom", ".txt")) else dump_json())
+
+if METRICS_ENABLED:
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+    # Every engine, including the sync side of the async one (run_sync keeps the node's context)
+    event.listen(Engine, "before_cursor_execute", _count_query)
+    if METRICS_DUMP_PATH:
+        atexit.register(_dump_at_exit)
@@ -1,88 +1,511 @@
-import hashlib, json
-from typing import List, Dict
-from sqlalchemy.orm import Session
-from langchain_openai import ChatOpenAI
-from .embeddings import embed_texts, max_cosine
-from .config import CHAT_MODEL, OPENAI_API_KEY, COSINE_THRESHOLD_HARD
-from .db import QuestionItem
-from .bank_index import BankANN
-
-def stable_item_id(stem: str) -> str:
-    return hashlib.sha256(stem.strip().lower().encode("utf-8")).hex()[:24]
-
-def llm_generate_mcqs(topic: str, subtopic: str, difficulty: str, k: int) -> List[Dict]:
-    llm = ChatOpenAI(model=CHAT_MODEL, temperature=0.2, api_key=OPENAI_API_KEY)
-    sys = "You are a finance instructor. Create precise MCQs with 4 choices and one correct answer."
-    usr = f"""
-Generate {k*2} MCQs for topic '{topic}', subtopic '{subtopic}', difficulty '{difficulty}'.
-Return JSON list: question, choices[10], answer_index (0-3), explanation.
-Ensure questions are semantically distinct; vary stems, numbers, and rationale.
-"""
-    resp = llm.invoke([{"role":"system","content":sys},{"role":"user","content":usr}])
-    return json.loads(resp.content)
-
-def select_unique_items_for_attempt(
-    db: Session,
-    topic: str,
-    subtopic: str,
-    difficulty: str,
-    needed: int,
-    attempt_seen_items: List[Dict],
-    bank_ann: BankANN | None = None,
-) -> List[Dict]:
-    collected: List[Dict] = []
-    seen_vecs = [it["embedding"] for it in attempt_seen_items if it.get("embedding")]
-
-    # Prefer bank by metadata
-    bank_rows = db.query(QuestionItem).filter_by(topic=topic, subtopic=subtopic, difficulty=difficulty).limit(needed*3).all()
-    for r in bank_rows:
-        if len(collected) >= needed:
-            break
-        vec = r.embedding
-        if vec:
-            sim = max_cosine(vec, seen_vecs)
-            if sim >= COSINE_THRESHOLD_HARD:
-                continue
-            collected.append({
-                "item_id": r.item_id,
-                "question": r.payload["question"],
-                "choices": r.payload["choices"],
-                "correct_index": r.payload["answer_index"],
-                "embedding": vec
-            })
-            seen_vecs.append(vec)
-
-    if len(collected) < needed:
-        gen_k = max(needed - len(collected), 3)
-        raw = llm_generate_mcqs(topic, subtopic, difficulty, gen_k)
-        stems = [it["question"] for it in raw]
-        gen_vecs = embed_texts(stems)
-        for it, v in zip(raw, gen_vecs):
-            sim = max_cosine(v, seen_vecs)
-            if sim >= COSINE_THRESHOLD_HARD:
-                continue
-            it["item_id"] = stable_item_id(it["question"])
-            it["embedding"] = v
-            collected.append({
-                "item_id": it["item_id"],
-                "question": it["question"],
-                "choices": it["choices"],
-                "correct_index": it["answer_index"],
-                "embedding": v
-            })
-            seen_vecs.append(v)
-        # Upsert generated into bank
-        for it in collected:
-            if not db.query(QuestionItem).filter_by(item_id=it["item_id"]).first():
-                db.add(QuestionItem(
-                    item_id=it["item_id"],
-                    source="generated",
-                    topic=topic,
-                    subtopic=subtopic,
-                    difficulty=difficulty,
-                    payload={"question": it["question"], "choices": it["choices"], "answer_index": it["correct_index"], "explanation": ""},
-                    embedding=it["embedding"]
-                ))
-        db.commit()
-
-    return collected[:needed]
+import hashlib, json
+import asyncio
+import logging
+import threading
+import contextvars
+import numpy as np
+from functools import partial
+from typing import AsyncIterator, Iterator, List, Dict
+from sqlalchemy.orm import Session
+from langchain_openai import ChatOpenAI
+from .embeddings import embed_texts, aembed_texts, SeenMatrix
+from .config import CHAT_MODEL, OPENAI_API_KEY, COSINE_THRESHOLD_HARD, MCQ_CACHE_TTL_S, MCQ_STREAM
+from .db import SessionLocal, get_async_session, arun, QuestionItem, vec_to_blob, bulk_upsert_question_items, iter_question_items
+from .bank_index import BankANN, get_bank_ann
+from .replenish import Replenisher, get_replenisher
+from .coalesce import SharedStream, SingleFlight
+from .json_stream import JSONArrayStream
+from .metrics import count, count_llm, timed
+
+log = logging.getLogger(__name__)
+
+_MCQ_FLIGHT = SingleFlight(MCQ_CACHE_TTL_S)
+
+def stable_item_id(stem: str) -> str:
+    return hashlib.sha256(stem.strip().lower().encode("utf-8")).hexdigest()[:24]
+
+def _mcq_messages(topic: str, subtopic: str, difficulty: str, k: int) -> List[Dict]:
+    sys = "You are a finance instructor. Create precise MCQs with 4 choices and one correct answer."
+    usr = f"""
+Generate {k*2} MCQs for topic '{topic}', subtopic '{subtopic}', difficulty '{difficulty}'.
+Return JSON list: question, choices[10], answer_index (0-3), explanation.
+Ensure questions are semantically distinct; vary stems, numbers, and rationale.
+"""
+    return [{"role":"system","content":sys},{"role":"user","content":usr}]
+
+def _call_llm_mcqs(topic: str, subtopic: str, difficulty: str, k: int) -> List[Dict]:
+    llm = ChatOpenAI(model=CHAT_MODEL, temperature=0.2, api_key=OPENAI_API_KEY)
+    resp = llm.invoke(_mcq_messages(topic, subtopic, difficulty, k))
+    count_llm(resp.usage_metadata)
+    return json.loads(resp.content)
+
+@timed("llm_generate_mcqs")
+def llm_generate_mcqs(topic: str, subtopic: str, difficulty: str, k: int, fresh: bool = False) -> List[Dict]:
+    # Single-flight per pool: concurrent callers share one LLM request, whose result is reused for
+    # MCQ_CACHE_TTL_S. fresh=True (background replenishment) skips the cache but still joins a call in flight.
+    raw = _MCQ_FLIGHT.do((topic, subtopic, difficulty), k, partial(_call_llm_mcqs, topic, subtopic, difficulty, k), fresh)
+    return [dict(it) for it in raw]
+
+async def _acall_llm_mcqs(topic: str, subtopic: str, difficulty: str, k: int) -> List[Dict]:
+    llm = ChatOpenAI(model=CHAT_MODEL, temperature=0.2, api_key=OPENAI_API_KEY)
+    resp = await llm.ainvoke(_mcq_messages(topic, subtopic, difficulty, k))
+    count_llm(resp.usage_metadata)
+    return json.loads(resp.content)
+
+@timed("llm_generate_mcqs")
+async def allm_generate_mcqs(topic: str, subtopic: str, difficulty: str, k: int, fresh: bool = False) -> List[Dict]:
+    # llm_generate_mcqs for the async nodes; shares the same single-flight entries with sync callers
+    raw = await _MCQ_FLIGHT.ado((topic, subtopic, difficulty), k, partial(_acall_llm_mcqs, topic, subtopic, difficulty, k), fresh)
+    return [dict(it) for it in raw]
+
+def _valid_mcq(it) -> bool:
+    return (isinstance(it, dict) and isinstance(it.get("question"), str) and isinstance(it.get("choices"), list)
+            and isinstance(it.get("answer_index"), int))
+
+def _stream_llm_mcqs(topic: str, subtopic: str, difficulty: str, k: int) -> Iterator[Dict]:
+    # Same prompt as llm_generate_mcqs, but yields each MCQ as soon as its JSON object is complete
+    llm = ChatOpenAI(model=CHAT_MODEL, temperature=0.2, api_key=OPENAI_API_KEY)
+    parser = JSONArrayStream()
+    count("llm_calls")
+    for chunk in llm.stream(_mcq_messages(topic, subtopic, difficulty, k)):
+        if chunk.usage_metadata:  # final chunk, when the provider reports usage
+            count("llm_tokens", chunk.usage_metadata.get("total_tokens", 0))
+        for it in parser.feed(chunk.content if isinstance(chunk.content, str) else ""):
+            if _valid_mcq(it):
+                yield it
+
+async def _astream_llm_mcqs(topic: str, subtopic: str, difficulty: str, k: int) -> AsyncIterator[Dict]:
+    llm = ChatOpenAI(model=CHAT_MODEL, temperature=0.2, api_key=OPENAI_API_KEY)
+    parser = JSONArrayStream()
+    count("llm_calls")
+    async for chunk in llm.astream(_mcq_messages(topic, subtopic, difficulty, k)):
+        if chunk.usage_metadata:
+            count("llm_tokens", chunk.usage_metadata.get("total_tokens", 0))
+        for it in parser.feed(chunk.content if isinstance(chunk.content, str) else ""):
+            if _valid_mcq(it):
+                yield it
+
+def llm_stream_mcqs(topic: str, subtopic: str, difficulty: str, k: int, ann: BankANN | None = None,
+                    fresh: bool = False) -> SharedStream:
+    # Single-flight like llm_generate_mcqs, item by item: one producer thread per pool streams the
+    # response and publishes each MCQ as it parses; concurrent callers read the same items and later
+    # ones replay them for MCQ_CACHE_TTL_S. The producer banks the whole batch when the stream ends,
+    # so readers may stop as soon as they have enough.
+    def start(shared: SharedStream):
+        ctx = contextvars.copy_context()  # the call is counted in the leading caller's node step
+        threading.Thread(target=ctx.run, args=(_pump, shared, topic, subtopic, difficulty, k, ann), daemon=True).start()
+    return _MCQ_FLIGHT.stream((topic, subtopic, difficulty), k, start, fresh)
+
+def allm_stream_mcqs(topic: str, subtopic: str, difficulty: str, k: int, ann: BankANN | None = None,
+                     fresh: bool = False) -> SharedStream:
+    # llm_stream_mcqs for the async nodes (read it with async for); the producer is a task on the running
+    # loop, and sync and async callers of a pool share one stream
+    def start(shared: SharedStream):
+        _spawn(_apump(shared, topic, subtopic, difficulty, k, ann))
+    return _MCQ_FLIGHT.stream((topic, subtopic, difficulty), k, start, fresh)
+
+def _pump(shared: SharedStream, topic: str, subtopic: str, difficulty: str, k: int, ann: BankANN | None):
+    try:
+        for it in _stream_llm_mcqs(topic, subtopic, difficulty, k):
+            shared.publish(it)
+    except Exception as e:
+        shared.finish(e)  # raised to the readers
+        return
+    except BaseException as e:
+        shared.finish(e)
+        raise
+    shared.finish()
+    _bank_stream_rest(shared.items, topic, subtopic, difficulty, ann or get_bank_ann())
+
+async def _apump(shared: SharedStream, topic: str, subtopic: str, difficulty: str, k: int, ann: BankANN | None):
+    try:
+        async for it in _astream_llm_mcqs(topic, subtopic, difficulty, k):
+            shared.publish(it)
+    except Exception as e:
+        shared.finish(e)
+        return
+    except BaseException as e:
+        shared.finish(e)
+        raise
+    shared.finish()
+    await _abank_stream_rest(shared.items, topic, subtopic, difficulty, ann or await asyncio.to_thread(get_bank_ann))
+
+@timed("generate_into_bank")
+def generate_into_bank(db: Session, topic: str, subtopic: str, difficulty: str, k: int,
+                       bank_ann: BankANN | None = None, fresh: bool = False) -> int:
+    # Generate MCQs and bank the ones that are novel vs. the shared bank index and vs. each other
+    ann = bank_ann or get_bank_ann()
+    return bank_raw_items(db, ann, topic, subtopic, difficulty, llm_generate_mcqs(topic, subtopic, difficulty, k, fresh=fresh))
+
+@timed("generate_into_bank")
+async def agenerate_into_bank(adb, topic: str, subtopic: str, difficulty: str, k: int,
+                             bank_ann: BankANN | None = None, fresh: bool = False) -> int:
+    # generate_into_bank over an AsyncSession: provider calls are awaited, ORM work runs via arun
+    ann = bank_ann or await asyncio.to_thread(get_bank_ann)
+    raw = await allm_generate_mcqs(topic, subtopic, difficulty, k, fresh=fresh)
+    if not raw:
+        return 0
+    vecs = await aembed_texts([it["question"] for it in raw])
+    return await abank_raw_items(adb, ann, topic, subtopic, difficulty, raw, vecs)
+
+def bank_raw_items(db: Session, ann: BankANN, topic: str, subtopic: str, difficulty: str, raw: List[Dict],
+                   vecs: List[List[float]] | None = None) -> int:
+    # `vecs` are the stems' embeddings when the caller already has them
+    if not raw:
+        return 0
+    if vecs is None:
+        vecs = embed_texts([it["question"] for it in raw])
+    items = _novel_items(ann, topic, subtopic, difficulty, raw, vecs)
+    if not items:
+        return 0
+    new_ids = _upsert_raw(db, topic, subtopic, difficulty, raw, vecs, items)
+    if new_ids:
+        ann.add(new_ids, [vecs[items[item_id]] for item_id in new_ids], [(topic, subtopic, difficulty)] * len(new_ids))
+    return len(new_ids)
+
+async def abank_raw_items(adb, ann: BankANN, topic: str, subtopic: str, difficulty: str, raw: List[Dict],
+                          vecs: List[List[float]] | None = None) -> int:
+    # bank_raw_items over an AsyncSession: index lookups and adds run in a worker thread, only the upsert via arun
+    if not raw:
+        return 0
+    if vecs is None:
+        vecs = await aembed_texts([it["question"] for it in raw])
+    items = await asyncio.to_thread(_novel_items, ann, topic, subtopic, difficulty, raw, vecs)
+    if not items:
+        return 0
+    new_ids = await arun(adb, _upsert_raw, topic, subtopic, difficulty, raw, vecs, items)
+    if new_ids:
+        await asyncio.to_thread(ann.add, new_ids, [vecs[items[item_id]] for item_id in new_ids],
+                                [(topic, subtopic, difficulty)] * len(new_ids))
+    return len(new_ids)
+
+def _novel_items(ann: BankANN, topic: str, subtopic: str, difficulty: str, raw: List[Dict],
+                 vecs: List[List[float]]) -> Dict[str, int]:
+    # Stems novel vs. the bank index and vs. each other, as item_id -> position in `raw`
+    dup_of = ann.near_duplicates(vecs, topic, subtopic, difficulty, COSINE_THRESHOLD_HARD)
+    novel = [i for i, d in enumerate(dup_of) if d is None]
+    keep = []
+    if novel:
+        keep = [novel[j] for j in SeenMatrix().take_unique([vecs[i] for i in novel], COSINE_THRESHOLD_HARD, len(novel))]
+    return {stable_item_id(raw[i]["question"]): i for i in keep}
+
+def _upsert_raw(db: Session, topic: str, subtopic: str, difficulty: str, raw: List[Dict], vecs: List[List[float]],
+                items: Dict[str, int]) -> List[str]:
+    new_ids = bulk_upsert_question_items(db, [{
+        "item_id": item_id,
+        "source": "generated",
+        "topic": topic,
+        "subtopic": subtopic,
+        "difficulty": difficulty,
+        "payload": {"question": raw[i]["question"], "choices": raw[i]["choices"], "answer_index": raw[i]["answer_index"],
+                    "explanation": raw[i].get("explanation", "")},
+        "embedding_f32": vec_to_blob(vecs[i]),
+    } for item_id, i in items.items()])
+    db.commit()
+    return new_ids
+
+def _unbanked(ann: BankANN, raw: List[Dict]) -> List[Dict]:
+    return [it for it in raw if stable_item_id(it["question"]) not in ann.known]
+
+def _bank_stream_rest(raw: List[Dict], topic: str, subtopic: str, difficulty: str, ann: BankANN):
+    # Bank a finished generation stream off the request path; items its readers already banked are skipped
+    raw = _unbanked(ann, raw)
+    if not raw:
+        return
+    db = SessionLocal()
+    try:
+        bank_raw_items(db, ann, topic, subtopic, difficulty, raw)
+    except Exception:
+        db.rollback()
+        log.exception("Banking streamed MCQs failed for %s", (topic, subtopic, difficulty))
+    finally:
+        db.close()
+
+_TASKS: set = set()  # strong references to in-flight background tasks (the loop only keeps weak ones)
+
+async def _abank_stream_rest(raw: List[Dict], topic: str, subtopic: str, difficulty: str, ann: BankANN):
+    # _bank_stream_rest on the event loop, with its own session
+    try:
+        raw = _unbanked(ann, raw)
+        if raw:
+            vecs = await aembed_texts([it["question"] for it in raw])
+            async with get_async_session()() as adb:
+                await abank_raw_items(adb, ann, topic, subtopic, difficulty, raw, vecs)
+    except Exception:
+        log.exception("Banking streamed MCQs failed for %s", (topic, subtopic, difficulty))
+
+def _spawn(coro):
+    task = asyncio.create_task(coro)
+    _TASKS.add(task)
+    task.add_done_callback(_TASKS.discard)
+
+def _anchor_text(topic: str, subtopic: str, difficulty: str) -> str:
+    return f"{topic}: {subtopic} ({difficulty})"
+
+def topic_anchor(topic: str, subtopic: str, difficulty: str) -> List[float]:
+    # Query vector for candidate retrieval from the bank index (served from the embedding cache after first use)
+    return embed_texts([_anchor_text(topic, subtopic, difficulty)])[0]
+
+def _item_dict(r: QuestionItem) -> Dict:
+    return {
+        "item_id": r.item_id,
+        "question": r.payload["question"],
+        "choices": r.payload["choices"],
+        "correct_index": r.payload["answer_index"],
+        "embedding": r.vector.tolist()
+    }
+
+def _bank_items(db: Session, item_ids: List[str]) -> List[Dict]:
+    # One IN query; result keeps the order of item_ids (ANN rank)
+    if not item_ids:
+        return []
+    rows = {r.item_id: r for r in db.query(QuestionItem).filter(QuestionItem.item_id.in_(item_ids)).all()}
+    return [_item_dict(rows[i]) for i in item_ids if i in rows and rows[i].vector is not None]
+
+def _take_unique(seen: SeenMatrix, items: List[Dict], limit: int) -> List[Dict]:
+    if not items or limit <= 0:
+        return []
+    vecs = np.stack([it["embedding"] for it in items])
+    return [items[i] for i in seen.take_unique(vecs, COSINE_THRESHOLD_HARD, limit)]
+
+def _bank_hits(ann: BankANN, topic: str, subtopic: str, difficulty: str, needed: int, served_ids: set,
+               anchor: List[float] | None = None) -> List[str]:
+    # Ids of the bank items nearest the subtopic anchor within the metadata partition
+    if needed <= 0 or ann.partition(topic, subtopic, difficulty) is None:
+        return []
+    if anchor is None:
+        anchor = topic_anchor(topic, subtopic, difficulty)
+    return ann.search_filtered(anchor, topic, subtopic, difficulty, topk=needed * 3 + len(served_ids))
+
+def _from_bank(db: Session, ann: BankANN, topic: str, subtopic: str, difficulty: str, needed: int,
+               served_ids: set, seen: SeenMatrix, hits: List[str] | None = None) -> List[Dict]:
+    # The ANN `hits` (_bank_hits, if not given) first; if dedup against `seen` leaves that short, the
+    # rest of the pool is streamed page by page until enough unique items are found, so generation is
+    # only paid for once the bank has nothing left for this attempt.
+    if needed <= 0:
+        return []
+    if hits is None:
+        hits = _bank_hits(ann, topic, subtopic, difficulty, needed, served_ids)
+    out: List[Dict] = []
+    tried = set(served_ids)
+    if hits:
+        out += _take_unique(seen, _bank_items(db, [i for i in hits if i not in tried]), needed)
+        tried.update(hits)
+    if len(out) < needed:
+        for rows in iter_question_items(db, topic, subtopic, difficulty):
+            page = [_item_dict(r) for r in rows if r.item_id not in tried and r.vector is not None]
+            out += _take_unique(seen, page, needed - len(out))
+            if len(out) >= needed:
+                break
+    return out
+
+def _accept_generated(db: Session, ann: BankANN, topic: str, subtopic: str, difficulty: str, raw: List[Dict],
+                      taken: set, seen: SeenMatrix, gen_seen: SeenMatrix,
+                      gen_vecs: List[List[float]] | None = None) -> List[Dict]:
+    # Embed a group of generated MCQs and keep those unique vs. the attempt (`seen`) and vs. generated
+    # items accepted earlier (`gen_seen`). A stem that near-duplicates a banked item is replaced by that
+    # item (never re-banked). Accepted ids go into `taken`, accepted vectors into `gen_seen`.
+    if not raw:
+        return []
+    if gen_vecs is None:
+        gen_vecs = embed_texts([it["question"] for it in raw])
+    dup_of = ann.near_duplicates(gen_vecs, topic, subtopic, difficulty, COSINE_THRESHOLD_HARD)
+    existing = _bank_items(db, [d for d in set(dup_of) if d and d not in taken])
+    return _accept(raw, gen_vecs, dup_of, existing, taken, seen, gen_seen)
+
+async def _aaccept_generated(adb, ann: BankANN, topic: str, subtopic: str, difficulty: str, raw: List[Dict],
+                             taken: set, seen: SeenMatrix, gen_seen: SeenMatrix,
+                             gen_vecs: List[List[float]]) -> List[Dict]:
+    # _accept_generated with the index lookup in a worker thread; only the banked rows are read via arun
+    if not raw:
+        return []
+    dup_of = await asyncio.to_thread(ann.near_duplicates, gen_vecs, topic, subtopic, difficulty, COSINE_THRESHOLD_HARD)
+    dups = [d for d in set(dup_of) if d and d not in taken]
+    existing = await arun(adb, _bank_items, dups) if dups else []
+    return _accept(raw, gen_vecs, dup_of, existing, taken, seen, gen_seen)
+
+def _accept(raw: List[Dict], gen_vecs: List[List[float]], dup_of: List[str | None], existing: List[Dict],
+            taken: set, seen: SeenMatrix, gen_seen: SeenMatrix) -> List[Dict]:
+    existing = {it["item_id"]: it for it in existing}
+    cands: List[Dict] = []
+    for it, v, dup in zip(raw, gen_vecs, dup_of):
+        if dup is None:
+            cands.append({
+                "item_id": stable_item_id(it["question"]),
+                "question": it["question"],
+                "choices": it["choices"],
+                "correct_index": it["answer_index"],
+                "embedding": v
+            })
+        elif dup in existing:
+            cands.append(existing.pop(dup))
+    cands = [c for c in cands if c["item_id"] not in taken]
+    if not cands:
+        return []
+    base = seen.max_sims([c["embedding"] for c in cands])
+    accepted = []
+    for c, sim in zip(cands, base):
+        if sim >= COSINE_THRESHOLD_HARD or gen_seen.max_sim(c["embedding"]) >= COSINE_THRESHOLD_HARD:
+            continue
+        gen_seen.add([c["embedding"]])
+        taken.add(c["item_id"])
+        accepted.append(c)
+    return accepted
+
+def _bank_collected(db: Session, ann: BankANN, topic: str, subtopic: str, difficulty: str, items: List[Dict]):
+    # Upsert generated into bank in one statement per batch
+    fresh_items = {it["item_id"]: it for it in items if it["item_id"] not in ann.known}
+    new_ids = _upsert_collected(db, topic, subtopic, difficulty, fresh_items)
+    # Visible to the next retrieval in this process without a rebuild
+    if new_ids:
+        ann.add(new_ids, [fresh_items[i]["embedding"] for i in new_ids], [(topic, subtopic, difficulty)] * len(new_ids))
+
+async def _abank_collected(adb, ann: BankANN, topic: str, subtopic: str, difficulty: str, items: List[Dict]):
+    fresh_items = {it["item_id"]: it for it in items if it["item_id"] not in ann.known}
+    if not fresh_items:
+        return
+    new_ids = await arun(adb, _upsert_collected, topic, subtopic, difficulty, fresh_items)
+    if new_ids:
+        await asyncio.to_thread(ann.add, new_ids, [fresh_items[i]["embedding"] for i in new_ids],
+                                [(topic, subtopic, difficulty)] * len(new_ids))
+
+def _upsert_collected(db: Session, topic: str, subtopic: str, difficulty: str, fresh_items: Dict[str, Dict]) -> List[str]:
+    new_ids = bulk_upsert_question_items(db, [{
+        "item_id": it["item_id"],
+        "source": "generated",
+        "topic": topic,
+        "subtopic": subtopic,
+        "difficulty": difficulty,
+        "payload": {"question": it["question"], "choices": it["choices"], "answer_index": it["correct_index"], "explanation": ""},
+        "embedding_f32": vec_to_blob(it["embedding"]),
+    } for it in fresh_items.values()])
+    db.commit()
+    return new_ids
+
+@timed("select_unique_items_for_attempt")
+def select_unique_items_for_attempt(
+    db: Session,
+    topic: str,
+    subtopic: str,
+    difficulty: str,
+    needed: int,
+    attempt_seen_items: List[Dict],
+    bank_ann: BankANN | None = None,
+    seen: SeenMatrix | None = None,
+    bank_only: bool = False,
+) -> List[Dict]:
+    # `seen` is the attempt's dedup matrix; it is extended in place with every item returned.
+    # `bank_ann` defaults to the process-wide index, which is updated inline with any items banked here.
+    # `bank_only` (speculative prefetch): serve from the bank only, without replenishment or generation.
+    if seen is None:
+        seen = SeenMatrix.from_items(attempt_seen_items)
+    ann = bank_ann or get_bank_ann()
+    served_ids = {it["item_id"] for it in attempt_seen_items}
+
+    # Report how much of the pool this attempt has left; below the low watermark it is topped up in the background
+    replenisher = get_replenisher()
+    job = None
+    if replenisher is not None and not bank_only:
+        part = ann.partition(topic, subtopic, difficulty)
+        job = replenisher.observe((topic, subtopic, difficulty), (len(part.ids) if part else 0) - len(served_ids))
+
+    # Prefer bank
+    collected = _from_bank(db, ann, topic, subtopic, difficulty, needed, served_ids, seen)
+    if len(collected) < needed and Replenisher.finished(job):
+        # Pool ran dry but a top-up has just landed; a job still running is not waited for
+        collected += _from_bank(db, ann, topic, subtopic, difficulty, needed - len(collected),
+                                served_ids | {it["item_id"] for it in collected}, seen)
+
+    if len(collected) < needed and not bank_only:
+        n_bank = len(collected)
+        gen_k = max(needed - len(collected), 3)
+        taken = served_ids | {it["item_id"] for it in collected}
+        gen_seen = SeenMatrix()  # generated items accepted so far (not yet part of the attempt)
+        if MCQ_STREAM:
+            # Embed and dedup each MCQ as it streams in and stop reading once enough are accepted (the
+            # stream's producer banks the rest). A shared stream may be one this attempt already drew
+            # from; if it falls short, pay for a fresh one.
+            for fresh in (False, True):
+                for it in llm_stream_mcqs(topic, subtopic, difficulty, gen_k, ann, fresh=fresh):
+                    collected += _accept_generated(db, ann, topic, subtopic, difficulty, [it], taken, seen, gen_seen)
+                    if len(collected) >= needed:
+                        break
+                if len(collected) >= needed:
+                    break
+        else:
+            # A coalesced result may be one this attempt already drew from; if it falls short, pay for a fresh call
+            for fresh in (False, True):
+                raw = llm_generate_mcqs(topic, subtopic, difficulty, gen_k, fresh=fresh)
+                collected += _accept_generated(db, ann, topic, subtopic, difficulty, raw, taken, seen, gen_seen)
+                if len(collected) >= needed:
+                    break
+        _bank_collected(db, ann, topic, subtopic, difficulty, collected[n_bank:])
+        # Every unique generated item is banked, but only the ones served join the attempt's matrix
+        served_gen = [it["embedding"] for it in collected[n_bank:needed]]
+        if served_gen:
+            seen.add(served_gen)
+
+    return collected[:needed]
+
+@timed("select_unique_items_for_attempt")
+async def aselect_unique_items_for_attempt(
+    adb,
+    topic: str,
+    subtopic: str,
+    difficulty: str,
+    needed: int,
+    attempt_seen_items: List[Dict],
+    bank_ann: BankANN | None = None,
+    seen: SeenMatrix | None = None,
+) -> List[Dict]:
+    # select_unique_items_for_attempt over an AsyncSession `adb`: the LLM, embedding and replenishment
+    # waits are awaited, ANN searches and adds run in a worker thread, and only ORM work goes through arun
+    if seen is None:
+        seen = SeenMatrix.from_items(attempt_seen_items)
+    ann = bank_ann or await asyncio.to_thread(get_bank_ann)
+    served_ids = {it["item_id"] for it in attempt_seen_items}
+
+    replenisher = get_replenisher()
+    job = None
+    if replenisher is not None:
+        part = ann.partition(topic, subtopic, difficulty)
+        job = replenisher.observe((topic, subtopic, difficulty), (len(part.ids) if part else 0) - len(served_ids))
+
+    anchor = (await aembed_texts([_anchor_text(topic, subtopic, difficulty)]))[0]
+    hits = await asyncio.to_thread(_bank_hits, ann, topic, subtopic, difficulty, needed, served_ids, anchor)
+    collected = await arun(adb, _from_bank, ann, topic, subtopic, difficulty, needed, served_ids, seen, hits)
+    if len(collected) < needed and Replenisher.finished(job):
+        tried = served_ids | {it["item_id"] for it in collected}
+        hits = await asyncio.to_thread(_bank_hits, ann, topic, subtopic, difficulty, needed - len(collected), tried, anchor)
+        collected += await arun(adb, _from_bank, ann, topic, subtopic, difficulty, needed - len(collected),
+                                tried, seen, hits)
+
+    if len(collected) < needed:
+        n_bank = len(collected)
+        gen_k = max(needed - len(collected), 3)
+        taken = served_ids | {it["item_id"] for it in collected}
+        gen_seen = SeenMatrix()
+        if MCQ_STREAM:
+            for fresh in (False, True):
+                async for it in allm_stream_mcqs(topic, subtopic, difficulty, gen_k, ann, fresh=fresh):
+                    vecs = await aembed_texts([it["question"]])
+                    collected += await _aaccept_generated(adb, ann, topic, subtopic, difficulty, [it],
+                                                          taken, seen, gen_seen, vecs)
+                    if len(collected) >= needed:
+                        break
+                if len(collected) >= needed:
+                    break
+        else:
+            for fresh in (False, True):
+                raw = await allm_generate_mcqs(topic, subtopic, difficulty, gen_k, fresh=fresh)
+                vecs = await aembed_texts([it["question"] for it in raw]) if raw else []
+                collected += await _aaccept_generated(adb, ann, topic, subtopic, difficulty, raw,
+                                                      taken, seen, gen_seen, vecs)
+                if len(collected) >= needed:
+                    break
+        await _abank_collected(adb, ann, topic, subtopic, difficulty, collected[n_bank:])
+        served_gen = [it["embedding"] for it in collected[n_bank:needed]]
+        if served_gen:
+            seen.add(served_gen)
+
+    return collected[:needed]
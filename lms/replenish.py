@@ -0,0 +1,98 @@
+import time
+import logging
+import threading
+from functools import partial
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, Optional, Tuple
+from sqlalchemy.orm import Session
+from .db import SessionLocal
+from .config import (
+    REPLENISH_ENABLED, REPLENISH_LOW_WATERMARK, REPLENISH_BATCH, REPLENISH_WORKERS, REPLENISH_COOLDOWN_S
+)
+
+log = logging.getLogger(__name__)
+
+PoolKey = Tuple[str, str, str]  # (topic, subtopic, difficulty)
+
+class Replenisher:
+    # Background question generation per pool. The live path reports how many items are still unused
+    # for the attempt in hand; below the low watermark a job is queued (at most one in flight per pool)
+    # that generates, embeds, dedups and banks `batch` new items off the request thread. A pool whose
+    # job banks nothing (e.g. every generated item is a near-duplicate) or fails is left alone for
+    # `cooldown` seconds, so a saturated pool does not start a paid LLM job on every request.
+
+    def __init__(self, generate: Callable[[Session, str, str, str, int], int],
+                 low_watermark: int = REPLENISH_LOW_WATERMARK, batch: int = REPLENISH_BATCH,
+                 workers: int = REPLENISH_WORKERS, cooldown: float = REPLENISH_COOLDOWN_S):
+        self.generate = generate  # (db, topic, subtopic, difficulty, k) -> number of items banked
+        self.low_watermark = low_watermark
+        self.batch = batch
+        self.cooldown = cooldown
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="replenish")
+        self.inflight: Dict[PoolKey, Future] = {}
+        self.idle_until: Dict[PoolKey, float] = {}  # pools in cooldown -> monotonic time it ends
+        self.lock = threading.Lock()
+
+    def observe(self, key: PoolKey, unused: int) -> Optional[Future]:
+        # Returns the pool's in-flight job, if any
+        with self.lock:
+            fut = self.inflight.get(key)
+            if fut is not None or unused >= self.low_watermark:
+                return fut
+            if time.monotonic() < self.idle_until.get(key, 0.0):
+                return None
+            fut = self.inflight[key] = self.executor.submit(self._run, key)
+            return fut
+
+    def _run(self, key: PoolKey) -> int:
+        db = SessionLocal()
+        n = 0
+        try:
+            n = self.generate(db, *key, self.batch)
+            return n
+        except Exception:
+            # Nobody may be waiting on this job; report it and retry after the cooldown
+            db.rollback()
+            log.exception("Replenishment failed for %s", key)
+            return 0
+        finally:
+            db.close()
+            with self.lock:
+                self.inflight.pop(key, None)
+                if n:
+                    self.idle_until.pop(key, None)
+                else:
+                    self.idle_until[key] = time.monotonic() + self.cooldown
+
+    @staticmethod
+    def finished(fut: Optional[Future]) -> int:
+        # Items banked by a job returned by observe() if it has already finished; never blocks.
+        # The live path does not wait on a running job and generates inline instead (non-streaming
+        # generation joins the job's LLM call through the single-flight rather than paying twice).
+        if fut is None or not fut.done() or fut.cancelled():
+            return 0
+        return fut.result()
+
+    def shutdown(self, wait: bool = True):
+        self.executor.shutdown(wait=wait, cancel_futures=not wait)
+
+_REPLENISHER: Optional[Replenisher] = None
+_LOCK = threading.Lock()
+
+def get_replenisher() -> Optional[Replenisher]:
+    global _REPLENISHER
+    if not REPLENISH_ENABLED:
+        return None
+    if _REPLENISHER is None:
+        with _LOCK:
+            if _REPLENISHER is None:
+                from .quiz import generate_into_bank  # quiz imports this module
+                _REPLENISHER = Replenisher(partial(generate_into_bank, fresh=True))
+    return _REPLENISHER
+
+def shutdown_replenisher(wait: bool = True):
+    global _REPLENISHER
+    with _LOCK:
+        if _REPLENISHER is not None:
+            _REPLENISHER.shutdown(wait)
+            _REPLENISHER = None
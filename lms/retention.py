@@ -0,0 +1,153 @@
+import time
+import sqlite3
+import argparse
+from typing import Dict, List, Optional
+from langgraph.checkpoint.base import BaseCheckpointSaver
+from .config import CHECKPOINT_TTL_S, CHECKPOINT_SWEEP_BATCH, CHECKPOINT_VACUUM_PAGES, SQLITE_CP_PATH
+
+# Checkpoint retention: finished attempts are compacted to their final checkpoint, abandoned threads
+# expire after CHECKPOINT_TTL_S, and the SQLite file gives freed pages back in small steps.
+# Redis expires keys on its own (see checkpointer.py), so only compaction applies there.
+
+_UUID_EPOCH = 0x01B21DD213814000  # 1582-10-15 in 100ns ticks before the unix epoch
+
+def checkpoint_time(checkpoint_id: str) -> float:
+    # Checkpoint ids are uuid6, so the write time (unix seconds) is encoded in the id itself
+    h = checkpoint_id.replace("-", "")
+    return (((int(h[:12], 16) << 12) | int(h[13:16], 16)) - _UUID_EPOCH) / 1e7
+
+def _sqlite_conn(cp: BaseCheckpointSaver) -> Optional[sqlite3.Connection]:
+    conn = getattr(cp, "conn", None)
+    if not isinstance(conn, sqlite3.Connection):
+        return None
+    cp.setup()  # tables are created lazily on first use
+    return conn
+
+def compact_thread(cp: BaseCheckpointSaver, thread_id: str) -> bool:
+    # Keep only the thread's latest checkpoint (its final state once the attempt is persisted)
+    try:
+        cp.prune([thread_id], strategy="keep_latest")
+        return True
+    except NotImplementedError:
+        pass
+    latest = cp.get_tuple({"configurable": {"thread_id": thread_id}})
+    if latest is None:
+        return False
+    ns = latest.config["configurable"].get("checkpoint_ns", "")
+    # get_tuple returns materialized channel_values, so the re-put checkpoint is self-contained
+    cp.delete_thread(thread_id)
+    cp.put({"configurable": {"thread_id": thread_id, "checkpoint_ns": ns}}, latest.checkpoint, latest.metadata,
+           latest.checkpoint["channel_versions"])
+    return True
+
+async def acompact_thread(cp: BaseCheckpointSaver, thread_id: str) -> bool:
+    # compact_thread through the saver's async API
+    try:
+        await cp.aprune([thread_id], strategy="keep_latest")
+        return True
+    except NotImplementedError:
+        pass
+    latest = await cp.aget_tuple({"configurable": {"thread_id": thread_id}})
+    if latest is None:
+        return False
+    ns = latest.config["configurable"].get("checkpoint_ns", "")
+    await cp.adelete_thread(thread_id)
+    await cp.aput({"configurable": {"thread_id": thread_id, "checkpoint_ns": ns}}, latest.checkpoint, latest.metadata,
+                  latest.checkpoint["channel_versions"])
+    return True
+
+def thread_heads(cp: BaseCheckpointSaver) -> Dict[str, str]:
+    # thread_id -> id of its newest checkpoint
+    conn = _sqlite_conn(cp)
+    if conn is not None:
+        with cp.lock:
+            return dict(conn.execute("SELECT thread_id, MAX(checkpoint_id) FROM checkpoints GROUP BY thread_id"))
+    storage = getattr(cp, "storage", None)
+    if isinstance(storage, dict):
+        return {t: max(cid for ns in nss.values() for cid in ns) for t, nss in storage.items()
+                if any(nss.values())}
+    heads: Dict[str, str] = {}
+    for tup in cp.list(None):
+        c = tup.config["configurable"]
+        heads[c["thread_id"]] = max(heads.get(c["thread_id"], ""), c["checkpoint_id"])
+    return heads
+
+def delete_threads(cp: BaseCheckpointSaver, thread_ids: List[str], batch: int = CHECKPOINT_SWEEP_BATCH) -> int:
+    conn = _sqlite_conn(cp)
+    if conn is None:
+        for t in thread_ids:
+            cp.delete_thread(t)
+        return len(thread_ids)
+    for i in range(0, len(thread_ids), batch):
+        rows = [(t,) for t in thread_ids[i:i + batch]]
+        with cp.lock, conn:  # one transaction per batch
+            conn.executemany("DELETE FROM checkpoints WHERE thread_id = ?", rows)
+            conn.executemany("DELETE FROM writes WHERE thread_id = ?", rows)
+    return len(thread_ids)
+
+def expire_threads(cp: BaseCheckpointSaver, ttl: float = CHECKPOINT_TTL_S, now: Optional[float] = None) -> int:
+    # Delete threads with no checkpoint written in the last `ttl` seconds; ttl <= 0 keeps everything
+    if ttl <= 0:
+        return 0
+    cutoff = (now or time.time()) - ttl
+    stale = [t for t, cid in thread_heads(cp).items() if checkpoint_time(cid) < cutoff]
+    return delete_threads(cp, stale)
+
+def vacuum_sqlite(path: str = SQLITE_CP_PATH, pages: int = CHECKPOINT_VACUUM_PAGES, pause: float = 0.05,
+                  convert: bool = False) -> int:
+    # Return free pages to the filesystem `pages` at a time, so writers are never blocked for long.
+    # A file created without incremental auto-vacuum has nothing to free this way; convert=True switches
+    # it over with a one-time full VACUUM, which rewrites the file and blocks writers while it runs.
+    conn = sqlite3.connect(path, isolation_level=None, timeout=30)
+    try:
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            if convert:
+                conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+                conn.execute("VACUUM")
+            return 0
+        freed = 0
+        free = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        while free:
+            conn.executescript(f"PRAGMA incremental_vacuum({min(free, pages)});")  # execute() frees only one page
+            left = conn.execute("PRAGMA freelist_count").fetchone()[0]
+            if left >= free:
+                break
+            freed += free - left
+            free = left
+            time.sleep(pause)
+        return freed
+    finally:
+        conn.close()
+
+def _sqlite_path(cp: BaseCheckpointSaver) -> Optional[str]:
+    conn = _sqlite_conn(cp)
+    if conn is None:
+        return None
+    with cp.lock:
+        return conn.execute("PRAGMA database_list").fetchone()[2] or None  # the file this saver has open
+
+def run_retention(cp: BaseCheckpointSaver, ttl: float = CHECKPOINT_TTL_S) -> Dict:
+    # The periodic pass: expiry plus incremental vacuum only, never a full VACUUM
+    report = {"expired": expire_threads(cp, ttl), "vacuumed_pages": 0}
+    path = _sqlite_path(cp)
+    if path:
+        report["vacuumed_pages"] = vacuum_sqlite(path)
+    return report
+
+def main():
+    from .checkpointer import get_checkpointer
+    ap = argparse.ArgumentParser(description="Expire abandoned quiz threads and compact the checkpoint store.")
+    ap.add_argument("--ttl", type=float, default=CHECKPOINT_TTL_S, help="seconds since a thread's last checkpoint")
+    ap.add_argument("--convert-vacuum", action="store_true",
+                    help="one-time full VACUUM enabling incremental auto-vacuum on an existing SQLite store "
+                         "(blocks writers while it runs)")
+    args = ap.parse_args()
+    cp = get_checkpointer()
+    if args.convert_vacuum:
+        path = _sqlite_path(cp)
+        if path:
+            vacuum_sqlite(path, convert=True)
+    print(run_retention(cp, args.ttl))
+
+if __name__ == "__main__":
+    main()
@@ -1,51 +1,298 @@
-import os
-import numpy as np
-import faiss
-from typing import List, Tuple
-from sqlalchemy.orm import Session
-from .db import SessionLocal, QuestionItem
-from .config import FAISS_DIR
-
-class BankANN:
-    def __init__(self, dim: int):
-        self.dim = dim
-        self.index = faiss.IndexFlatIP(dim)  # cosine via normalized vectors
-        self.ids: List[str] = []
-        self.meta: List[Tuple[str, str, str]] = []
-
-    def add(self, ids: List[str], vecs: List[List[float]], metas: List[Tuple[str,str,str]]):
-        X = np.array(vecs, dtype=np.float32)
-        faiss.normalize_L2(X)
-        self.index.add(X)
-        self.ids.extend(ids)
-        self.meta.extend(metas)
-
-    def search_filtered(self, q_vec: List[float], topic: str, subtopic: str, difficulty: str, topk: int = 50):
-        X = np.array([q_vec], dtype=np.float32)
-        faiss.normalize_L2(X)
-        D, I = self.index.search(X, topk)
-        hits = []
-        for idx in I:
-            if idx == -1:
-                continue
-            t, st, diff = self.meta[idx]
-            if (t == topic) and (st == subtopic) and (diff == difficulty):
-                hits.append(self.ids[idx])
-        return hits
-
-def build_bank_ann(dim: int = 1536) -> BankANN:
-    os.makedirs(FAISS_DIR, exist_ok=True)
-    ann = BankANN(dim)
-    db: Session = SessionLocal()
-    rows = db.query(QuestionItem).all()
-    if not rows:
-        return ann
-    ids, vecs, metas = [], [], []
-    for r in rows:
-        if r.embedding:
-            ids.append(r.item_id)
-            vecs.append(r.embedding)
-            metas.append((r.topic, r.subtopic, r.difficulty))
-    if vecs:
-        ann.add(ids, vecs, metas)
-    return ann
+import os
+import time
+import shutil
+import threading
+import numpy as np
+import faiss
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy.orm import Session
+from .db import SessionLocal, QuestionItem
+from .config import (
+    EMBED_DIM, FAISS_DIR, BANK_ANN_SYNC_S, BANK_INDEX_TYPE, BANK_INDEX_MIN_TRAIN, BANK_TRAIN_SAMPLE, BANK_IVF_NLIST, BANK_PQ_M,
+    BANK_HNSW_M, BANK_NPROBE, BANK_EF_SEARCH
+)
+
+PartKey = Tuple[str, str, str]  # (topic, subtopic, difficulty)
+
+CURRENT_FILE = "CURRENT"  # names the active snapshot directory
+STATE_FILE = "state.npy"  # [dim, watermark]
+KEYS_FILE = "keys.npy"
+OFFSETS_FILE = "offsets.npy"
+IDS_FILE = "ids.npy"
+KEEP_SNAPSHOTS = 2
+INDEX_TYPES = ("flat", "ivf_flat", "ivf_pq", "hnsw")
+
+def _nlist(n: int) -> int:
+    # IVF wants ~39+ training points per list
+    nlist = BANK_IVF_NLIST or int(4 * np.sqrt(n))
+    return int(max(1, min(nlist, n // 39)))
+
+def _pq_m(dim: int) -> int:
+    return max(m for m in range(1, min(BANK_PQ_M, dim) + 1) if dim % m == 0)
+
+def make_index(kind: str, dim: int, n_train: int = 0):
+    # Inner-product indexes over L2-normalized vectors (cosine similarity)
+    if kind == "flat":
+        return faiss.IndexFlatIP(dim)
+    if kind == "hnsw":
+        return faiss.IndexHNSWFlat(dim, BANK_HNSW_M, faiss.METRIC_INNER_PRODUCT)
+    if kind == "ivf_flat":
+        return faiss.IndexIVFFlat(faiss.IndexFlatIP(dim), dim, _nlist(n_train), faiss.METRIC_INNER_PRODUCT)
+    if kind == "ivf_pq":
+        return faiss.IndexIVFPQ(faiss.IndexFlatIP(dim), dim, _nlist(n_train), _pq_m(dim), 8, faiss.METRIC_INNER_PRODUCT)
+    raise ValueError(f"Unknown BANK_INDEX_TYPE '{kind}'; expected one of {INDEX_TYPES}")
+
+def train_index(kind: str, X: np.ndarray, sample: int = BANK_TRAIN_SAMPLE, seed: int = 0):
+    # Train on a random sample of the (normalized) vectors, then add all of them
+    index = make_index(kind, X.shape[1], min(len(X), sample))
+    if not index.is_trained:
+        rng = np.random.default_rng(seed)
+        pick = rng.choice(len(X), size=min(len(X), sample), replace=False) if len(X) > sample else slice(None)
+        index.train(np.ascontiguousarray(X[pick]))
+    index.add(X)
+    return index
+
+def search_params(index, nprobe: Optional[int] = None, ef_search: Optional[int] = None):
+    # Per-query knobs, so concurrent searches never mutate shared index state
+    if isinstance(index, faiss.IndexIVF):
+        return faiss.SearchParametersIVF(nprobe=nprobe or BANK_NPROBE)
+    if isinstance(index, faiss.IndexHNSW):
+        return faiss.SearchParametersHNSW(efSearch=ef_search or BANK_EF_SEARCH)
+    return None
+
+def _index_kind(index) -> str:
+    if isinstance(index, faiss.IndexIVFPQ):
+        return "ivf_pq"
+    if isinstance(index, faiss.IndexIVF):
+        return "ivf_flat"
+    if isinstance(index, faiss.IndexHNSW):
+        return "hnsw"
+    return "flat"
+
+class Partition:
+    # One sub-index per metadata key; row i of `index` is item `ids[i]`.
+    # Starts flat (exact) and is rebuilt as `kind` once it holds BANK_INDEX_MIN_TRAIN vectors.
+    def __init__(self, dim: int, index=None, ids: Optional[List[str]] = None, mmap_path: Optional[str] = None,
+                 kind: str = BANK_INDEX_TYPE):
+        self.index = index if index is not None else faiss.IndexFlatIP(dim)  # cosine via normalized vectors
+        self.ids: List[str] = ids or []
+        self.mmap_path = mmap_path  # file backing a memory-mapped (read-only) index
+        self.kind = kind
+
+    @property
+    def mmapped(self) -> bool:
+        return self.mmap_path is not None
+
+    def add(self, ids: List[str], X: np.ndarray):
+        if self.mmapped:
+            # A memory-mapped index is read-only; load it into RAM before the first write
+            # (re-read rather than clone: mapped IVF lists cannot be cloned)
+            self.index = faiss.read_index(self.mmap_path)
+            self.mmap_path = None
+        self.index.add(X)
+        self.ids.extend(ids)
+        if self.kind != "flat" and _index_kind(self.index) == "flat" and len(self.ids) >= BANK_INDEX_MIN_TRAIN:
+            self.index = train_index(self.kind, self.index.reconstruct_n(0, self.index.ntotal))
+
+    def search(self, X: np.ndarray, k: int, nprobe: Optional[int] = None, ef_search: Optional[int] = None):
+        k = min(k, len(self.ids))
+        if k == 0:
+            return np.zeros((len(X), 0), dtype=np.float32), np.zeros((len(X), 0), dtype=np.int64)
+        params = search_params(self.index, nprobe, ef_search)
+        return self.index.search(X, k, params=params) if params is not None else self.index.search(X, k)
+
+class BankANN:
+    def __init__(self, dim: int, index_type: str = BANK_INDEX_TYPE):
+        if index_type not in INDEX_TYPES:
+            raise ValueError(f"Unknown BANK_INDEX_TYPE '{index_type}'; expected one of {INDEX_TYPES}")
+        self.dim = dim
+        self.index_type = index_type
+        self.parts: Dict[PartKey, Partition] = {}
+        self.known: set = set()  # item ids already indexed; inline adds and catch-up may overlap
+        self.watermark = 0  # highest QuestionItem.id already in the index
+        self.synced_at = time.monotonic()
+        self.lock = threading.RLock()
+
+    def __len__(self) -> int:
+        return sum(len(p.ids) for p in self.parts.values())
+
+    def partition(self, topic: str, subtopic: str, difficulty: str) -> Optional[Partition]:
+        return self.parts.get((topic, subtopic, difficulty))
+
+    def add(self, ids: List[str], vecs, metas: List[PartKey]) -> int:
+        X = np.array(vecs, dtype=np.float32)  # copy: normalize_L2 works in place
+        if not len(X) or X.shape[1] != self.dim:
+            return 0
+        faiss.normalize_L2(X)
+        with self.lock:
+            groups: Dict[PartKey, List[int]] = {}
+            for i, m in enumerate(metas):
+                if ids[i] not in self.known:
+                    self.known.add(ids[i])
+                    groups.setdefault(tuple(m), []).append(i)
+            for key, rows in groups.items():
+                part = self.parts.get(key)
+                if part is None:
+                    part = self.parts[key] = Partition(self.dim, kind=self.index_type)
+                part.add([ids[i] for i in rows], X[rows])
+            return sum(len(rows) for rows in groups.values())
+
+    def search_vecs(self, vecs, topic: str, subtopic: str, difficulty: str, topk: int = 50,
+                    nprobe: Optional[int] = None, ef_search: Optional[int] = None) -> Tuple[np.ndarray, List[List[str]]]:
+        # Batched partition search: cosine scores (n, <=topk) and the matching item ids per query
+        X = np.atleast_2d(np.array(vecs, dtype=np.float32))
+        with self.lock:
+            part = self.partition(topic, subtopic, difficulty)
+            if part is None or not len(X) or X.shape[1] != self.dim:
+                return np.zeros((len(X), 0), dtype=np.float32), [[] for _ in range(len(X))]
+            faiss.normalize_L2(X)
+            D, I = part.search(X, topk, nprobe=nprobe, ef_search=ef_search)
+            return D, [[part.ids[idx] for idx in row if idx != -1] for row in I]
+
+    def search_filtered(self, q_vec: List[float], topic: str, subtopic: str, difficulty: str, topk: int = 50,
+                        nprobe: Optional[int] = None, ef_search: Optional[int] = None):
+        # Searches only the matching partition, so it returns min(topk, partition size) hits
+        return self.search_vecs([q_vec], topic, subtopic, difficulty, topk, nprobe, ef_search)[1][0]
+
+    def near_duplicates(self, vecs, topic: str, subtopic: str, difficulty: str, threshold: float) -> List[Optional[str]]:
+        # For each vector, the id of an indexed item at cosine >= threshold, or None if it is novel
+        D, ids = self.search_vecs(vecs, topic, subtopic, difficulty, 1)
+        return [row[0] if row and d[0] >= threshold else None for d, row in zip(D, ids)]
+
+    def save(self, path: str = FAISS_DIR):
+        # Each save writes a fresh snapshot directory, then flips CURRENT with an atomic rename.
+        # Indices, ids and watermark are serialized together under the lock (adds and catch-up wait
+        # for that, not for the disk writes), so the snapshot is consistent.
+        with self.lock:
+            keys = list(self.parts)
+            blobs = [faiss.serialize_index(self.parts[key].index) for key in keys]
+            part_ids = [list(self.parts[key].ids) for key in keys]
+            state = np.array([self.dim, self.watermark], dtype=np.int64)
+        os.makedirs(path, exist_ok=True)
+        name = f"snap-{time.time_ns()}"
+        snap = os.path.join(path, name)
+        os.makedirs(snap)
+        offsets = np.zeros(len(keys) + 1, dtype=np.int64)
+        ids: List[str] = []
+        for j, blob in enumerate(blobs):
+            blob.tofile(os.path.join(snap, f"p{j}.index"))  # same bytes faiss.write_index produces
+            ids.extend(part_ids[j])
+            offsets[j + 1] = len(ids)
+        np.save(os.path.join(snap, STATE_FILE), state)
+        np.save(os.path.join(snap, KEYS_FILE), np.array(keys, dtype=np.str_).reshape(-1, 3))
+        np.save(os.path.join(snap, OFFSETS_FILE), offsets)
+        np.save(os.path.join(snap, IDS_FILE), np.array(ids, dtype=np.str_))
+        tmp = os.path.join(path, CURRENT_FILE + ".tmp")
+        with open(tmp, "w") as f:
+            f.write(name)
+        os.replace(tmp, os.path.join(path, CURRENT_FILE))
+        snaps = sorted(d for d in os.listdir(path) if d.startswith("snap-"))
+        for old in snaps[:-KEEP_SNAPSHOTS]:
+            shutil.rmtree(os.path.join(path, old), ignore_errors=True)
+
+    @classmethod
+    def load(cls, path: str = FAISS_DIR, mmap: bool = True, index_type: str = BANK_INDEX_TYPE) -> Optional["BankANN"]:
+        current = os.path.join(path, CURRENT_FILE)
+        if not os.path.exists(current):
+            return None
+        with open(current) as f:
+            snap = os.path.join(path, f.read().strip())
+        dim, watermark = np.load(os.path.join(snap, STATE_FILE)).tolist()
+        keys = np.load(os.path.join(snap, KEYS_FILE)).tolist()
+        offsets = np.load(os.path.join(snap, OFFSETS_FILE))
+        ids = np.load(os.path.join(snap, IDS_FILE), mmap_mode="r")
+        ann = cls(int(dim), index_type)
+        ann.watermark = int(watermark)
+        for j, key in enumerate(keys):
+            fname = os.path.join(snap, f"p{j}.index")
+            index, mapped = _read_index(fname, mmap)
+            part = ann.parts[tuple(key)] = Partition(ann.dim, index, ids[offsets[j]:offsets[j + 1]].tolist(),
+                                                     mmap_path=fname if mapped else None, kind=index_type)
+            ann.known.update(part.ids)
+        return ann
+
+    def catch_up(self, db: Session, batch: int = 5000) -> int:
+        # Add bank rows newer than the watermark (rows already added inline are skipped)
+        added = 0
+        self.synced_at = time.monotonic()
+        while True:
+            rows = _embedding_rows(db, self.watermark, batch)
+            if not rows:
+                return added
+            with self.lock:
+                self.watermark = max(self.watermark, rows[-1][0])
+                rows = [r for r in rows if len(r[5]) == self.dim * 4]
+                if rows:
+                    added += self.add([r[1] for r in rows], _stack(rows, self.dim), [(r[2], r[3], r[4]) for r in rows])
+
+def _read_index(fname: str, mmap: bool):
+    if mmap:
+        try:
+            return faiss.read_index(fname, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY), True
+        except RuntimeError:
+            pass  # index type without mmap support
+    return faiss.read_index(fname), False
+
+def _embedding_rows(db: Session, after_id: int = 0, limit: Optional[int] = None):
+    q = (
+        db.query(QuestionItem.id, QuestionItem.item_id, QuestionItem.topic, QuestionItem.subtopic,
+                 QuestionItem.difficulty, QuestionItem.embedding_f32)
+        .filter(QuestionItem.id > after_id, QuestionItem.embedding_f32.isnot(None))
+        .order_by(QuestionItem.id)
+    )
+    return q.limit(limit).all() if limit else q.all()
+
+def _stack(rows, dim: int) -> np.ndarray:
+    # One contiguous buffer -> (n, dim) float32 view, no per-float Python objects
+    return np.frombuffer(b"".join(r[5] for r in rows), dtype="<f4").reshape(len(rows), dim)
+
+def build_bank_ann(dim: int = EMBED_DIM, index_type: str = BANK_INDEX_TYPE) -> BankANN:
+    os.makedirs(FAISS_DIR, exist_ok=True)
+    ann = BankANN(dim, index_type)
+    db: Session = SessionLocal()
+    try:
+        ann.catch_up(db)
+    finally:
+        db.close()
+    return ann
+
+def load_or_build_bank_ann(dim: int = EMBED_DIM, path: str = FAISS_DIR, mmap: bool = True,
+                           index_type: str = BANK_INDEX_TYPE) -> BankANN:
+    # Worker startup: map the saved index, apply rows added since it was written, re-save if it grew
+    ann = BankANN.load(path, mmap=mmap, index_type=index_type)
+    if ann is None or ann.dim != dim:
+        ann = build_bank_ann(dim, index_type)
+        ann.save(path)
+        return ann
+    db: Session = SessionLocal()
+    try:
+        if ann.catch_up(db):
+            ann.save(path)
+    finally:
+        db.close()
+    return ann
+
+_SHARED: Optional[BankANN] = None
+_SHARED_LOCK = threading.Lock()
+
+def get_bank_ann(dim: int = EMBED_DIM) -> BankANN:
+    # One index per process, loaded on first use; rows committed by other processes are
+    # picked up every BANK_ANN_SYNC_S, rows written in this process are added inline by the writer.
+    global _SHARED
+    if _SHARED is None:
+        with _SHARED_LOCK:
+            if _SHARED is None:
+                _SHARED = load_or_build_bank_ann(dim)
+    ann = _SHARED
+    if time.monotonic() - ann.synced_at >= BANK_ANN_SYNC_S:
+        db: Session = SessionLocal()
+        try:
+            ann.catch_up(db)
+        finally:
+            db.close()
+    return ann
+
+def reset_bank_ann():
+    global _SHARED
+    with _SHARED_LOCK:
+        _SHARED = None
@@ -0,0 +1,245 @@
+import os
+import argparse
+from datetime import datetime
+from typing import Dict, List, Iterator, Optional, Tuple
+import numpy as np
+from sqlalchemy.orm import Session
+from .db import SessionLocal, AttemptResponse, QuestionItem
+from .irt import log_sigmoid, quadrature_grid
+from .item_bank import update_cached_params
+from .config import (
+    CALIB_DIR, CALIB_QUAD_POINTS, CALIB_MAX_ITER, CALIB_TOL, CALIB_CHUNK_SIZE, CALIB_MIN_RESPONSES
+)
+
+STATS_FILE = "irt_stats.npz"
+
+# Bounds keep sparse or perfect-score items from drifting to infinity
+A_MIN, A_MAX = 0.2, 4.0
+B_MIN, B_MAX = -4.0, 4.0
+PRIOR_SD_A = 1.0   # normal prior on a, centred at 1
+PRIOR_SD_C = 3.0   # normal prior on the intercept c = -a*b
+
+def iter_responses(db: Session, after_id: int = 0, chunk: int = CALIB_CHUNK_SIZE) -> Iterator[List[Tuple]]:
+    # Keyset pagination over answered responses: (id, attempt_id, item_id, correct)
+    last = after_id
+    while True:
+        rows = (
+            db.query(AttemptResponse.id, AttemptResponse.attempt_id, AttemptResponse.item_id, AttemptResponse.correct)
+            .filter(AttemptResponse.id > last, AttemptResponse.correct.isnot(None))
+            .order_by(AttemptResponse.id)
+            .limit(chunk)
+            .all()
+        )
+        if not rows:
+            return
+        yield rows
+        last = rows[-1][0]
+
+class ResponseMatrix:
+    # Sparse (person, item, y) triplets; a person is one quiz attempt
+    def __init__(self, item_ids: Optional[List[str]] = None):
+        self.item_ids: List[str] = list(item_ids or [])
+        self.item_index: Dict[str, int] = {it: j for j, it in enumerate(self.item_ids)}
+        self.person_index: Dict[int, int] = {}
+        self.last_response_id = 0
+        self.n_responses = 0
+        self._rows: List[np.ndarray] = []
+        self._cols: List[np.ndarray] = []
+        self._ys: List[np.ndarray] = []
+
+    def add_chunk(self, rows: List[Tuple]):
+        n = len(rows)
+        r = np.empty(n, dtype=np.int32)
+        c = np.empty(n, dtype=np.int32)
+        y = np.empty(n, dtype=np.int8)
+        for k, (rid, attempt_id, item_id, correct) in enumerate(rows):
+            p = self.person_index.setdefault(attempt_id, len(self.person_index))
+            j = self.item_index.get(item_id)
+            if j is None:
+                j = self.item_index[item_id] = len(self.item_ids)
+                self.item_ids.append(item_id)
+            r[k], c[k], y[k] = p, j, 1 if correct else 0
+        self._rows.append(r); self._cols.append(c); self._ys.append(y)
+        self.last_response_id = max(self.last_response_id, rows[-1][0])
+        self.n_responses += n
+
+    def finalize(self):
+        rows = np.concatenate(self._rows) if self._rows else np.empty(0, dtype=np.int32)
+        order = np.argsort(rows, kind="stable")
+        self.rows = rows[order]
+        self.cols = np.concatenate(self._cols)[order] if self._cols else np.empty(0, dtype=np.int32)
+        self.y = np.concatenate(self._ys)[order] if self._ys else np.empty(0, dtype=np.int8)
+        self._rows, self._cols, self._ys = [], [], []
+        # starts[p]:starts[p+1] is the response range of person p
+        self.starts = np.searchsorted(self.rows, np.arange(self.n_persons + 1))
+        return self
+
+    @property
+    def n_persons(self) -> int:
+        return len(self.person_index)
+
+    @property
+    def n_items(self) -> int:
+        return len(self.item_ids)
+
+def e_step(rm: ResponseMatrix, a: np.ndarray, b: np.ndarray, nodes: np.ndarray, log_w: np.ndarray,
+           chunk: int = CALIB_CHUNK_SIZE):
+    # Expected counts n[j, q] (persons at node q answering j) and r[j, q] (of those, correct)
+    I, Q = rm.n_items, len(nodes)
+    z = a[:, None] * (nodes[None, :] - b[:, None])
+    logP, logQ = log_sigmoid(z), log_sigmoid(-z)
+    n = np.zeros((I, Q)); r = np.zeros((I, Q))
+    loglik = 0.0
+    starts = rm.starts
+    p0 = 0
+    while p0 < rm.n_persons:
+        s0 = starts[p0]
+        p1 = max(p0 + 1, int(np.searchsorted(starts, s0 + chunk, side="right")) - 1)
+        p1 = min(p1, rm.n_persons)
+        s1 = starts[p1]
+        cols, y = rm.cols[s0:s1], rm.y[s0:s1]
+        contrib = np.where(y[:, None] == 1, logP[cols], logQ[cols])
+        L = np.add.reduceat(contrib, starts[p0:p1] - s0, axis=0) + log_w
+        m = L.max(axis=1, keepdims=True)
+        post = np.exp(L - m)
+        tot = post.sum(axis=1, keepdims=True)
+        loglik += float((m + np.log(tot)).sum())
+        post /= tot
+        pr = post[rm.rows[s0:s1] - p0]
+        yw = y.astype(np.float64)
+        for q in range(Q):
+            n[:, q] += np.bincount(cols, weights=pr[:, q], minlength=I)
+            r[:, q] += np.bincount(cols, weights=pr[:, q] * yw, minlength=I)
+        p0 = p1
+    return n, r, loglik
+
+def m_step(n: np.ndarray, r: np.ndarray, nodes: np.ndarray, a: np.ndarray, b: np.ndarray, iters: int = 8):
+    # Batched Newton-Raphson on z = a*theta + c for every item at once (closed-form 2x2 solves)
+    a = a.astype(np.float64).copy()
+    c = -a * b
+    X = nodes[None, :]
+    ia2, ic2 = 1.0 / PRIOR_SD_A ** 2, 1.0 / PRIOR_SD_C ** 2
+    for _ in range(iters):
+        P = 1.0 / (1.0 + np.exp(-(a[:, None] * X + c[:, None])))
+        resid = r - n * P
+        W = n * P * (1.0 - P)
+        ga = (resid * X).sum(axis=1) - (a - 1.0) * ia2
+        gc = resid.sum(axis=1) - c * ic2
+        haa = -(W * X * X).sum(axis=1) - ia2
+        hac = -(W * X).sum(axis=1)
+        hcc = -W.sum(axis=1) - ic2
+        det = haa * hcc - hac * hac
+        a = np.clip(a - (hcc * ga - hac * gc) / det, A_MIN, A_MAX)
+        c = c - (haa * gc - hac * ga) / det
+    return a, np.clip(-c / a, B_MIN, B_MAX)
+
+def fit_em(rm: ResponseMatrix, a0: np.ndarray, b0: np.ndarray, base_n: np.ndarray, base_r: np.ndarray,
+           n_points: int = CALIB_QUAD_POINTS, max_iter: int = CALIB_MAX_ITER, tol: float = CALIB_TOL,
+           min_responses: int = CALIB_MIN_RESPONSES):
+    nodes, w = quadrature_grid(n_points)
+    log_w = np.log(w)
+    a, b = a0.copy(), b0.copy()
+    counts = np.bincount(rm.cols, minlength=rm.n_items) + base_n.sum(axis=1)
+    fit_mask = counts >= min_responses
+    prev = None
+    iterations = 0  # max_iter=0 only scores the starting parameters
+    for iterations in range(1, max_iter + 1):
+        n, r, ll = e_step(rm, a, b, nodes, log_w)
+        a_new, b_new = m_step(n + base_n, r + base_r, nodes, a, b)
+        a = np.where(fit_mask, a_new, a)
+        b = np.where(fit_mask, b_new, b)
+        if prev is not None and abs(ll - prev) <= tol * abs(prev):
+            break
+        prev = ll
+    n, r, ll = e_step(rm, a, b, nodes, log_w)
+    return {"a": a, "b": b, "n": n + base_n, "r": r + base_r, "fit_mask": fit_mask,
+            "loglik": ll, "iterations": iterations, "nodes": nodes}
+
+def load_stats(path: Optional[str] = None) -> Optional[Dict]:
+    path = path or os.path.join(CALIB_DIR, STATS_FILE)
+    if not os.path.exists(path):
+        return None
+    with np.load(path, allow_pickle=False) as z:
+        return {k: z[k] for k in z.files}
+
+def save_stats(stats: Dict, path: Optional[str] = None):
+    os.makedirs(CALIB_DIR, exist_ok=True)
+    path = path or os.path.join(CALIB_DIR, STATS_FILE)
+    tmp = path + ".tmp.npz"
+    np.savez_compressed(tmp, **stats)
+    os.replace(tmp, path)
+
+def load_item_params(db: Session, item_ids: List[str], chunk: int = 900):
+    a = np.ones(len(item_ids)); b = np.zeros(len(item_ids))
+    pk = np.full(len(item_ids), -1, dtype=np.int64)
+    pos = {it: j for j, it in enumerate(item_ids)}
+    for i in range(0, len(item_ids), chunk):
+        rows = (
+            db.query(QuestionItem.id, QuestionItem.item_id, QuestionItem.a, QuestionItem.b)
+            .filter(QuestionItem.item_id.in_(item_ids[i:i + chunk]))
+            .all()
+        )
+        for rid, item_id, ra, rb in rows:
+            j = pos[item_id]
+            pk[j] = rid
+            a[j] = ra if ra is not None else 1.0
+            b[j] = rb if rb is not None else 0.0
+    return a, b, pk
+
+def write_item_params(db: Session, pk: np.ndarray, a: np.ndarray, b: np.ndarray, chunk: int = 5000) -> int:
+    keep = pk >= 0
+    now = datetime.utcnow()  # lets cached pools in other processes refresh only these rows
+    mappings = [{"id": int(i), "a": float(x), "b": float(y), "params_updated_at": now}
+                for i, x, y in zip(pk[keep], a[keep], b[keep])]
+    for i in range(0, len(mappings), chunk):
+        db.bulk_update_mappings(QuestionItem, mappings[i:i + chunk])
+    db.commit()
+    return len(mappings)
+
+def calibrate(full: bool = False, db: Optional[Session] = None) -> Dict:
+    db = db or SessionLocal()
+    stats = None if full else load_stats()
+    if stats is not None and len(stats["nodes"]) != CALIB_QUAD_POINTS:
+        stats = None  # grid changed; stored counts no longer line up
+    after_id = int(stats["last_response_id"]) if stats is not None else 0
+    rm = ResponseMatrix(stats["item_ids"].tolist() if stats is not None else None)
+    for rows in iter_responses(db, after_id=after_id):
+        rm.add_chunk(rows)
+    if not rm.n_responses:
+        return {"responses": 0, "items_updated": 0, "last_response_id": after_id}
+    rm.finalize()
+
+    # Incremental runs fold new attempts onto the stored expected counts; those counts were
+    # computed under the previous parameters, so run with full=True periodically.
+    base_n = np.zeros((rm.n_items, CALIB_QUAD_POINTS)); base_r = np.zeros_like(base_n)
+    if stats is not None:
+        k = len(stats["item_ids"])
+        base_n[:k], base_r[:k] = stats["n"], stats["r"]
+    a0, b0, pk = load_item_params(db, rm.item_ids)
+    fit = fit_em(rm, a0, b0, base_n, base_r)
+    touched = fit["fit_mask"]
+    updated = write_item_params(db, np.where(touched, pk, -1), fit["a"], fit["b"])
+    save_stats({
+        "item_ids": np.array(rm.item_ids, dtype=np.str_),
+        "n": fit["n"], "r": fit["r"], "nodes": fit["nodes"],
+        "last_response_id": np.int64(rm.last_response_id),
+    })
+    ids = [it for it, t in zip(rm.item_ids, touched) if t]
+    update_cached_params(ids, fit["a"][touched], fit["b"][touched])
+    return {
+        "responses": rm.n_responses,
+        "persons": rm.n_persons,
+        "items_updated": updated,
+        "iterations": fit["iterations"],
+        "loglik": fit["loglik"],
+        "last_response_id": rm.last_response_id,
+    }
+
+def main():
+    ap = argparse.ArgumentParser(description="Calibrate 2PL item parameters from attempt responses.")
+    ap.add_argument("--full", action="store_true", help="ignore the checkpoint and refit from all responses")
+    args = ap.parse_args()
+    print(calibrate(full=args.full))
+
+if __name__ == "__main__":
+    main()
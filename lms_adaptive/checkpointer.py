@@ -0,0 +1,101 @@
+import atexit
+import threading
+from contextlib import AsyncExitStack, ExitStack
+from typing import Optional
+from langgraph.checkpoint.base import BaseCheckpointSaver
+from .metrics import instrument_saver
+from .config import CHECKPOINTER_BACKEND, REDIS_URL, SQLITE_CP_PATH, CHECKPOINT_TTL_S, CHECKPOINT_POOL_SIZE
+
+# One checkpointer per process, shared by every compiled graph and request. The savers'
+# from_conn_string() are context managers: they are entered once here and exited on shutdown.
+# Async graphs get their own saver (aget_checkpointer), bound to the event loop that opened it.
+
+_SAVER: Optional[BaseCheckpointSaver] = None
+_STACK: Optional[ExitStack] = None
+_LOCK = threading.Lock()
+_ASAVER: Optional[BaseCheckpointSaver] = None
+_ASTACK: Optional[AsyncExitStack] = None
+
+def _open(stack: ExitStack) -> BaseCheckpointSaver:
+    if CHECKPOINTER_BACKEND == "redis":
+        from redis import Redis, ConnectionPool
+        from langgraph.checkpoint.redis import RedisSaver
+        pool = ConnectionPool.from_url(REDIS_URL, max_connections=CHECKPOINT_POOL_SIZE)
+        stack.callback(pool.disconnect)
+        # Redis expires idle threads itself; reads refresh the TTL so an attempt in progress is kept
+        ttl = {"default_ttl": CHECKPOINT_TTL_S / 60, "refresh_on_read": True} if CHECKPOINT_TTL_S > 0 else None
+        saver = stack.enter_context(RedisSaver.from_conn_string(redis_client=Redis(connection_pool=pool), ttl=ttl))
+        saver.setup()
+        return saver
+    if CHECKPOINTER_BACKEND == "sqlite":
+        from langgraph.checkpoint.sqlite import SqliteSaver
+        # One connection (check_same_thread=False) serialized by the saver's own lock
+        saver = stack.enter_context(SqliteSaver.from_conn_string(SQLITE_CP_PATH))
+        saver.setup()
+        return saver
+    from langgraph.checkpoint.memory import InMemorySaver
+    return InMemorySaver()
+
+def get_checkpointer() -> BaseCheckpointSaver:
+    global _SAVER, _STACK
+    if _SAVER is None:
+        with _LOCK:
+            if _SAVER is None:
+                stack = ExitStack()
+                try:
+                    saver = instrument_saver(_open(stack))
+                except BaseException:
+                    stack.close()
+                    raise
+                _STACK, _SAVER = stack, saver
+    return _SAVER
+
+def shutdown_checkpointer():
+    # Closes the saver's connections; the next get_checkpointer() opens a fresh one
+    global _SAVER, _STACK
+    with _LOCK:
+        stack, _SAVER, _STACK = _STACK, None, None
+    if stack is not None:
+        stack.close()
+
+async def _aopen(stack: AsyncExitStack) -> BaseCheckpointSaver:
+    if CHECKPOINTER_BACKEND == "redis":
+        from redis.asyncio import Redis, ConnectionPool
+        from langgraph.checkpoint.redis.aio import AsyncRedisSaver
+        pool = ConnectionPool.from_url(REDIS_URL, max_connections=CHECKPOINT_POOL_SIZE)
+        stack.push_async_callback(pool.disconnect)
+        ttl = {"default_ttl": CHECKPOINT_TTL_S / 60, "refresh_on_read": True} if CHECKPOINT_TTL_S > 0 else None
+        saver = await stack.enter_async_context(
+            AsyncRedisSaver.from_conn_string(redis_client=Redis(connection_pool=pool), ttl=ttl))
+        await saver.asetup()
+        return saver
+    if CHECKPOINTER_BACKEND == "sqlite":
+        from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
+        saver = await stack.enter_async_context(AsyncSqliteSaver.from_conn_string(SQLITE_CP_PATH))
+        await saver.setup()
+        return saver
+    return get_checkpointer()  # InMemorySaver serves both APIs, so sync and async graphs share threads
+
+async def aget_checkpointer() -> BaseCheckpointSaver:
+    # Single event loop: no lock needed, but a concurrent first call must not open a second saver
+    global _ASAVER, _ASTACK
+    if _ASAVER is None:
+        stack = AsyncExitStack()
+        try:
+            saver = instrument_saver(await _aopen(stack))
+        except BaseException:
+            await stack.aclose()
+            raise
+        if _ASAVER is not None:
+            await stack.aclose()
+        else:
+            _ASTACK, _ASAVER = stack, saver
+    return _ASAVER
+
+async def ashutdown_checkpointer():
+    global _ASAVER, _ASTACK
+    stack, _ASAVER, _ASTACK = _ASTACK, None, None
+    if stack is not None:
+        await stack.aclose()
+
+atexit.register(shutdown_checkpointer)
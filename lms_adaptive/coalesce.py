@@ -0,0 +1,199 @@
+import time
+import asyncio
+import threading
+from concurrent.futures import Future
+from functools import partial
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional, Tuple
+
+class SharedStream:
+    # Items of one streamed call as they arrive. Any number of readers, sync (for) or async (async for),
+    # iterate it from the start; each waits only until the next item, or the end, is published.
+
+    def __init__(self, items: Optional[List[Any]] = None):
+        self.items: List[Any] = list(items) if items is not None else []
+        self.done = items is not None  # a finished result replays at once
+        self.error: Optional[BaseException] = None
+        self.waiters: List[Future] = []
+        self.callbacks: List[Callable[["SharedStream"], None]] = []
+        self.lock = threading.Lock()
+
+    def publish(self, item: Any):
+        with self.lock:
+            self.items.append(item)
+            waiters, self.waiters = self.waiters, []
+        for w in waiters:
+            w.set_result(None)
+
+    def finish(self, error: Optional[BaseException] = None):
+        with self.lock:
+            if self.done:
+                return
+            self.done, self.error = True, error
+            waiters, self.waiters = self.waiters, []
+            callbacks, self.callbacks = self.callbacks, []
+        for w in waiters:
+            w.set_result(None)
+        for fn in callbacks:
+            fn(self)
+
+    def add_done_callback(self, fn: Callable[["SharedStream"], None]):
+        with self.lock:
+            if not self.done:
+                self.callbacks.append(fn)
+                return
+        fn(self)
+
+    def _next(self, i: int) -> Tuple[str, Any]:
+        # -> ("item", item) | ("end", None) | ("wait", future set on the next publish/finish)
+        with self.lock:
+            if i < len(self.items):
+                return "item", self.items[i]
+            if self.done:
+                if self.error is not None:
+                    raise self.error
+                return "end", None
+            w = Future()
+            self.waiters.append(w)
+            return "wait", w
+
+    def __iter__(self):
+        i = 0
+        while True:
+            state, val = self._next(i)
+            if state == "end":
+                return
+            if state == "wait":
+                val.result()
+                continue
+            i += 1
+            yield val
+
+    async def __aiter__(self):
+        i = 0
+        while True:
+            state, val = self._next(i)
+            if state == "end":
+                return
+            if state == "wait":
+                await asyncio.wrap_future(val)
+                continue
+            i += 1
+            yield val
+
+class SingleFlight:
+    # Calls sharing a key run once: concurrent callers wait on the leader's result, and callers that
+    # arrive within `ttl` of it completing reuse it. `size` is the amount requested (e.g. k questions);
+    # a result produced for a smaller size never satisfies a larger request.
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self.inflight: Dict[Hashable, Tuple[int, Future, Optional[SharedStream]]] = {}
+        self.results: Dict[Hashable, Tuple[float, int, Any]] = {}  # key -> (finished_at, size, result)
+        self.calls = 0  # executions of fn
+        self.shared = 0  # requests served by another caller's execution
+        self.lock = threading.Lock()
+
+    def _join(self, key: Hashable, size: int, fresh: bool, stream: bool = False):
+        # -> ("hit", result, None) | ("follow", future, leader's stream or None) | ("lead", future, stream or None)
+        with self.lock:
+            now = time.monotonic()
+            hit = self.results.get(key)
+            if hit is not None and now - hit[0] >= self.ttl:
+                del self.results[key]
+                hit = None
+            if hit is not None and not fresh and hit[1] >= size:
+                self.shared += 1
+                return "hit", hit[2], None
+            flight = self.inflight.get(key)
+            if flight is not None and flight[0] >= size:
+                self.shared += 1
+                return "follow", flight[1], flight[2]
+            fut = Future()
+            shared = SharedStream() if stream else None
+            self.inflight[key] = (size, fut, shared)
+            self.calls += 1
+            return "lead", fut, shared
+
+    def do(self, key: Hashable, size: int, fn: Callable[[], Any], fresh: bool = False) -> Any:
+        # fresh=True ignores finished results but still joins a call already in flight
+        role, val, _ = self._join(key, size, fresh)
+        if role == "hit":
+            return val
+        if role == "follow":
+            return val.result()
+        fut = val
+        try:
+            result = fn()
+        except BaseException as e:
+            self._land(key, fut)
+            fut.set_exception(e)
+            raise
+        self._land(key, fut, (time.monotonic(), size, result))
+        fut.set_result(result)
+        return result
+
+    async def ado(self, key: Hashable, size: int, fn: Callable[[], Awaitable[Any]], fresh: bool = False) -> Any:
+        # do() for coroutines; sync and async callers of the same key share one execution
+        role, val, _ = self._join(key, size, fresh)
+        if role == "hit":
+            return val
+        if role == "follow":
+            return await asyncio.wrap_future(val)
+        fut = val
+        try:
+            result = await fn()
+        except BaseException as e:
+            self._land(key, fut)
+            fut.set_exception(e)
+            raise
+        self._land(key, fut, (time.monotonic(), size, result))
+        fut.set_result(result)
+        return result
+
+    def stream(self, key: Hashable, size: int, start: Callable[[SharedStream], None],
+               fresh: bool = False) -> SharedStream:
+        # Streaming form of do(): the leader calls start(shared), which must publish the call's items into
+        # `shared` and finish it (from a producer thread or task). Followers read the same stream as it
+        # arrives, callers within `ttl` replay the finished items, and do()/ado() callers share them too.
+        role, val, shared = self._join(key, size, fresh, stream=True)
+        if role == "hit":
+            return SharedStream(val)
+        if role == "follow":
+            if shared is None:  # a non-streamed call: its items arrive all at once
+                shared = SharedStream()
+                val.add_done_callback(partial(_fill, shared))
+            return shared
+        fut = val
+
+        def landed(s: SharedStream):
+            if s.error is not None:
+                self._land(key, fut)
+                fut.set_exception(s.error)
+            else:
+                self._land(key, fut, (time.monotonic(), size, s.items))
+                fut.set_result(s.items)
+        shared.add_done_callback(landed)
+        try:
+            start(shared)
+        except BaseException as e:
+            shared.finish(e)
+            raise
+        return shared
+
+    def _land(self, key: Hashable, fut: Future, entry=None):
+        with self.lock:
+            if self.inflight.get(key, (0, None, None))[1] is fut:
+                del self.inflight[key]
+            if entry is not None:
+                self.results[key] = entry
+            now = time.monotonic()
+            for k in [k for k, (t, _, _) in self.results.items() if now - t >= self.ttl]:
+                del self.results[k]
+
+def _fill(shared: SharedStream, fut: Future):
+    if fut.exception() is not None:
+        shared.finish(fut.exception())
+        return
+    for item in fut.result():
+        shared.publish(item)
+    shared.finish()
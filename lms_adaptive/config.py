@@ -1,37 +1,108 @@
-import os
-
-# API keys
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "")
-TAVILY_API_KEY = os.getenv("TAVILY_API_KEY", "")
-
-# Models
-CHAT_MODEL = os.getenv("CHAT_MODEL", "gpt-4o-mini")
-EMBED_MODEL = os.getenv("EMBED_MODEL", "text-embedding-3-small")
-
-# Quiz & IRT policy
-QUIZ_LENGTH = int(os.getenv("QUIZ_LENGTH", "10"))
-
-# Cosine thresholds for per-attempt dedup
-COSINE_THRESHOLD_HARD = float(os.getenv("COSINE_THRESHOLD_HARD", "0.90"))
-COSINE_THRESHOLD_SOFT = float(os.getenv("COSINE_THRESHOLD_SOFT", "0.86"))
-
-# Storage
-DB_URL = os.getenv("DB_URL", "sqlite:///./lms.db")
-
-# Vector stores
-VECTOR_DIR = os.getenv("VECTOR_DIR", "./vectorstore")  # Chroma for RAG
-FAISS_DIR = os.getenv("FAISS_DIR", "./faiss_index")    # FAISS for bank ANN (optional)
-
-# Checkpointers
-CHECKPOINTER_BACKEND = os.getenv("CHECKPOINTER_BACKEND", "redis")  # redis | sqlite | memory
-REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
-SQLITE_CP_PATH = os.getenv("SQLITE_CP_PATH", "./graph_checkpoints.sqlite")
-
-# Ingestion (company PDFs)
-COMPANY_PDF_DIR = os.getenv("COMPANY_PDF_DIR", "./company_finance_pdfs")
-CHUNK_SIZE = int(os.getenv("CHUNK_SIZE", "1200"))
-CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", "200"))
-
-# IRT adaptive settings
-INIT_THETA = float(os.getenv("INIT_THETA", "0.0"))
-THETA_LR = float(os.getenv("THETA_LR", "0.25"))  # step for online update
+import os
+
+# API keys
+OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "")
+TAVILY_API_KEY = os.getenv("TAVILY_API_KEY", "")
+
+# Models
+CHAT_MODEL = os.getenv("CHAT_MODEL", "gpt-4o-mini")
+EMBED_MODEL = os.getenv("EMBED_MODEL", "text-embedding-3-small")
+EMBED_DIM = int(os.getenv("EMBED_DIM", "1536"))  # vector width of EMBED_MODEL
+
+# Quiz & IRT policy
+QUIZ_LENGTH = int(os.getenv("QUIZ_LENGTH", "10"))
+
+# Cosine thresholds for per-attempt dedup
+COSINE_THRESHOLD_HARD = float(os.getenv("COSINE_THRESHOLD_HARD", "0.90"))
+COSINE_THRESHOLD_SOFT = float(os.getenv("COSINE_THRESHOLD_SOFT", "0.86"))
+
+# Storage
+DB_URL = os.getenv("DB_URL", "sqlite:///./lms.db")
+ASYNC_DB_URL = os.getenv("ASYNC_DB_URL", "")  # async nodes; empty -> DB_URL through aiosqlite/asyncpg
+
+# Vector stores
+VECTOR_DIR = os.getenv("VECTOR_DIR", "./vectorstore")  # Chroma for RAG
+FAISS_DIR = os.getenv("FAISS_DIR", "./faiss_index")    # FAISS for bank ANN (optional)
+BANK_INDEX_TYPE = os.getenv("BANK_INDEX_TYPE", "flat")  # flat | ivf_flat | ivf_pq | hnsw
+BANK_INDEX_MIN_TRAIN = int(os.getenv("BANK_INDEX_MIN_TRAIN", "20000"))  # smaller partitions stay flat (exact)
+BANK_TRAIN_SAMPLE = int(os.getenv("BANK_TRAIN_SAMPLE", "100000"))  # vectors sampled to train IVF quantizers
+BANK_IVF_NLIST = int(os.getenv("BANK_IVF_NLIST", "0"))  # 0 -> ~4*sqrt(n)
+BANK_PQ_M = int(os.getenv("BANK_PQ_M", "64"))  # PQ sub-quantizers (8 bits each)
+BANK_HNSW_M = int(os.getenv("BANK_HNSW_M", "32"))
+BANK_NPROBE = int(os.getenv("BANK_NPROBE", "16"))  # default IVF lists probed per query
+BANK_EF_SEARCH = int(os.getenv("BANK_EF_SEARCH", "64"))  # default HNSW search beam
+BANK_ANN_SYNC_S = float(os.getenv("BANK_ANN_SYNC_S", "60"))  # shared index catches up with other writers this often
+BANK_PAGE_SIZE = int(os.getenv("BANK_PAGE_SIZE", "500"))  # rows per keyset page when streaming a pool
+BANK_SCAN_ORDER = os.getenv("BANK_SCAN_ORDER", "rotate")  # id | rotate | random
+
+# Checkpointers
+CHECKPOINTER_BACKEND = os.getenv("CHECKPOINTER_BACKEND", "redis")  # redis | sqlite | memory
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+SQLITE_CP_PATH = os.getenv("SQLITE_CP_PATH", "./graph_checkpoints.sqlite")
+CHECKPOINT_POOL_SIZE = int(os.getenv("CHECKPOINT_POOL_SIZE", "16"))  # Redis connections shared by all graphs in the process
+CHECKPOINT_SLIM = os.getenv("CHECKPOINT_SLIM", "1") == "1"  # checkpoint item references; bodies come from the item cache
+ITEM_CACHE_MAX_ITEMS = int(os.getenv("ITEM_CACHE_MAX_ITEMS", "20000"))  # served items kept in memory per process
+CHECKPOINT_COMPACT = os.getenv("CHECKPOINT_COMPACT", "1") == "1"  # persist_attempt collapses the thread to its final checkpoint
+CHECKPOINT_TTL_S = float(os.getenv("CHECKPOINT_TTL_S", str(7 * 24 * 3600)))  # idle threads expire after this; 0 keeps them
+CHECKPOINT_SWEEP_BATCH = int(os.getenv("CHECKPOINT_SWEEP_BATCH", "500"))  # expired threads deleted per SQLite transaction
+CHECKPOINT_VACUUM_PAGES = int(os.getenv("CHECKPOINT_VACUUM_PAGES", "1000"))  # SQLite pages freed per incremental vacuum step
+
+# Ingestion (company PDFs)
+COMPANY_PDF_DIR = os.getenv("COMPANY_PDF_DIR", "./company_finance_pdfs")
+CHUNK_SIZE = int(os.getenv("CHUNK_SIZE", "1200"))
+CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", "200"))
+
+# Bulk import of curated question banks (see import_bank.py)
+IMPORT_CHUNK_SIZE = int(os.getenv("IMPORT_CHUNK_SIZE", "2000"))  # records per validate/embed/insert batch
+
+# IRT adaptive settings
+INIT_THETA = float(os.getenv("INIT_THETA", "0.0"))
+THETA_LR = float(os.getenv("THETA_LR", "0.25"))  # step for online update
+
+# In-memory item bank (per topic/subtopic/difficulty) used by adaptive selection
+BANK_CACHE_TTL = float(os.getenv("BANK_CACHE_TTL", "300"))  # seconds before a pool is refreshed
+INFO_INDEX_BINS = int(os.getenv("INFO_INDEX_BINS", "81"))  # theta bins for the precomputed information ranking
+
+# Offline 2PL calibration (MML-EM)
+CALIB_DIR = os.getenv("CALIB_DIR", "./irt_calibration")  # sufficient stats + last response id
+CALIB_QUAD_POINTS = int(os.getenv("CALIB_QUAD_POINTS", "41"))
+CALIB_MAX_ITER = int(os.getenv("CALIB_MAX_ITER", "100"))
+CALIB_TOL = float(os.getenv("CALIB_TOL", "1e-6"))  # relative change in marginal log-likelihood
+CALIB_CHUNK_SIZE = int(os.getenv("CALIB_CHUNK_SIZE", "100000"))  # responses per DB page / E-step block
+CALIB_MIN_RESPONSES = int(os.getenv("CALIB_MIN_RESPONSES", "30"))  # items below this keep their params
+
+# Ability estimation: "eap" | "mle" | "step" (legacy fixed-rate gradient step)
+THETA_ESTIMATOR = os.getenv("THETA_ESTIMATOR", "eap")
+THETA_PRIOR_SD = float(os.getenv("THETA_PRIOR_SD", "1.0"))  # prior is N(INIT_THETA, THETA_PRIOR_SD)
+THETA_GRID_POINTS = int(os.getenv("THETA_GRID_POINTS", "81"))
+THETA_GRID_MIN = float(os.getenv("THETA_GRID_MIN", "-4.0"))
+THETA_GRID_MAX = float(os.getenv("THETA_GRID_MAX", "4.0"))
+
+# Early stopping for adaptive quizzes: stop once SE(theta) <= threshold, within [min, max] items
+STOP_SE_THRESHOLD = float(os.getenv("STOP_SE_THRESHOLD", "0.35"))
+STOP_MIN_ITEMS = int(os.getenv("STOP_MIN_ITEMS", "5"))
+STOP_MAX_ITEMS = int(os.getenv("STOP_MAX_ITEMS", "0"))  # 0 -> use the attempt's `needed`
+
+# Embedding cache (content-addressed by model + text); empty path disables it
+EMBED_CACHE_PATH = os.getenv("EMBED_CACHE_PATH", "./embed_cache.sqlite")
+EMBED_CACHE_MAX_ITEMS = int(os.getenv("EMBED_CACHE_MAX_ITEMS", "200000"))  # LRU-evicted beyond this
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "256"))  # texts per provider request (cache misses only)
+
+# Background pool replenishment (see replenish.py)
+REPLENISH_ENABLED = os.getenv("REPLENISH_ENABLED", "0") == "1"  # opt-in: runs paid LLM calls in the background
+REPLENISH_LOW_WATERMARK = int(os.getenv("REPLENISH_LOW_WATERMARK", "20"))  # unused items per attempt before topping up
+REPLENISH_BATCH = int(os.getenv("REPLENISH_BATCH", "10"))  # k passed to llm_generate_mcqs (it returns 2k)
+REPLENISH_WORKERS = int(os.getenv("REPLENISH_WORKERS", "2"))
+REPLENISH_COOLDOWN_S = float(os.getenv("REPLENISH_COOLDOWN_S", "300"))  # no new job for a pool whose last one banked nothing or failed
+MCQ_CACHE_TTL_S = float(os.getenv("MCQ_CACHE_TTL_S", "30"))  # concurrent/bursty generation for a pool shares one LLM call
+MCQ_STREAM = os.getenv("MCQ_STREAM", "1") == "1"  # inline generation parses the LLM stream item by item
+
+# Speculative prefetch of the next question while the graph waits for an answer (see prefetch.py)
+PREFETCH_ENABLED = os.getenv("PREFETCH_ENABLED", "0") == "1"
+PREFETCH_WORKERS = int(os.getenv("PREFETCH_WORKERS", "4"))
+PREFETCH_TTL_S = float(os.getenv("PREFETCH_TTL_S", "900"))  # untaken branches are dropped after this
+PREFETCH_WAIT_S = float(os.getenv("PREFETCH_WAIT_S", "30"))  # wait for a still-running prefetch before recomputing
+
+# Per-node instrumentation of the quiz graphs (see metrics.py)
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "0") == "1"
+METRICS_DUMP_PATH = os.getenv("METRICS_DUMP_PATH", "")  # written at exit: Prometheus text for .prom/.txt, else JSON
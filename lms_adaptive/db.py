@@ -1,108 +1,268 @@
-from sqlalchemy import (
-    create_engine, Column, Integer, String, Text, DateTime, ForeignKey,
-    JSON, Float, Boolean, UniqueConstraint
-)
-from sqlalchemy.orm import declarative_base, sessionmaker, relationship
-from datetime import datetime
-from .config import DB_URL
-
-engine = create_engine(DB_URL, connect_args={"check_same_thread": False})
-SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False)
-Base = declarative_base()
-
-class User(Base):
-    __tablename__ = "users"
-    id = Column(Integer, primary_key=True)
-    email = Column(String, unique=True, index=True)
-    name = Column(String)
-    user_level = Column(String)
-    attempts = relationship("QuizAttempt", back_populates="user")
-
-class Lesson(Base):
-    __tablename__ = "lessons"
-    id = Column(Integer, primary_key=True)
-    title = Column(String, index=True)
-    topic = Column(String, index=True)
-    description = Column(Text)
-
-class QuestionItem(Base):
-    __tablename__ = "question_items"
-    id = Column(Integer, primary_key=True)
-    item_id = Column(String, unique=True, index=True)
-    source = Column(String)  # "generated" | "curated"
-    topic = Column(String, index=True)
-    subtopic = Column(String, index=True)
-    difficulty = Column(String, index=True)
-    payload = Column(JSON)   # {question, choices, answer_index, explanation}
-    embedding = Column(JSON) # vector as list[float]
-    # IRT parameters (2PL)
-    a = Column(Float, default=1.0)   # discrimination
-    b = Column(Float, default=0.0)   # difficulty
-    created_at = Column(DateTime, default=datetime.utcnow)
-
-class QuizAttempt(Base): #For the entire 10 question quiz
-    __tablename__ = "quiz_attempts"
-    id = Column(Integer, primary_key=True)
-    user_id = Column(Integer, ForeignKey("users.id"))
-    topic = Column(String, index=True)
-    subtopic = Column(String, index=True)
-    passed = Column(Boolean, default=False)
-    score = Column(Float, nullable=True)
-    created_at = Column(DateTime, default=datetime.utcnow)
-    finished_at = Column(DateTime, nullable=True)
-    user = relationship("User", back_populates="attempts")
-    responses = relationship("AttemptResponse", back_populates="attempt", cascade="all, delete-orphan")
-
-class AttemptResponse(Base): #each question in the quiz attempt
-    __tablename__ = "attempt_responses"
-    id = Column(Integer, primary_key=True)
-    attempt_id = Column(Integer, ForeignKey("quiz_attempts.id"))
-    item_id = Column(String, index=True)
-    question = Column(Text)
-    choices = Column(JSON)
-    correct_index = Column(Integer)
-    user_index = Column(Integer, nullable=True)
-    correct = Column(Boolean, nullable=True)
-    created_at = Column(DateTime, default=datetime.utcnow)
-    attempt = relationship("QuizAttempt", back_populates="responses")
-    __table_args__ = (UniqueConstraint("attempt_id","item_id", name="uniq_attempt_item"),)
-
-# Progression structures
-class Topic(Base):
-    __tablename__ = "topics"
-    id = Column(Integer, primary_key=True)
-    name = Column(String, unique=True, index=True)
-    order_index = Column(Integer, default=0)
-    subtopics = relationship("Subtopic", back_populates="topic")
-
-class Subtopic(Base):
-    __tablename__ = "subtopics"
-    id = Column(Integer, primary_key=True)
-    topic_id = Column(Integer, ForeignKey("topics.id"))
-    name = Column(String, index=True)
-    order_index = Column(Integer, default=0)
-    topic = relationship("Topic", back_populates="subtopics")
-    __table_args__ = (UniqueConstraint("topic_id","name", name="uniq_topic_subtopic"),)
-
-class Prerequisite(Base):
-    __tablename__ = "prerequisites"
-    id = Column(Integer, primary_key=True)
-    prereq_topic = Column(String, index=True)
-    prereq_subtopic = Column(String, index=True)  # "ANY" allowed
-    target_topic = Column(String, index=True)
-    target_subtopic = Column(String, index=True)  # "ANY" allowed
-
-class UserProgress(Base):
-    __tablename__ = "user_progress"
-    id = Column(Integer, primary_key=True)
-    user_id = Column(Integer, index=True)
-    topic = Column(String, index=True)
-    subtopic = Column(String, index=True)
-    attempts = Column(Integer, default=0)
-    completed = Column(Boolean, default=False)
-    last_score = Column(Float, nullable=True) #Stores all attempts of user_id, topic, subtopic
-    updated_at = Column(DateTime, default=datetime.utcnow)
-    __table_args__ = (UniqueConstraint("user_id","topic","subtopic", name="uniq_user_topic_subtopic"),)
-
-def init_db():
-    Base.metadata.create_all(bind=engine)
+from sqlalchemy import (
+    create_engine, Column, Integer, String, Text, DateTime, ForeignKey,
+    JSON, Float, Boolean, UniqueConstraint, LargeBinary, inspect, text, insert, func
+)
+from sqlalchemy.orm import declarative_base, sessionmaker, relationship, Session
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional
+import random
+import numpy as np
+from .config import DB_URL, ASYNC_DB_URL, BANK_PAGE_SIZE, BANK_SCAN_ORDER
+
+engine = create_engine(DB_URL, connect_args={"check_same_thread": False})
+SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False)
+_ASYNC_SESSION = None  # async_sessionmaker, built on first use (see get_async_session)
+Base = declarative_base()
+
+class User(Base):
+    __tablename__ = "users"
+    id = Column(Integer, primary_key=True)
+    email = Column(String, unique=True, index=True)
+    name = Column(String)
+    user_level = Column(String)
+    attempts = relationship("QuizAttempt", back_populates="user")
+
+class Lesson(Base):
+    __tablename__ = "lessons"
+    id = Column(Integer, primary_key=True)
+    title = Column(String, index=True)
+    topic = Column(String, index=True)
+    description = Column(Text)
+
+class QuestionItem(Base):
+    __tablename__ = "question_items"
+    id = Column(Integer, primary_key=True)
+    item_id = Column(String, unique=True, index=True)
+    source = Column(String)  # "generated" | "curated"
+    topic = Column(String, index=True)
+    subtopic = Column(String, index=True)
+    difficulty = Column(String, index=True)
+    payload = Column(JSON)   # {question, choices, answer_index, explanation}
+    embedding = Column(JSON) # legacy: vector as list[float]; migrated into embedding_f32
+    embedding_f32 = Column(LargeBinary, nullable=True)  # raw little-endian float32 vector
+    # IRT parameters (2PL)
+    a = Column(Float, default=1.0)   # discrimination
+    b = Column(Float, default=0.0)   # difficulty
+    params_updated_at = Column(DateTime, nullable=True, index=True)  # last (a, b) write by calibration
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    @property
+    def vector(self):
+        # Zero-copy read-only view over the blob; falls back to the legacy JSON list
+        if self.embedding_f32 is not None:
+            return blob_to_vec(self.embedding_f32)
+        if self.embedding:
+            return np.asarray(self.embedding, dtype=np.float32)
+        return None
+
+class QuizAttempt(Base): #For the entire 10 question quiz
+    __tablename__ = "quiz_attempts"
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"))
+    topic = Column(String, index=True)
+    subtopic = Column(String, index=True)
+    passed = Column(Boolean, default=False)
+    score = Column(Float, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    finished_at = Column(DateTime, nullable=True)
+    user = relationship("User", back_populates="attempts")
+    responses = relationship("AttemptResponse", back_populates="attempt", cascade="all, delete-orphan")
+
+class AttemptResponse(Base): #each question in the quiz attempt
+    __tablename__ = "attempt_responses"
+    id = Column(Integer, primary_key=True)
+    attempt_id = Column(Integer, ForeignKey("quiz_attempts.id"))
+    item_id = Column(String, index=True)
+    question = Column(Text)
+    choices = Column(JSON)
+    correct_index = Column(Integer)
+    user_index = Column(Integer, nullable=True)
+    correct = Column(Boolean, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    attempt = relationship("QuizAttempt", back_populates="responses")
+    __table_args__ = (UniqueConstraint("attempt_id","item_id", name="uniq_attempt_item"),)
+
+# Progression structures
+class Topic(Base):
+    __tablename__ = "topics"
+    id = Column(Integer, primary_key=True)
+    name = Column(String, unique=True, index=True)
+    order_index = Column(Integer, default=0)
+    subtopics = relationship("Subtopic", back_populates="topic")
+
+class Subtopic(Base):
+    __tablename__ = "subtopics"
+    id = Column(Integer, primary_key=True)
+    topic_id = Column(Integer, ForeignKey("topics.id"))
+    name = Column(String, index=True)
+    order_index = Column(Integer, default=0)
+    topic = relationship("Topic", back_populates="subtopics")
+    __table_args__ = (UniqueConstraint("topic_id","name", name="uniq_topic_subtopic"),)
+
+class Prerequisite(Base):
+    __tablename__ = "prerequisites"
+    id = Column(Integer, primary_key=True)
+    prereq_topic = Column(String, index=True)
+    prereq_subtopic = Column(String, index=True)  # "ANY" allowed
+    target_topic = Column(String, index=True)
+    target_subtopic = Column(String, index=True)  # "ANY" allowed
+
+class UserProgress(Base):
+    __tablename__ = "user_progress"
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, index=True)
+    topic = Column(String, index=True)
+    subtopic = Column(String, index=True)
+    attempts = Column(Integer, default=0)
+    completed = Column(Boolean, default=False)
+    last_score = Column(Float, nullable=True) #Stores all attempts of user_id, topic, subtopic
+    updated_at = Column(DateTime, default=datetime.utcnow)
+    __table_args__ = (UniqueConstraint("user_id","topic","subtopic", name="uniq_user_topic_subtopic"),)
+
+def vec_to_blob(vec) -> bytes:
+    return np.asarray(vec, dtype="<f4").tobytes()
+
+def blob_to_vec(blob: bytes) -> np.ndarray:
+    return np.frombuffer(blob, dtype="<f4")
+
+UPSERT_BATCH = 500
+
+def _insert_ignore(dialect: str):
+    if dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    elif dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    else:
+        return None
+    return dialect_insert(QuestionItem).on_conflict_do_nothing(index_elements=["item_id"]).returning(QuestionItem.item_id)
+
+def bulk_upsert_question_items(db: Session, rows: List[Dict], batch: int = UPSERT_BATCH) -> List[str]:
+    # Insert QuestionItem column dicts (same keys in every row) whose item_id is not banked yet and
+    # return the item_ids that were new. SQLite/Postgres: INSERT ... ON CONFLICT DO NOTHING RETURNING,
+    # one statement per batch; elsewhere one IN lookup plus one executemany insert per batch.
+    # The caller commits.
+    stmt = _insert_ignore(db.get_bind().dialect.name)
+    new_ids: List[str] = []
+    for i in range(0, len(rows), batch):
+        chunk: Dict[str, Dict] = {}
+        for r in rows[i:i + batch]:
+            chunk.setdefault(r["item_id"], r)
+        if not chunk:
+            continue
+        if stmt is not None:
+            new_ids.extend(db.execute(stmt, list(chunk.values())).scalars().all())
+            continue
+        for (item_id,) in db.query(QuestionItem.item_id).filter(QuestionItem.item_id.in_(list(chunk))).all():
+            chunk.pop(item_id, None)
+        if chunk:
+            db.execute(insert(QuestionItem), list(chunk.values()))
+            new_ids.extend(chunk)
+    return new_ids
+
+SCAN_ORDERS = ("id", "rotate", "random")
+
+def iter_question_items(db: Session, topic: str, subtopic: str, difficulty: str, order: str = BANK_SCAN_ORDER,
+                        page: int = BANK_PAGE_SIZE, after_id: int = 0,
+                        rng: Optional[random.Random] = None) -> Iterator[List[QuestionItem]]:
+    # Streams one pool's rows (id > after_id) in pages by keyset (WHERE id > last ORDER BY id LIMIT page),
+    # so every page is an index range scan and only one page is held at a time. "rotate" starts at a
+    # random id and wraps round to the beginning, spreading concurrent attempts over the pool;
+    # "random" additionally shuffles each page. Stop iterating as soon as enough rows were taken.
+    if order not in SCAN_ORDERS:
+        raise ValueError(f"order must be one of {SCAN_ORDERS}")
+    q = db.query(QuestionItem).filter(QuestionItem.topic == topic, QuestionItem.subtopic == subtopic,
+                                      QuestionItem.difficulty == difficulty)
+    segments = [(after_id, None)]
+    if order != "id":
+        rng = rng or random
+        lo, hi = q.filter(QuestionItem.id > after_id).with_entities(func.min(QuestionItem.id),
+                                                                    func.max(QuestionItem.id)).one()
+        if lo is None:
+            return
+        pivot = rng.randint(lo - 1, hi - 1)
+        segments = [(pivot, None), (after_id, pivot)]
+    for last, upto in segments:
+        while True:
+            pq = q.filter(QuestionItem.id > last)
+            if upto is not None:
+                pq = pq.filter(QuestionItem.id <= upto)
+            rows = pq.order_by(QuestionItem.id).limit(page).all()
+            if not rows:
+                break
+            last = rows[-1].id
+            if order == "random":
+                rng.shuffle(rows)
+            yield rows
+            if len(rows) < page:
+                break
+
+_ADDED_COLUMNS = (("embedding_f32", LargeBinary()), ("params_updated_at", DateTime()))
+
+def _ensure_columns():
+    # create_all() does not add columns (or their indexes) to existing tables
+    cols = {c["name"] for c in inspect(engine).get_columns("question_items")}
+    with engine.begin() as conn:
+        for name, col_type in _ADDED_COLUMNS:
+            if name not in cols:
+                conn.execute(text(f"ALTER TABLE question_items ADD COLUMN {name} {col_type.compile(dialect=engine.dialect)}"))
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_question_items_params_updated_at "
+                          "ON question_items (params_updated_at)"))
+
+def migrate_embeddings_to_blob(batch: int = 1000) -> int:
+    # One-time move of JSON embeddings into embedding_f32; safe to re-run
+    db = SessionLocal()
+    moved, last = 0, 0
+    try:
+        while True:
+            rows = (
+                db.query(QuestionItem.id, QuestionItem.embedding)
+                .filter(QuestionItem.id > last, QuestionItem.embedding_f32.is_(None))
+                .order_by(QuestionItem.id)
+                .limit(batch)
+                .all()
+            )
+            if not rows:
+                return moved
+            last = rows[-1][0]
+            mappings = [{"id": rid, "embedding_f32": vec_to_blob(vec), "embedding": None} for rid, vec in rows if vec]
+            if mappings:
+                db.bulk_update_mappings(QuestionItem, mappings)
+                db.commit()
+                moved += len(mappings)
+    finally:
+        db.close()
+
+_ASYNC_DRIVERS = (("sqlite://", "sqlite+aiosqlite://"), ("postgresql+psycopg2://", "postgresql+asyncpg://"),
+                  ("postgresql://", "postgresql+asyncpg://"))
+
+def async_db_url(url: str = DB_URL) -> str:
+    # The same database through its asyncio driver
+    for sync_prefix, async_prefix in _ASYNC_DRIVERS:
+        if url.startswith(sync_prefix):
+            return async_prefix + url[len(sync_prefix):]
+    return url
+
+def get_async_session():
+    # async_sessionmaker for the async graph nodes. Imported lazily: the sync path does not need the
+    # asyncio extras (greenlet, aiosqlite/asyncpg). ORM helpers written against Session run unchanged
+    # on the async connection through AsyncSession.run_sync.
+    global _ASYNC_SESSION
+    if _ASYNC_SESSION is None:
+        from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+        _ASYNC_SESSION = async_sessionmaker(create_async_engine(ASYNC_DB_URL or async_db_url()),
+                                            autoflush=False, expire_on_commit=False)
+    return _ASYNC_SESSION
+
+async def arun(adb, fn, *args):
+    # fn(session, *args) on the AsyncSession `adb` as one short transaction. This is only
+    # AsyncSession.run_sync over the existing sync ORM functions (they run on the async driver's
+    # connection via greenlet), not a separate async data layer. Committing releases the pooled
+    # connection before the caller's next await (an LLM or embedding call) instead of holding it.
+    out = await adb.run_sync(fn, *args)
+    await adb.commit()
+    return out
+
+def init_db():
+    Base.metadata.create_all(bind=engine)
+    _ensure_columns()
+    migrate_embeddings_to_blob()
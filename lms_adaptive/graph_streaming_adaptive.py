@@ -1,153 +1,347 @@
-from typing import TypedDict, List, Dict, Annotated
-import operator
-from datetime import datetime
-from sqlalchemy.orm import Session
-from langgraph.graph import StateGraph, START, END
-from langgraph.types import Command, interrupt
-from .db import SessionLocal, QuizAttempt, AttemptResponse
-from .quiz_adaptive import pick_next_item_adaptive, update_theta_step
-from .config import QUIZ_LENGTH, CHECKPOINTER_BACKEND, REDIS_URL, SQLITE_CP_PATH, INIT_THETA, THETA_LR
-from .progress import is_unlocked, record_attempt
-
-def make_checkpointer():
-    if CHECKPOINTER_BACKEND == "redis":
-        from langgraph.checkpoint.redis import RedisSaver
-        return RedisSaver.from_conn_string(REDIS_URL)
-    if CHECKPOINTER_BACKEND == "sqlite":
-        from langgraph.checkpoint.sqlite import SqliteSaver
-        return SqliteSaver.from_conn_string(f"sqlite:///{SQLITE_CP_PATH}")
-    from langgraph.checkpoint.memory import InMemorySaver
-    return InMemorySaver()
-
-class AttemptState(TypedDict):
-    user_id: int
-    topic: str
-    subtopic: str
-    difficulty: str
-    needed: int
-    served: Annotated[List[Dict], operator.add]  # items with a,b
-    current_index: int
-    current_answer: int | None
-    correct_count: int
-    theta: float
-    complete: bool
-
-def _db() -> Session:
-    return SessionLocal()
-
-def node_gate_unlock(s: AttemptState):
-    db = SessionLocal()
-    ok, unmet = is_unlocked(db, s["user_id"], s["topic"], s["subtopic"])
-    if ok:
-        return {}
-    _ = interrupt({
-        "type": "locked",
-        "message": "This subtopic is locked. Complete prerequisites first.",
-        "unmet": unmet
-    })
-    return {}
-
-def node_init(s: AttemptState):
-    return {
-        "needed": QUIZ_LENGTH if not s.get("needed") else s["needed"],
-        "served": s.get("served", []),
-        "current_index": s.get("current_index", 0),
-        "current_answer": None,
-        "correct_count": s.get("correct_count", 0),
-        "theta": s.get("theta", INIT_THETA),
-        "complete": False
-    }
-
-def node_select_next(s: AttemptState):
-    if len(s["served"]) > s["current_index"]:
-        return {}
-    item = pick_next_item_adaptive(
-        db=_db(),
-        topic=s["topic"],
-        subtopic=s["subtopic"],
-        difficulty=s["difficulty"],
-        theta=s["theta"],
-        attempt_seen_items=s["served"]
-    )
-    if not item:
-        _ = interrupt({
-            "type": "no_item_available",
-            "message": "No suitable next item found for this adaptive step."
-        })
-        return {}
-    return {"served": [item]}
-
-def node_emit_and_wait(s: AttemptState):
-    idx = s["current_index"]
-    if idx >= s["needed"]:
-        return {}
-    q = s["served"][idx]
-    _ = interrupt({
-        "type": "await_answer",
-        "index": idx,
-        "question": q["question"],
-        "choices": q["choices"],
-    })
-    return {}
-
-def node_validate_update_and_advance(s: AttemptState):
-    idx = s["current_index"]
-    if idx >= len(s["served"]):
-        return {}
-    q = s["served"][idx]
-    ans = s.get("current_answer", None)
-    correct_count = s["correct_count"]
-    theta = s["theta"]
-    if ans is not None:
-        y = 1 if ans == q["correct_index"] else 0
-        if y == 1:
-            correct_count += 1
-        a = q.get("a", 1.0)
-        b = q.get("b", 0.0)
-        theta = update_theta_step(theta, a, b, y, lr=THETA_LR)
-    next_idx = idx + 1
-    done = next_idx >= s["needed"]
-    return {"correct_count": correct_count, "current_index": next_idx, "current_answer": None, "theta": theta, "complete": done}
-
-def build_quiz_graph_streaming_adaptive():
-    g = StateGraph(AttemptState)
-    g.add_node("gate", node_gate_unlock)
-    g.add_node("init", node_init)
-    g.add_node("select_next", node_select_next)
-    g.add_node("emit_and_wait", node_emit_and_wait)
-    g.add_node("validate_update_and_advance", node_validate_update_and_advance)
-    g.add_edge(START, "gate")
-    g.add_edge("gate", "init")
-    g.add_edge("init", "select_next")
-    g.add_edge("select_next", "emit_and_wait")
-    g.add_edge("emit_and_wait", "validate_update_and_advance")
-    g.add_conditional_edges(
-        "validate_update_and_advance",
-        lambda s: "end" if s["complete"] else "loop",
-        {"end": END, "loop": "select_next"}
-    )
-    checkpointer = make_checkpointer()
-    return g.compile(checkpointer=checkpointer)
-
-def persist_attempt(user_id: int, topic: str, subtopic: str, served: List[Dict], answers: List[int], pass_mark: float = 0.6):
-    db = _db()
-    att = QuizAttempt(user_id=user_id, topic=topic, subtopic=subtopic, created_at=datetime.utcnow())
-    db.add(att); db.flush()
-    correct = 0
-    for i, it in enumerate(served):
-        ui = answers[i] if i < len(answers) else None
-        is_correct = (ui == it["correct_index"]) if ui is not None else None
-        if is_correct:
-            correct += 1
-        db.add(AttemptResponse(
-            attempt_id=att.id,
-            item_id=it["item_id"], question=it["question"], choices=it["choices"],
-            correct_index=it["correct_index"], user_index=ui, correct=is_correct
-        ))
-    score = correct / max(1, len(served))
-    att.score = score * 100.0
-    att.passed = bool(score >= pass_mark)
-    att.finished_at = datetime.utcnow()
-    db.commit()
-    record_attempt(db, user_id, topic, subtopic, att.score, pass_mark)
-    return att.id
+from typing import TypedDict, List, Dict, Tuple, Annotated
+import operator
+import threading
+from functools import partial
+from datetime import datetime
+from sqlalchemy.orm import Session
+from langgraph.graph import StateGraph, START, END
+from langgraph.graph.state import CompiledStateGraph
+from langgraph.checkpoint.base import BaseCheckpointSaver
+from langgraph.types import Command, interrupt
+from .db import SessionLocal, QuizAttempt, AttemptResponse, get_async_session, arun
+from .quiz_adaptive import pick_next_item_adaptive, apick_next_item_adaptive
+from .embeddings import SeenMatrix
+from .prefetch import get_prefetcher
+from .item_cache import get_item_cache, rehydrate, arehydrate
+from .retention import compact_thread, acompact_thread
+from .checkpointer import get_checkpointer, shutdown_checkpointer, aget_checkpointer, ashutdown_checkpointer
+from .theta import AbilityEstimator, get_estimator, initial_loglik
+from .stopping import StoppingRule
+from .config import (
+    QUIZ_LENGTH, INIT_THETA, THETA_PRIOR_SD, PREFETCH_ENABLED, CHECKPOINT_SLIM, CHECKPOINT_COMPACT
+)
+from .progress import is_unlocked, record_attempt
+from .metrics import instrument
+
+GRAPH_NAME = "quiz_adaptive"  # `graph` label in metrics.py
+
+class AttemptState(TypedDict):
+    user_id: int
+    topic: str
+    subtopic: str
+    difficulty: str
+    needed: int
+    served: Annotated[List[Dict], operator.add]  # items with a,b; {"item_id", "a", "b"} refs when CHECKPOINT_SLIM
+    seen_matrix: bytes | None  # SeenMatrix.to_state() of everything served so far (full mode only)
+    current_index: int
+    current_answer: int | None
+    correct_count: int
+    theta: float
+    theta_se: float
+    theta_loglik: List[float]  # log-likelihood over the theta grid (see theta.py)
+    complete: bool
+
+def _db() -> Session:
+    return SessionLocal()
+
+# Nodes prefixed with `a` are the async variants used by graphs built with aio=True: the same steps,
+# with DB work on an AsyncSession and provider calls awaited, so one event loop can drive many attempts.
+
+def _gate(ok: bool, unmet: List[Dict]):
+    if ok:
+        return {}
+    _ = interrupt({
+        "type": "locked",
+        "message": "This subtopic is locked. Complete prerequisites first.",
+        "unmet": unmet
+    })
+    return {}
+
+def node_gate_unlock(s: AttemptState):
+    db = SessionLocal()
+    return _gate(*is_unlocked(db, s["user_id"], s["topic"], s["subtopic"]))
+
+async def anode_gate_unlock(s: AttemptState):
+    async with get_async_session()() as adb:
+        ok, unmet = await arun(adb, is_unlocked, s["user_id"], s["topic"], s["subtopic"])
+    return _gate(ok, unmet)
+
+def node_init(s: AttemptState):
+    return {
+        "needed": QUIZ_LENGTH if not s.get("needed") else s["needed"],
+        "served": s.get("served", []),
+        "current_index": s.get("current_index", 0),
+        "current_answer": None,
+        "correct_count": s.get("correct_count", 0),
+        "theta": s.get("theta", INIT_THETA),
+        "theta_se": s.get("theta_se", THETA_PRIOR_SD),
+        "theta_loglik": s.get("theta_loglik") or initial_loglik().tolist(),
+        "complete": False
+    }
+
+def _prefetch_key(s: AttemptState):
+    # The next item depends on what has been served and on theta, so each answer branch gets its own key
+    served = tuple(it["item_id"] for it in s["served"])
+    return (s["user_id"], s["topic"], s["subtopic"], s["difficulty"], served, round(float(s["theta"]), 9))
+
+def _select_next(s: AttemptState, bank_only: bool = False) -> Dict:
+    served = rehydrate(s["served"])
+    seen = SeenMatrix.from_state(s["seen_matrix"]) if s.get("seen_matrix") else SeenMatrix.from_items(served)
+    db = _db()
+    try:
+        item = pick_next_item_adaptive(
+            db=db,
+            topic=s["topic"],
+            subtopic=s["subtopic"],
+            difficulty=s["difficulty"],
+            theta=s["theta"],
+            attempt_seen_items=served,
+            seen=seen,
+            bank_only=bank_only,
+        )
+    finally:
+        db.close()
+    return _selected_update(seen, item)
+
+async def _aselect_next(s: AttemptState) -> Dict:
+    async with get_async_session()() as adb:
+        served = await arehydrate(s["served"], adb)
+        seen = SeenMatrix.from_state(s["seen_matrix"]) if s.get("seen_matrix") else SeenMatrix.from_items(served)
+        item = await apick_next_item_adaptive(
+            adb,
+            topic=s["topic"],
+            subtopic=s["subtopic"],
+            difficulty=s["difficulty"],
+            theta=s["theta"],
+            attempt_seen_items=served,
+            seen=seen,
+        )
+    return _selected_update(seen, item)
+
+def _selected_update(seen: SeenMatrix, item: Dict | None) -> Dict:
+    if not item:
+        return {}
+    if CHECKPOINT_SLIM:
+        # The ref keeps the (a, b) the item was selected with, so a recalibration mid-attempt
+        # cannot change how its answer updates theta; the dedup matrix is rebuilt from cached vectors
+        get_item_cache().put([item])
+        return {"served": [{"item_id": item["item_id"], "a": item["a"], "b": item["b"]}], "seen_matrix": None}
+    return {"served": [item], "seen_matrix": seen.to_state()}
+
+def _prefetch_branches(s: AttemptState, q: Dict, estimator: AbilityEstimator, stopping: StoppingRule):
+    # Select the next item for both outcomes (theta+ if correct, theta- if not) while the learner answers.
+    # Branches where the stopping rule would end the attempt are skipped. Selection is bank-only: a branch
+    # the pool cannot serve is left to select_next, which replenishes and generates as without prefetch.
+    loglik = s.get("theta_loglik") or initial_loglik().tolist()
+    answered = s["current_index"] + 1
+    prefetcher = get_prefetcher()
+    for y in (1, 0):
+        ability = estimator.update(s["theta"], loglik, q.get("a", 1.0), q.get("b", 0.0), y)
+        if answered >= s["needed"] or bool(stopping.should_stop(answered, ability["theta_se"], s["needed"])):
+            continue
+        branch = {**s, **ability}
+        prefetcher.submit(_prefetch_key(branch), _select_next, branch, True)
+
+def node_select_next(s: AttemptState, prefetch: bool = False):
+    if len(s["served"]) > s["current_index"]:
+        return {}
+    update = get_prefetcher().take(_prefetch_key(s)) if prefetch else None
+    return _selected(update or _select_next(s))
+
+async def anode_select_next(s: AttemptState, prefetch: bool = False):
+    if len(s["served"]) > s["current_index"]:
+        return {}
+    update = await get_prefetcher().atake(_prefetch_key(s)) if prefetch else None
+    return _selected(update or await _aselect_next(s))
+
+def _selected(update: Dict):
+    if not update:
+        _ = interrupt({
+            "type": "no_item_available",
+            "message": "No suitable next item found for this adaptive step."
+        })
+        return {}
+    return update
+
+def node_emit_and_wait(s: AttemptState, estimator: AbilityEstimator | None = None,
+                       stopping: StoppingRule | None = None, prefetch: bool = False):
+    idx = s["current_index"]
+    if idx >= s["needed"]:
+        return {}
+    return _emit(s, rehydrate(s["served"][idx:idx + 1])[0], estimator, stopping, prefetch)
+
+async def anode_emit_and_wait(s: AttemptState, estimator: AbilityEstimator | None = None,
+                              stopping: StoppingRule | None = None, prefetch: bool = False):
+    idx = s["current_index"]
+    if idx >= s["needed"]:
+        return {}
+    async with get_async_session()() as adb:
+        q = (await arehydrate(s["served"][idx:idx + 1], adb))[0]
+    return _emit(s, q, estimator, stopping, prefetch)
+
+def _emit(s: AttemptState, q: Dict, estimator: AbilityEstimator | None, stopping: StoppingRule | None, prefetch: bool):
+    idx = s["current_index"]
+    if prefetch and len(s["served"]) == idx + 1:
+        # Branch jobs run on the prefetcher's worker threads with the sync path, also for async graphs
+        _prefetch_branches(s, q, estimator or get_estimator(), stopping or StoppingRule())
+    resume = interrupt({
+        "type": "await_answer",
+        "index": idx,
+        "question": q["question"],
+        "choices": q["choices"],
+    })
+    # Resumed with Command(resume={"current_answer": i}) or a bare index
+    ans = resume.get("current_answer") if isinstance(resume, dict) else resume
+    return {"current_answer": ans}
+
+def node_validate_update_and_advance(s: AttemptState, estimator: AbilityEstimator | None = None,
+                                     stopping: StoppingRule | None = None):
+    idx = s["current_index"]
+    if idx >= len(s["served"]):
+        return {}
+    return _advance(s, rehydrate(s["served"][idx:idx + 1])[0], estimator, stopping)
+
+async def anode_validate_update_and_advance(s: AttemptState, estimator: AbilityEstimator | None = None,
+                                            stopping: StoppingRule | None = None):
+    idx = s["current_index"]
+    if idx >= len(s["served"]):
+        return {}
+    async with get_async_session()() as adb:
+        q = (await arehydrate(s["served"][idx:idx + 1], adb))[0]
+    return _advance(s, q, estimator, stopping)
+
+def _advance(s: AttemptState, q: Dict, estimator: AbilityEstimator | None, stopping: StoppingRule | None):
+    idx = s["current_index"]
+    ans = s.get("current_answer", None)
+    correct_count = s["correct_count"]
+    ability = {}
+    if ans is not None:
+        y = 1 if ans == q["correct_index"] else 0
+        if y == 1:
+            correct_count += 1
+        a = q.get("a", 1.0)
+        b = q.get("b", 0.0)
+        estimator = estimator or get_estimator()
+        ability = estimator.update(s["theta"], s.get("theta_loglik") or initial_loglik().tolist(), a, b, y)
+    next_idx = idx + 1
+    # Complete on the length cap or once the SE rule fires, so the checkpoint records why the attempt ended
+    se = ability.get("theta_se", s.get("theta_se", float("inf")))
+    done = next_idx >= s["needed"] or (stopping or StoppingRule()).is_complete(next_idx, se, s["needed"])
+    return {"correct_count": correct_count, "current_index": next_idx, "current_answer": None, "complete": done, **ability}
+
+def build_quiz_graph_streaming_adaptive(
+    estimator: AbilityEstimator | str | None = None,
+    stopping: StoppingRule | None = None,
+    prefetch: bool | None = None,
+    checkpointer: BaseCheckpointSaver | None = None,
+    aio: bool = False,
+):
+    # aio=True builds the async variant (drive it with ainvoke/astream); pass it an async-capable
+    # checkpointer (aget_checkpointer()) unless the backend is in-memory
+    if not isinstance(estimator, AbilityEstimator):
+        estimator = get_estimator(estimator)
+    stopping = stopping or StoppingRule()
+    prefetch = PREFETCH_ENABLED if prefetch is None else prefetch
+    g = StateGraph(AttemptState)
+    nodes = {
+        "gate": anode_gate_unlock if aio else node_gate_unlock,
+        "init": node_init,
+        "select_next": partial(anode_select_next if aio else node_select_next, prefetch=prefetch),
+        "emit_and_wait": partial(anode_emit_and_wait if aio else node_emit_and_wait,
+                                 estimator=estimator, stopping=stopping, prefetch=prefetch),
+        "validate_update_and_advance": partial(
+            anode_validate_update_and_advance if aio else node_validate_update_and_advance,
+            estimator=estimator, stopping=stopping),
+    }
+    for name, fn in nodes.items():
+        g.add_node(name, instrument(GRAPH_NAME, name, fn))
+    g.add_edge(START, "gate")
+    g.add_edge("gate", "init")
+    g.add_edge("init", "select_next")
+    g.add_edge("select_next", "emit_and_wait")
+    g.add_edge("emit_and_wait", "validate_update_and_advance")
+    g.add_conditional_edges(
+        "validate_update_and_advance",
+        stopping.route,
+        {"end": END, "loop": "select_next"}
+    )
+    return g.compile(checkpointer=checkpointer or get_checkpointer())
+
+_GRAPHS: Dict[Tuple[str | None, bool], CompiledStateGraph] = {}
+_GRAPHS_LOCK = threading.Lock()
+
+def get_quiz_graph_streaming_adaptive(estimator: str | None = None, prefetch: bool | None = None) -> CompiledStateGraph:
+    # Compiled once per process (per estimator/prefetch setting) and shared by all requests; per-attempt
+    # state lives in the checkpointer. Graphs with a custom StoppingRule are built directly.
+    key = (estimator, PREFETCH_ENABLED if prefetch is None else prefetch)
+    graph = _GRAPHS.get(key)
+    if graph is None:
+        with _GRAPHS_LOCK:
+            graph = _GRAPHS.get(key)
+            if graph is None:
+                graph = _GRAPHS[key] = build_quiz_graph_streaming_adaptive(estimator, prefetch=key[1])
+    return graph
+
+def shutdown_quiz_graphs():
+    with _GRAPHS_LOCK:
+        _GRAPHS.clear()
+    shutdown_checkpointer()
+
+_AGRAPHS: Dict[Tuple[str | None, bool], CompiledStateGraph] = {}
+
+async def aget_quiz_graph_streaming_adaptive(estimator: str | None = None,
+                                             prefetch: bool | None = None) -> CompiledStateGraph:
+    # Async counterpart of get_quiz_graph_streaming_adaptive, over the event loop's checkpointer
+    key = (estimator, PREFETCH_ENABLED if prefetch is None else prefetch)
+    graph = _AGRAPHS.get(key)
+    if graph is None:
+        checkpointer = await aget_checkpointer()
+        graph = _AGRAPHS.setdefault(key, build_quiz_graph_streaming_adaptive(
+            estimator, prefetch=key[1], checkpointer=checkpointer, aio=True))
+    return graph
+
+async def ashutdown_quiz_graphs():
+    _AGRAPHS.clear()
+    await ashutdown_checkpointer()
+
+def persist_attempt(user_id: int, topic: str, subtopic: str, served: List[Dict], answers: List[int], pass_mark: float = 0.6,
+                    checkpointer: BaseCheckpointSaver | None = None, thread_id: str | None = None):
+    # Pass the graph's checkpointer and the attempt's thread_id to drop its intermediate checkpoints
+    served = rehydrate(served)
+    att_id = _write_attempt(_db(), user_id, topic, subtopic, served, answers, pass_mark)
+    if CHECKPOINT_COMPACT and checkpointer is not None and thread_id:
+        compact_thread(checkpointer, thread_id)
+    return att_id
+
+async def apersist_attempt(user_id: int, topic: str, subtopic: str, served: List[Dict], answers: List[int],
+                           pass_mark: float = 0.6, checkpointer: BaseCheckpointSaver | None = None,
+                           thread_id: str | None = None):
+    async with get_async_session()() as adb:
+        served = await arehydrate(served, adb)
+        att_id = await arun(adb, _write_attempt, user_id, topic, subtopic, served, answers, pass_mark)
+    if CHECKPOINT_COMPACT and checkpointer is not None and thread_id:
+        await acompact_thread(checkpointer, thread_id)
+    return att_id
+
+def _write_attempt(db: Session, user_id: int, topic: str, subtopic: str, served: List[Dict], answers: List[int],
+                   pass_mark: float) -> int:
+    att = QuizAttempt(user_id=user_id, topic=topic, subtopic=subtopic, created_at=datetime.utcnow())
+    db.add(att); db.flush()
+    correct = 0
+    for i, it in enumerate(served):
+        ui = answers[i] if i < len(answers) else None
+        is_correct = (ui == it["correct_index"]) if ui is not None else None
+        if is_correct:
+            correct += 1
+        db.add(AttemptResponse(
+            attempt_id=att.id,
+            item_id=it["item_id"], question=it["question"], choices=it["choices"],
+            correct_index=it["correct_index"], user_index=ui, correct=is_correct
+        ))
+    score = correct / max(1, len(served))
+    att.score = score * 100.0
+    att.passed = bool(score >= pass_mark)
+    att.finished_at = datetime.utcnow()
+    db.commit()
+    record_attempt(db, user_id, topic, subtopic, att.score, pass_mark)
+    return att.id
@@ -0,0 +1,20 @@
+import numpy as np
+
+# Vectorized 2PL helpers; scalar versions live in quiz_adaptive.py
+
+def prob_correct_2pl_vec(theta, a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    z = np.asarray(a, dtype=np.float64) * (np.asarray(theta, dtype=np.float64) - np.asarray(b, dtype=np.float64))
+    return 1.0 / (1.0 + np.exp(-np.clip(z, -35.0, 35.0)))
+
+def fisher_info_2pl_vec(theta, a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    p = prob_correct_2pl_vec(theta, a, b)
+    return (np.asarray(a, dtype=np.float64) ** 2) * p * (1.0 - p)
+
+def log_sigmoid(z: np.ndarray) -> np.ndarray:
+    return -np.logaddexp(0.0, -z)
+
+def quadrature_grid(n_points: int, lo: float = -4.0, hi: float = 4.0):
+    # Equally spaced nodes with standard-normal prior weights (sum to 1)
+    nodes = np.linspace(lo, hi, n_points)
+    w = np.exp(-0.5 * nodes * nodes)
+    return nodes, w / w.sum()
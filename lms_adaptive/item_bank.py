@@ -0,0 +1,261 @@
+import time
+import threading
+from datetime import datetime
+from typing import List, Dict, Iterable, Optional, Tuple
+import numpy as np
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+from .db import QuestionItem, iter_question_items
+from .irt import fisher_info_2pl_vec
+from .embeddings import SeenMatrix
+from .config import BANK_CACHE_TTL, INFO_INDEX_BINS, THETA_GRID_MIN, THETA_GRID_MAX
+from .metrics import timed
+
+BankKey = Tuple[str, str, str]  # (topic, subtopic, difficulty)
+
+SELECT_CHUNK = 64  # ranked candidates checked per dedup matmul
+
+def normalize_rows(X: np.ndarray) -> np.ndarray:
+    X = np.asarray(X, dtype=np.float32)
+    norms = np.linalg.norm(X, axis=1, keepdims=True)
+    return X / np.maximum(norms, 1e-12)
+
+class InfoIndex:
+    # For each theta bin centre, item positions sorted by 2PL information (descending)
+
+    def __init__(self, a: np.ndarray, b: np.ndarray, n_bins: int = INFO_INDEX_BINS):
+        self.centres = np.linspace(THETA_GRID_MIN, THETA_GRID_MAX, n_bins)
+        info = fisher_info_2pl_vec(self.centres[:, None], a[None, :], b[None, :])
+        self.order = np.argsort(-info, axis=1, kind="stable").astype(np.int32)
+        self.keys = np.take_along_axis(-info, self.order, axis=1)  # ascending, aligned with order
+
+    def bin_of(self, theta: float) -> int:
+        i = int(np.searchsorted(self.centres, theta))
+        if i == 0:
+            return 0
+        if i == len(self.centres):
+            return i - 1
+        return i if self.centres[i] - theta < theta - self.centres[i - 1] else i - 1
+
+    def ranked(self, theta: float) -> np.ndarray:
+        return self.order[self.bin_of(theta)]
+
+    def upsert(self, pos: np.ndarray, a: np.ndarray, b: np.ndarray):
+        # Re-rank only `pos` (new or recalibrated items): drop their old entries, find each new key's
+        # slot per bin with searchsorted, then scatter old and new entries into every bin at once
+        # instead of re-sorting the whole bank or inserting bin by bin.
+        pos = np.asarray(pos, dtype=np.int32)
+        if not len(pos):
+            return
+        n_bins = len(self.centres)
+        ki = -fisher_info_2pl_vec(self.centres[:, None], a[pos][None, :], b[pos][None, :])
+        srt = np.argsort(ki, axis=1, kind="stable")
+        ki, pi = np.take_along_axis(ki, srt, axis=1), pos[srt]
+        stale = np.zeros(max(self.order.shape[1], int(pos.max()) + 1), dtype=bool)
+        stale[pos] = True
+        keep = ~stale[self.order]  # same count per bin
+        o = self.order[keep].reshape(n_bins, -1)
+        k = self.keys[keep].reshape(n_bins, -1)
+        at = np.stack([np.searchsorted(k[i], ki[i], side="right") for i in range(n_bins)])
+        dst = at + np.arange(len(pos))  # final column of each new entry
+        rows = np.arange(n_bins)[:, None]
+        width = o.shape[1] + len(pos)
+        old = np.ones((n_bins, width), dtype=bool)
+        old[rows, dst] = False
+        order = np.empty((n_bins, width), dtype=np.int32)
+        keys = np.empty((n_bins, width), dtype=k.dtype)
+        order[old], keys[old] = o.ravel(), k.ravel()
+        order[rows, dst], keys[rows, dst] = pi, ki
+        self.order, self.keys = order, keys
+
+class ItemMatrix:
+    # Column-oriented snapshot of one (topic, subtopic, difficulty) pool
+
+    def __init__(self, ids: List[str], a: List[float], b: List[float], emb: np.ndarray, payloads: List[Dict],
+                 max_pk: int = 0, params_at: Optional[datetime] = None):
+        self.ids: List[str] = list(ids)
+        self.a = np.asarray(a, dtype=np.float64)
+        self.b = np.asarray(b, dtype=np.float64)
+        self.emb = normalize_rows(emb)  # (n, dim); rows of zeros for items without a vector
+        self.payloads = payloads
+        self.pos = {item_id: i for i, item_id in enumerate(self.ids)}
+        self.max_pk = max_pk  # highest QuestionItem.id loaded; newer rows are appended on refresh
+        self.params_at = params_at  # latest params_updated_at seen; later (a, b) writes are re-read on refresh
+        self.index = InfoIndex(self.a, self.b)
+        self.loaded_at = time.monotonic()
+        self.lock = threading.RLock()
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @staticmethod
+    def _columns(rows: List[QuestionItem], dim: int):
+        emb = np.zeros((len(rows), dim), dtype=np.float32)
+        ids, a, b, payloads = [], [], [], []
+        for i, r in enumerate(rows):
+            ids.append(r.item_id)
+            a.append(r.a if r.a is not None else 1.0)
+            b.append(r.b if r.b is not None else 0.0)
+            payloads.append(r.payload)
+            v = r.vector
+            if v is not None and len(v) == dim:
+                emb[i] = v
+        max_pk = max((r.id for r in rows), default=0)
+        return ids, a, b, emb, payloads, max_pk
+
+    @staticmethod
+    def _dim(rows: List[QuestionItem]) -> int:
+        return next((len(v) for v in (r.vector for r in rows) if v is not None), 0)
+
+    @classmethod
+    def from_rows(cls, rows: List[QuestionItem]) -> "ItemMatrix":
+        return cls(*cls._columns(rows, cls._dim(rows)))
+
+    def extend(self, rows: List[QuestionItem], watermark: bool = True):
+        # watermark=False for rows appended out of id order (just banked here): rows other writers
+        # banked below them must still be picked up by the next refresh
+        with self.lock:
+            if watermark and rows:
+                self.max_pk = max(self.max_pk, max(r.id for r in rows))
+            rows = [r for r in rows if r.item_id not in self.pos]
+            if not rows:
+                return
+            dim = self.emb.shape[1] or self._dim(rows)
+            ids, a, b, emb, payloads, _ = self._columns(rows, dim)
+            start = len(self.ids)
+            self.a = np.concatenate([self.a, a])
+            self.b = np.concatenate([self.b, b])
+            old = self.emb if self.emb.shape[1] == dim else np.zeros((start, dim), dtype=np.float32)
+            self.emb = np.vstack([old, normalize_rows(emb)])
+            for i, item_id in enumerate(ids):
+                self.pos[item_id] = start + i
+            self.ids.extend(ids)
+            self.payloads.extend(payloads)
+            self.index.upsert(np.arange(start, len(self.ids)), self.a, self.b)
+
+    def set_params(self, item_ids: Iterable[str], a: Iterable[float], b: Iterable[float]) -> int:
+        with self.lock:
+            changed = []
+            for item_id, ai, bi in zip(item_ids, a, b):
+                i = self.pos.get(item_id)
+                ai = 1.0 if ai is None else float(ai)
+                bi = 0.0 if bi is None else float(bi)
+                if i is not None and (self.a[i] != ai or self.b[i] != bi):
+                    self.a[i], self.b[i] = ai, bi
+                    changed.append(i)
+            self.index.upsert(np.array(changed, dtype=np.int32), self.a, self.b)
+            return len(changed)
+
+    def select(self, theta: float, seen_ids: List[str], seen: Optional[SeenMatrix], threshold: float) -> Optional[int]:
+        # Walk the information ranking for theta's bin; first unseen, non-duplicate item wins
+        with self.lock:
+            if not len(self):
+                return None
+            served = np.zeros(len(self), dtype=bool)
+            served[[self.pos[i] for i in seen_ids if i in self.pos]] = True
+            dedup = seen is not None and len(seen) > 0 and seen.dim == self.emb.shape[1]
+            ranked = self.index.ranked(theta)
+            for start in range(0, len(ranked), SELECT_CHUNK):
+                chunk = ranked[start:start + SELECT_CHUNK]
+                chunk = chunk[~served[chunk]]
+                if dedup and len(chunk):
+                    chunk = chunk[seen.max_sims(self.emb[chunk], normalized=True) < threshold]
+                if len(chunk):
+                    return int(chunk[0])
+            return None
+
+    def item_dict(self, i: int) -> Dict:
+        p = self.payloads[i]
+        return {
+            "item_id": self.ids[i],
+            "question": p["question"],
+            "choices": p["choices"],
+            "correct_index": p["answer_index"],
+            "embedding": self.emb[i].tolist() if self.emb.shape[1] else None,
+            "a": float(self.a[i]),
+            "b": float(self.b[i]),
+        }
+
+_BANKS: Dict[BankKey, ItemMatrix] = {}
+_LOCK = threading.Lock()
+
+def _pool_query(db: Session, key: BankKey, *cols):
+    topic, subtopic, difficulty = key
+    q = db.query(*cols) if cols else db.query(QuestionItem)
+    return q.filter(QuestionItem.topic == topic, QuestionItem.subtopic == subtopic,
+                    QuestionItem.difficulty == difficulty)
+
+def _params_watermark(db: Session, key: BankKey) -> Optional[datetime]:
+    return _pool_query(db, key, func.max(QuestionItem.params_updated_at)).scalar()
+
+def load_item_matrix(db: Session, topic: str, subtopic: str, difficulty: str) -> ItemMatrix:
+    # Columns are built page by page (keyset, id order), so only one page of ORM rows is alive at a time.
+    # The params watermark is read first: a recalibration during the scan is re-read on the next refresh.
+    params_at = _params_watermark(db, (topic, subtopic, difficulty))
+    chunks, dim = [], 0
+    for rows in iter_question_items(db, topic, subtopic, difficulty, order="id"):
+        dim = dim or ItemMatrix._dim(rows)
+        chunks.append(ItemMatrix._columns(rows, dim))
+    if not chunks:
+        m = ItemMatrix.from_rows([])
+        m.params_at = params_at
+        return m
+    emb = [c[3] if c[3].shape[1] == dim else np.zeros((len(c[0]), dim), dtype=np.float32) for c in chunks]
+    return ItemMatrix(
+        [i for c in chunks for i in c[0]],
+        np.concatenate([c[1] for c in chunks]),
+        np.concatenate([c[2] for c in chunks]),
+        np.vstack(emb),
+        [p for c in chunks for p in c[4]],
+        max(c[5] for c in chunks),
+        params_at,
+    )
+
+def refresh_item_matrix(db: Session, key: BankKey, m: ItemMatrix) -> ItemMatrix:
+    # Incremental: append rows above the id watermark, then re-read (a, b) only for rows recalibrated
+    # since the params watermark (>=, so writes sharing its timestamp are not lost; re-applying is a no-op)
+    for rows in iter_question_items(db, *key, order="id", after_id=m.max_pk):
+        m.extend(rows)
+    q = _pool_query(db, key, QuestionItem.item_id, QuestionItem.a, QuestionItem.b, QuestionItem.params_updated_at)
+    if m.params_at is None:
+        q = q.filter(QuestionItem.params_updated_at.isnot(None))
+    else:
+        q = q.filter(QuestionItem.params_updated_at >= m.params_at)
+    params = q.all()
+    if params:
+        ids, a, b, at = zip(*params)
+        m.set_params(ids, a, b)
+        m.params_at = max(at)
+    m.loaded_at = time.monotonic()
+    return m
+
+def append_to_cached(db: Session, key: BankKey, item_ids: List[str]):
+    # Add just-banked items to the cached pool, if it is loaded, without rescanning the rest of it
+    m = _BANKS.get(key)
+    if m is None or not item_ids:
+        return
+    m.extend(db.query(QuestionItem).filter(QuestionItem.item_id.in_(item_ids)).all(), watermark=False)
+
+@timed("get_item_matrix")
+def get_item_matrix(db: Session, topic: str, subtopic: str, difficulty: str) -> ItemMatrix:
+    key = (topic, subtopic, difficulty)
+    m = _BANKS.get(key)
+    if m is not None:
+        if time.monotonic() - m.loaded_at >= BANK_CACHE_TTL:
+            refresh_item_matrix(db, key, m)
+        return m
+    m = load_item_matrix(db, topic, subtopic, difficulty)
+    with _LOCK:
+        return _BANKS.setdefault(key, m)
+
+def update_cached_params(item_ids: List[str], a: Iterable[float], b: Iterable[float]) -> int:
+    # Push recalibrated (a, b) into every cached pool without reloading it
+    a, b = list(a), list(b)
+    return sum(m.set_params(item_ids, a, b) for m in list(_BANKS.values()))
+
+def invalidate_item_matrix(key: Optional[BankKey] = None):
+    with _LOCK:
+        if key is None:
+            _BANKS.clear()
+        else:
+            _BANKS.pop(key, None)
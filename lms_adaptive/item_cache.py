@@ -0,0 +1,116 @@
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Tuple
+from sqlalchemy.orm import Session
+from .db import SessionLocal, QuestionItem, arun
+from .config import ITEM_CACHE_MAX_ITEMS
+from .metrics import timed
+
+class ItemCache:
+    # Process-wide LRU of served item bodies (question, choices, answer, vector) keyed by item_id.
+    # Slim checkpoints hold only item references; nodes rehydrate them here, and misses (e.g. an
+    # attempt resumed on another worker) are loaded from the bank with one IN query.
+    # Returned dicts are shared: treat them as read-only.
+
+    def __init__(self, max_items: int = ITEM_CACHE_MAX_ITEMS):
+        self.max_items = max_items
+        self.items: "OrderedDict[str, Dict]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def put(self, items: Iterable[Dict]):
+        with self.lock:
+            for it in items:
+                self.items[it["item_id"]] = it
+                self.items.move_to_end(it["item_id"])
+            while len(self.items) > self.max_items:
+                self.items.popitem(last=False)
+
+    def _lookup(self, item_ids: List[str]) -> Tuple[Dict[str, Dict], List[str]]:
+        out: Dict[str, Dict] = {}
+        with self.lock:
+            for item_id in item_ids:
+                it = self.items.get(item_id)
+                if it is not None:
+                    self.items.move_to_end(item_id)
+                    out[item_id] = it
+            self.hits += len(out)
+            missing = [i for i in dict.fromkeys(item_ids) if i not in out]
+            self.misses += len(missing)
+        return out, missing
+
+    def _finish(self, item_ids: List[str], out: Dict[str, Dict], loaded: List[Dict]) -> List[Dict]:
+        self.put(loaded)
+        out.update((it["item_id"], it) for it in loaded)
+        lost = [i for i in item_ids if i not in out]
+        if lost:
+            raise KeyError(f"items not in the bank: {lost}")
+        return [out[i] for i in item_ids]
+
+    def get_many(self, item_ids: List[str], db: Optional[Session] = None) -> List[Dict]:
+        out, missing = self._lookup(item_ids)
+        loaded: List[Dict] = []
+        if missing:
+            own = db is None
+            db = db or SessionLocal()
+            try:
+                loaded = load_items(db, missing)
+            finally:
+                if own:
+                    db.close()
+        return self._finish(item_ids, out, loaded)
+
+    async def aget_many(self, item_ids: List[str], adb) -> List[Dict]:
+        # get_many for the async nodes; misses are read through the AsyncSession `adb`
+        out, missing = self._lookup(item_ids)
+        loaded = await arun(adb, load_items, missing) if missing else []
+        return self._finish(item_ids, out, loaded)
+
+def load_items(db: Session, item_ids: List[str]) -> List[Dict]:
+    # Same shape as a freshly served item, with the vector as a plain list (QuestionItem.vector is a
+    # read-only numpy view), so rehydrated items compare and serialize like fresh ones
+    rows = db.query(QuestionItem).filter(QuestionItem.item_id.in_(item_ids)).all()
+    return [{
+        "item_id": r.item_id,
+        "question": r.payload["question"],
+        "choices": r.payload["choices"],
+        "correct_index": r.payload["answer_index"],
+        "embedding": _as_list(r.vector),
+        "a": float(r.a) if r.a is not None else 1.0,
+        "b": float(r.b) if r.b is not None else 0.0,
+    } for r in rows]
+
+def _as_list(v) -> Optional[List[float]]:
+    return v.tolist() if v is not None else None
+
+_CACHE: Optional[ItemCache] = None
+_LOCK = threading.Lock()
+
+def get_item_cache() -> ItemCache:
+    global _CACHE
+    if _CACHE is None:
+        with _LOCK:
+            if _CACHE is None:
+                _CACHE = ItemCache()
+    return _CACHE
+
+@timed("rehydrate")
+def rehydrate(refs: List[Dict]) -> List[Dict]:
+    # Full items for checkpointed `served` entries; full entries pass through, and fields stored on a
+    # reference (e.g. the a/b an item was selected with) take precedence over the cached body
+    slim = [r["item_id"] for r in refs if "question" not in r]
+    if not slim:
+        return list(refs)
+    return _merge(refs, get_item_cache().get_many(slim))
+
+@timed("rehydrate")
+async def arehydrate(refs: List[Dict], adb) -> List[Dict]:
+    slim = [r["item_id"] for r in refs if "question" not in r]
+    if not slim:
+        return list(refs)
+    return _merge(refs, await get_item_cache().aget_many(slim, adb))
+
+def _merge(refs: List[Dict], bodies: List[Dict]) -> List[Dict]:
+    bodies = iter(bodies)
+    return [r if "question" in r else {**next(bodies), **r} for r in refs]
@@ -0,0 +1,91 @@
+import time
+import asyncio
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Hashable, Optional, Tuple
+from .config import PREFETCH_WORKERS, PREFETCH_TTL_S, PREFETCH_WAIT_S
+
+class Prefetcher:
+    # Speculative next-step results, computed while the graph is parked at an interrupt.
+    # Each entry is keyed by the exact state it was computed for, so after the resume only the
+    # matching branch can be taken; branches nobody takes expire after `ttl` seconds.
+
+    def __init__(self, workers: int = PREFETCH_WORKERS, ttl: float = PREFETCH_TTL_S):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="prefetch")
+        self.ttl = ttl
+        self.entries: "OrderedDict[Hashable, Tuple[float, Future]]" = OrderedDict()  # insertion == expiry order
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def _expire(self, now: float):
+        while self.entries:
+            key, (t, fut) = next(iter(self.entries.items()))
+            if now - t < self.ttl:
+                return
+            del self.entries[key]
+            fut.cancel()
+
+    def submit(self, key: Hashable, fn: Callable[..., Any], *args):
+        # Idempotent: nodes re-run from the top on resume, so a second submit for the same key is a no-op
+        with self.lock:
+            now = time.monotonic()
+            self._expire(now)
+            if key not in self.entries:
+                self.entries[key] = (now, self.executor.submit(fn, *args))
+
+    def take(self, key: Hashable, timeout: float = PREFETCH_WAIT_S) -> Optional[Any]:
+        # Result for `key` (waiting up to `timeout` if it is still running); None on miss, timeout or error.
+        # An empty result (a bank-only selection that found nothing) is a miss too: the node computes it.
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is None:
+                self.misses += 1
+                return None
+        try:
+            result = entry[1].result(timeout=timeout)
+        except Exception:
+            with self.lock:
+                self.misses += 1
+            return None
+        with self.lock:
+            if not result:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return result
+
+    async def atake(self, key: Hashable, timeout: float = PREFETCH_WAIT_S) -> Optional[Any]:
+        # take() without blocking the event loop
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is None:
+                self.misses += 1
+                return None
+        try:
+            result = await asyncio.wait_for(asyncio.wrap_future(entry[1]), timeout)
+        except Exception:
+            with self.lock:
+                self.misses += 1
+            return None
+        with self.lock:
+            if not result:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return result
+
+    def shutdown(self, wait: bool = True):
+        self.executor.shutdown(wait=wait, cancel_futures=not wait)
+
+_PREFETCHER: Optional[Prefetcher] = None
+_LOCK = threading.Lock()
+
+def get_prefetcher() -> Prefetcher:
+    global _PREFETCHER
+    if _PREFETCHER is None:
+        with _LOCK:
+            if _PREFETCHER is None:
+                _PREFETCHER = Prefetcher()
+    return _PREFETCHER
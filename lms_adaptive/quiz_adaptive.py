@@ -1,75 +1,359 @@
-import math, hashlib, json
-from typing import List, Dict, Optional
-from sqlalchemy.orm import Session
-from langchain_openai import ChatOpenAI
-from .db import QuestionItem
-from .embeddings import embed_texts, max_cosine
-from .config import CHAT_MODEL, OPENAI_API_KEY, COSINE_THRESHOLD_HARD
-
-def sigmoid(x: float) -> float:
-    return 1.0 / (1.0 + math.exp(-x))
-
-def prob_correct_2pl(theta: float, a: float, b: float) -> float:
-    return sigmoid(a * (theta - b))
-
-def fisher_info_2pl(theta: float, a: float, b: float) -> float:
-    p = prob_correct_2pl(theta, a, b)
-    return (a * a) * p * (1.0 - p)
-
-def update_theta_step(theta: float, a: float, b: float, y: int, lr: float) -> float:
-    p = prob_correct_2pl(theta, a, b)
-    grad = a * (y - p)
-    return float(theta + lr * grad)
-
-def stable_item_id(stem: str) -> str:
-    return hashlib.sha256(stem.strip().lower().encode("utf-8")).hexdigest()[:24]
-
-def llm_generate_mcqs(topic: str, subtopic: str, difficulty: str, k: int) -> List[Dict]:
-    llm = ChatOpenAI(model=CHAT_MODEL, temperature=0.2, api_key=OPENAI_API_KEY)
-    sys = "You are a finance instructor. Create precise MCQs with 4 choices and one correct answer."
-    usr = f"""
-Generate {k*2} MCQs for topic '{topic}', subtopic '{subtopic}', difficulty '{difficulty}'.
-Return JSON list: question, choices[28], answer_index (0-3), explanation.
-Ensure questions are semantically distinct; vary stems, numbers, and rationale.
-"""
-    resp = llm.invoke([{"role":"system","content":sys},{"role":"user","content":usr}])
-    return json.loads(resp.content)
-
-def pick_next_item_adaptive(
-    db: Session,
-    topic: str,
-    subtopic: str,
-    difficulty: str,
-    theta: float,
-    attempt_seen_items: List[Dict],
-) -> Optional[Dict]:
-    rows = db.query(QuestionItem).filter_by(topic=topic, subtopic=subtopic, difficulty=difficulty).limit(200).all()
-    if not rows:
-        return None
-    seen_ids = {it["item_id"] for it in attempt_seen_items}
-    seen_vecs = [it["embedding"] for it in attempt_seen_items if it.get("embedding")]
-
-    best, best_info = None, -1.0
-    for r in rows:
-        if r.item_id in seen_ids:
-            continue
-        if r.embedding is not None:
-            sim = max_cosine(r.embedding, seen_vecs)
-            if sim >= COSINE_THRESHOLD_HARD:
-                continue
-        a = r.a if r.a is not None else 1.0
-        b = r.b if r.b is not None else 0.0
-        info = fisher_info_2pl(theta, a, b)
-        if info > best_info:
-            best_info, best = info, r
-    if not best:
-        return None
-    return {
-        "item_id": best.item_id,
-        "question": best.payload["question"],
-        "choices": best.payload["choices"],
-        "correct_index": best.payload["answer_index"],
-        "embedding": best.embedding,
-        "a": best.a if best.a is not None else 1.0,
-        "b": best.b if best.b is not None else 0.0,
-    }
+import math, hashlib, json
+import asyncio
+import logging
+import threading
+import contextvars
+from functools import partial
+from typing import AsyncIterator, Callable, Iterator, List, Dict, Optional
+from sqlalchemy.orm import Session
+from langchain_openai import ChatOpenAI
+from .embeddings import embed_texts, aembed_texts, SeenMatrix
+from .item_bank import get_item_matrix, append_to_cached
+from .bank_index import BankANN, get_bank_ann
+from .db import SessionLocal, get_async_session, arun, vec_to_blob, bulk_upsert_question_items
+from .replenish import Replenisher, get_replenisher
+from .coalesce import SharedStream, SingleFlight
+from .json_stream import JSONArrayStream
+from .metrics import count, count_llm, timed
+from .config import CHAT_MODEL, OPENAI_API_KEY, COSINE_THRESHOLD_HARD, MCQ_CACHE_TTL_S, MCQ_STREAM
+
+log = logging.getLogger(__name__)
+
+def sigmoid(x: float) -> float:
+    return 1.0 / (1.0 + math.exp(-x))
+
+def prob_correct_2pl(theta: float, a: float, b: float) -> float:
+    return sigmoid(a * (theta - b))
+
+def fisher_info_2pl(theta: float, a: float, b: float) -> float:
+    p = prob_correct_2pl(theta, a, b)
+    return (a * a) * p * (1.0 - p)
+
+def update_theta_step(theta: float, a: float, b: float, y: int, lr: float) -> float:
+    p = prob_correct_2pl(theta, a, b)
+    grad = a * (y - p)
+    return float(theta + lr * grad)
+
+_MCQ_FLIGHT = SingleFlight(MCQ_CACHE_TTL_S)
+
+def stable_item_id(stem: str) -> str:
+    return hashlib.sha256(stem.strip().lower().encode("utf-8")).hexdigest()[:24]
+
+def _mcq_messages(topic: str, subtopic: str, difficulty: str, k: int) -> List[Dict]:
+    sys = "You are a finance instructor. Create precise MCQs with 4 choices and one correct answer."
+    usr = f"""
+Generate {k*2} MCQs for topic '{topic}', subtopic '{subtopic}', difficulty '{difficulty}'.
+Return JSON list: question, choices[28], answer_index (0-3), explanation.
+Ensure questions are semantically distinct; vary stems, numbers, and rationale.
+"""
+    return [{"role":"system","content":sys},{"role":"user","content":usr}]
+
+def _call_llm_mcqs(topic: str, subtopic: str, difficulty: str, k: int) -> List[Dict]:
+    llm = ChatOpenAI(model=CHAT_MODEL, temperature=0.2, api_key=OPENAI_API_KEY)
+    resp = llm.invoke(_mcq_messages(topic, subtopic, difficulty, k))
+    count_llm(resp.usage_metadata)
+    return json.loads(resp.content)
+
+@timed("llm_generate_mcqs")
+def llm_generate_mcqs(topic: str, subtopic: str, difficulty: str, k: int, fresh: bool = False) -> List[Dict]:
+    # Single-flight per pool: concurrent callers share one LLM request, whose result is reused for
+    # MCQ_CACHE_TTL_S. fresh=True (background replenishment) skips the cache but still joins a call in flight.
+    raw = _MCQ_FLIGHT.do((topic, subtopic, difficulty), k, partial(_call_llm_mcqs, topic, subtopic, difficulty, k), fresh)
+    return [dict(it) for it in raw]
+
+async def _acall_llm_mcqs(topic: str, subtopic: str, difficulty: str, k: int) -> List[Dict]:
+    llm = ChatOpenAI(model=CHAT_MODEL, temperature=0.2, api_key=OPENAI_API_KEY)
+    resp = await llm.ainvoke(_mcq_messages(topic, subtopic, difficulty, k))
+    count_llm(resp.usage_metadata)
+    return json.loads(resp.content)
+
+@timed("llm_generate_mcqs")
+async def allm_generate_mcqs(topic: str, subtopic: str, difficulty: str, k: int, fresh: bool = False) -> List[Dict]:
+    # llm_generate_mcqs for the async nodes; shares the same single-flight entries with sync callers
+    raw = await _MCQ_FLIGHT.ado((topic, subtopic, difficulty), k, partial(_acall_llm_mcqs, topic, subtopic, difficulty, k), fresh)
+    return [dict(it) for it in raw]
+
+def _valid_mcq(it) -> bool:
+    return (isinstance(it, dict) and isinstance(it.get("question"), str) and isinstance(it.get("choices"), list)
+            and isinstance(it.get("answer_index"), int))
+
+def _stream_llm_mcqs(topic: str, subtopic: str, difficulty: str, k: int) -> Iterator[Dict]:
+    # Same prompt as llm_generate_mcqs, but yields each MCQ as soon as its JSON object is complete
+    llm = ChatOpenAI(model=CHAT_MODEL, temperature=0.2, api_key=OPENAI_API_KEY)
+    parser = JSONArrayStream()
+    count("llm_calls")
+    for chunk in llm.stream(_mcq_messages(topic, subtopic, difficulty, k)):
+        if chunk.usage_metadata:  # final chunk, when the provider reports usage
+            count("llm_tokens", chunk.usage_metadata.get("total_tokens", 0))
+        for it in parser.feed(chunk.content if isinstance(chunk.content, str) else ""):
+            if _valid_mcq(it):
+                yield it
+
+async def _astream_llm_mcqs(topic: str, subtopic: str, difficulty: str, k: int) -> AsyncIterator[Dict]:
+    llm = ChatOpenAI(model=CHAT_MODEL, temperature=0.2, api_key=OPENAI_API_KEY)
+    parser = JSONArrayStream()
+    count("llm_calls")
+    async for chunk in llm.astream(_mcq_messages(topic, subtopic, difficulty, k)):
+        if chunk.usage_metadata:
+            count("llm_tokens", chunk.usage_metadata.get("total_tokens", 0))
+        for it in parser.feed(chunk.content if isinstance(chunk.content, str) else ""):
+            if _valid_mcq(it):
+                yield it
+
+def llm_stream_mcqs(topic: str, subtopic: str, difficulty: str, k: int, ann: BankANN | None = None,
+                    fresh: bool = False) -> SharedStream:
+    # Single-flight like llm_generate_mcqs, item by item: one producer thread per pool streams the
+    # response and publishes each MCQ as it parses; concurrent callers read the same items and later
+    # ones replay them for MCQ_CACHE_TTL_S. The producer banks the whole batch when the stream ends,
+    # so readers may stop as soon as they have enough.
+    def start(shared: SharedStream):
+        ctx = contextvars.copy_context()  # the call is counted in the leading caller's node step
+        threading.Thread(target=ctx.run, args=(_pump, shared, topic, subtopic, difficulty, k, ann), daemon=True).start()
+    return _MCQ_FLIGHT.stream((topic, subtopic, difficulty), k, start, fresh)
+
+def allm_stream_mcqs(topic: str, subtopic: str, difficulty: str, k: int, ann: BankANN | None = None,
+                     fresh: bool = False) -> SharedStream:
+    # llm_stream_mcqs for the async nodes (read it with async for); the producer is a task on the running
+    # loop, and sync and async callers of a pool share one stream
+    def start(shared: SharedStream):
+        _spawn(_apump(shared, topic, subtopic, difficulty, k, ann))
+    return _MCQ_FLIGHT.stream((topic, subtopic, difficulty), k, start, fresh)
+
+def _pump(shared: SharedStream, topic: str, subtopic: str, difficulty: str, k: int, ann: BankANN | None):
+    try:
+        for it in _stream_llm_mcqs(topic, subtopic, difficulty, k):
+            shared.publish(it)
+    except Exception as e:
+        shared.finish(e)  # raised to the readers
+        return
+    except BaseException as e:
+        shared.finish(e)
+        raise
+    shared.finish()
+    _bank_stream_rest(shared.items, topic, subtopic, difficulty, ann or get_bank_ann())
+
+async def _apump(shared: SharedStream, topic: str, subtopic: str, difficulty: str, k: int, ann: BankANN | None):
+    try:
+        async for it in _astream_llm_mcqs(topic, subtopic, difficulty, k):
+            shared.publish(it)
+    except Exception as e:
+        shared.finish(e)
+        return
+    except BaseException as e:
+        shared.finish(e)
+        raise
+    shared.finish()
+    await _abank_stream_rest(shared.items, topic, subtopic, difficulty, ann or await asyncio.to_thread(get_bank_ann))
+
+@timed("generate_into_bank")
+def generate_into_bank(db: Session, topic: str, subtopic: str, difficulty: str, k: int,
+                       bank_ann: BankANN | None = None, fresh: bool = False, stream: bool = False,
+                       enough: Callable[[], bool] | None = None) -> int:
+    # Generate MCQs and bank the ones that are novel vs. the shared bank index and vs. each other.
+    # New rows are added to the index inline and merged into the cached pool, so no rebuild is needed.
+    # stream=True banks items one at a time as they are parsed and returns once enough() holds (by
+    # default, once one lands) or the stream ends; the stream's producer banks the rest.
+    ann = bank_ann or get_bank_ann()
+    if not stream:
+        return bank_raw_items(db, ann, topic, subtopic, difficulty, llm_generate_mcqs(topic, subtopic, difficulty, k, fresh=fresh))
+    banked = 0
+    for it in llm_stream_mcqs(topic, subtopic, difficulty, k, ann, fresh=fresh):
+        banked += bank_raw_items(db, ann, topic, subtopic, difficulty, [it])
+        if enough() if enough is not None else banked:
+            break
+    return banked
+
+def _unbanked(ann: BankANN, raw: List[Dict]) -> List[Dict]:
+    return [it for it in raw if stable_item_id(it["question"]) not in ann.known]
+
+def _bank_stream_rest(raw: List[Dict], topic: str, subtopic: str, difficulty: str, ann: BankANN):
+    # Bank a finished generation stream off the request path; items its readers already banked are skipped
+    raw = _unbanked(ann, raw)
+    if not raw:
+        return
+    db = SessionLocal()
+    try:
+        bank_raw_items(db, ann, topic, subtopic, difficulty, raw)
+    except Exception:
+        db.rollback()
+        log.exception("Banking streamed MCQs failed for %s", (topic, subtopic, difficulty))
+    finally:
+        db.close()
+
+_TASKS: set = set()  # strong references to in-flight background tasks (the loop only keeps weak ones)
+
+def _spawn(coro):
+    task = asyncio.create_task(coro)
+    _TASKS.add(task)
+    task.add_done_callback(_TASKS.discard)
+
+@timed("generate_into_bank")
+async def agenerate_into_bank(adb, topic: str, subtopic: str, difficulty: str, k: int,
+                             bank_ann: BankANN | None = None, fresh: bool = False, stream: bool = False,
+                             enough: Callable[[], bool] | None = None) -> int:
+    # generate_into_bank over an AsyncSession: provider calls are awaited, ORM work runs via arun
+    ann = bank_ann or await asyncio.to_thread(get_bank_ann)
+    if not stream:
+        raw = await allm_generate_mcqs(topic, subtopic, difficulty, k, fresh=fresh)
+        if not raw:
+            return 0
+        vecs = await aembed_texts([it["question"] for it in raw])
+        return await abank_raw_items(adb, ann, topic, subtopic, difficulty, raw, vecs)
+    banked = 0
+    async for it in allm_stream_mcqs(topic, subtopic, difficulty, k, ann, fresh=fresh):
+        vecs = await aembed_texts([it["question"]])
+        banked += await abank_raw_items(adb, ann, topic, subtopic, difficulty, [it], vecs)
+        if enough() if enough is not None else banked:
+            break
+    return banked
+
+async def _abank_stream_rest(raw: List[Dict], topic: str, subtopic: str, difficulty: str, ann: BankANN):
+    try:
+        raw = _unbanked(ann, raw)
+        if raw:
+            vecs = await aembed_texts([it["question"] for it in raw])
+            async with get_async_session()() as adb:
+                await abank_raw_items(adb, ann, topic, subtopic, difficulty, raw, vecs)
+    except Exception:
+        log.exception("Banking streamed MCQs failed for %s", (topic, subtopic, difficulty))
+
+def bank_raw_items(db: Session, ann: BankANN, topic: str, subtopic: str, difficulty: str, raw: List[Dict],
+                   vecs: List[List[float]] | None = None) -> int:
+    # `vecs` are the stems' embeddings when the caller already has them
+    if not raw:
+        return 0
+    if vecs is None:
+        vecs = embed_texts([it["question"] for it in raw])
+    items = _novel_items(ann, topic, subtopic, difficulty, raw, vecs)
+    if not items:
+        return 0
+    new_ids = _upsert_raw(db, topic, subtopic, difficulty, raw, vecs, items)
+    if not new_ids:
+        return 0
+    ann.add(new_ids, [vecs[items[item_id]] for item_id in new_ids], [(topic, subtopic, difficulty)] * len(new_ids))
+    append_to_cached(db, (topic, subtopic, difficulty), new_ids)
+    return len(new_ids)
+
+async def abank_raw_items(adb, ann: BankANN, topic: str, subtopic: str, difficulty: str, raw: List[Dict],
+                          vecs: List[List[float]] | None = None) -> int:
+    # bank_raw_items over an AsyncSession: index lookups and adds run in a worker thread, only ORM work via arun
+    if not raw:
+        return 0
+    if vecs is None:
+        vecs = await aembed_texts([it["question"] for it in raw])
+    items = await asyncio.to_thread(_novel_items, ann, topic, subtopic, difficulty, raw, vecs)
+    if not items:
+        return 0
+    new_ids = await arun(adb, _upsert_raw, topic, subtopic, difficulty, raw, vecs, items)
+    if not new_ids:
+        return 0
+    await asyncio.to_thread(ann.add, new_ids, [vecs[items[item_id]] for item_id in new_ids],
+                            [(topic, subtopic, difficulty)] * len(new_ids))
+    await arun(adb, append_to_cached, (topic, subtopic, difficulty), new_ids)
+    return len(new_ids)
+
+def _novel_items(ann: BankANN, topic: str, subtopic: str, difficulty: str, raw: List[Dict],
+                 vecs: List[List[float]]) -> Dict[str, int]:
+    # Stems novel vs. the bank index and vs. each other, as item_id -> position in `raw`
+    dup_of = ann.near_duplicates(vecs, topic, subtopic, difficulty, COSINE_THRESHOLD_HARD)
+    novel = [i for i, d in enumerate(dup_of) if d is None]
+    keep = []
+    if novel:
+        keep = [novel[j] for j in SeenMatrix().take_unique([vecs[i] for i in novel], COSINE_THRESHOLD_HARD, len(novel))]
+    return {stable_item_id(raw[i]["question"]): i for i in keep}
+
+def _upsert_raw(db: Session, topic: str, subtopic: str, difficulty: str, raw: List[Dict], vecs: List[List[float]],
+                items: Dict[str, int]) -> List[str]:
+    new_ids = bulk_upsert_question_items(db, [{
+        "item_id": item_id,
+        "source": "generated",
+        "topic": topic,
+        "subtopic": subtopic,
+        "difficulty": difficulty,
+        "payload": {"question": raw[i]["question"], "choices": raw[i]["choices"], "answer_index": raw[i]["answer_index"],
+                    "explanation": raw[i].get("explanation", "")},
+        "embedding_f32": vec_to_blob(vecs[i]),
+    } for item_id, i in items.items()])
+    db.commit()
+    return new_ids
+
+@timed("pick_next_item_adaptive")
+def pick_next_item_adaptive(
+    db: Session,
+    topic: str,
+    subtopic: str,
+    difficulty: str,
+    theta: float,
+    attempt_seen_items: List[Dict],
+    seen: SeenMatrix | None = None,
+    bank_ann: BankANN | None = None,
+    gen_k: int = 3,
+    bank_only: bool = False,
+) -> Optional[Dict]:
+    # `seen` is the attempt's dedup matrix; the chosen item's vector is appended to it.
+    # Candidates come from the information-ranked pool, which is topped up in the background once this
+    # attempt has fewer than REPLENISH_LOW_WATERMARK unused items. If it is exhausted anyway, a top-up that
+    # has already finished is picked up; otherwise gen_k*2 items are generated inline without waiting.
+    # `bank_only` (speculative prefetch): select from the pool as it is, without replenishment or generation.
+    if seen is None:
+        seen = SeenMatrix.from_items(attempt_seen_items)
+    bank = get_item_matrix(db, topic, subtopic, difficulty)
+    seen_ids = [it["item_id"] for it in attempt_seen_items]
+    replenisher = None if bank_only else get_replenisher()
+    job = replenisher.observe((topic, subtopic, difficulty), len(bank) - len(seen_ids)) if replenisher else None
+    best = bank.select(theta, seen_ids, seen, COSINE_THRESHOLD_HARD)
+    if best is None and Replenisher.finished(job):
+        best = bank.select(theta, seen_ids, seen, COSINE_THRESHOLD_HARD)
+    if best is None and gen_k > 0 and not bank_only:
+        # Re-select even if nothing new was banked: a coalesced caller may have banked the same batch.
+        # A stream is read until it yields a selectable item (whoever banked it) or ends; only if the
+        # (possibly shared or cached) batch leaves nothing for this attempt is a fresh call paid for.
+        selectable = lambda: bank.select(theta, seen_ids, seen, COSINE_THRESHOLD_HARD) is not None
+        for fresh in (False, True):
+            generate_into_bank(db, topic, subtopic, difficulty, gen_k, bank_ann, fresh=fresh, stream=MCQ_STREAM,
+                               enough=selectable)
+            best = bank.select(theta, seen_ids, seen, COSINE_THRESHOLD_HARD)
+            if best is not None:
+                break
+    if best is None:
+        return None
+    if bank.emb.shape[1]:
+        seen.add(bank.emb[best], normalized=True)
+    return bank.item_dict(best)
+
+@timed("pick_next_item_adaptive")
+async def apick_next_item_adaptive(
+    adb,
+    topic: str,
+    subtopic: str,
+    difficulty: str,
+    theta: float,
+    attempt_seen_items: List[Dict],
+    seen: SeenMatrix | None = None,
+    bank_ann: BankANN | None = None,
+    gen_k: int = 3,
+) -> Optional[Dict]:
+    # pick_next_item_adaptive over an AsyncSession `adb`. Selection itself is in-memory on the cached
+    # pool; only loading it, banking and the provider calls leave the event loop.
+    if seen is None:
+        seen = SeenMatrix.from_items(attempt_seen_items)
+    bank = await arun(adb, get_item_matrix, topic, subtopic, difficulty)
+    seen_ids = [it["item_id"] for it in attempt_seen_items]
+    replenisher = get_replenisher()
+    job = replenisher.observe((topic, subtopic, difficulty), len(bank) - len(seen_ids)) if replenisher else None
+    best = bank.select(theta, seen_ids, seen, COSINE_THRESHOLD_HARD)
+    if best is None and Replenisher.finished(job):
+        best = bank.select(theta, seen_ids, seen, COSINE_THRESHOLD_HARD)
+    if best is None and gen_k > 0:
+        selectable = lambda: bank.select(theta, seen_ids, seen, COSINE_THRESHOLD_HARD) is not None
+        for fresh in (False, True):
+            await agenerate_into_bank(adb, topic, subtopic, difficulty, gen_k, bank_ann, fresh=fresh, stream=MCQ_STREAM,
+                                      enough=selectable)
+            best = bank.select(theta, seen_ids, seen, COSINE_THRESHOLD_HARD)
+            if best is not None:
+                break
+    if best is None:
+        return None
+    if bank.emb.shape[1]:
+        seen.add(bank.emb[best], normalized=True)
+    return bank.item_dict(best)
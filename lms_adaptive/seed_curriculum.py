@@ -1,29 +1,35 @@
-from .db import SessionLocal, Topic, Subtopic, Prerequisite
-
-def seed_curriculum():
-    db = SessionLocal()
-    topics = {
-        "Corporate Finance": ["Time Value of Money", "NPV", "IRR", "WACC", "Capital Structure", "CAPM"]
-    }
-    order = 0
-    for t, subs in topics.items():
-        topic = db.query(Topic).filter_by(name=t).first()
-        if not topic:
-            topic = Topic(name=t, order_index=order); db.add(topic); db.flush()
-        for i, s in enumerate(subs):
-            if not db.query(Subtopic).filter_by(topic_id=topic.id, name=s).first():
-                db.add(Subtopic(topic_id=topic.id, name=s, order_index=i))
-        order += 1
-    db.commit()
-
-    prereqs = [
-        ("Corporate Finance","Time Value of Money","Corporate Finance","NPV"),
-        ("Corporate Finance","NPV","Corporate Finance","IRR"),
-        ("Corporate Finance","IRR","Corporate Finance","WACC"),
-        ("Corporate Finance","Capital Structure","Corporate Finance","WACC"),
-        ("Corporate Finance","WACC","Corporate Finance","CAPM"),
-    ]
-    for pt, ps, tt, ts in prereqs:
-        if not db.query(Prerequisite).filter_by(prereq_topic=pt, prereq_subtopic=ps, target_topic=tt, target_subtopic=ts).first():
-            db.add(Prerequisite(prereq_topic=pt, prereq_subtopic=ps, target_topic=tt, target_subtopic=ts))
-    db.commit()
+from .db import SessionLocal, Topic, Subtopic, Prerequisite
+
+def seed_curriculum():
+    db = SessionLocal()
+    topics = {
+        "Corporate Finance": ["Time Value of Money", "NPV", "IRR", "WACC", "Capital Structure", "CAPM"]
+    }
+    # One lookup per table instead of one per row
+    existing = {t.name: t for t in db.query(Topic).filter(Topic.name.in_(list(topics))).all()}
+    new_topics = [Topic(name=t, order_index=order) for order, t in enumerate(topics) if t not in existing]
+    if new_topics:
+        db.add_all(new_topics); db.flush()
+        existing.update({t.name: t for t in new_topics})
+    topic_ids = [existing[t].id for t in topics]
+    have = set(db.query(Subtopic.topic_id, Subtopic.name).filter(Subtopic.topic_id.in_(topic_ids)).all())
+    db.add_all([
+        Subtopic(topic_id=existing[t].id, name=s, order_index=i)
+        for t, subs in topics.items() for i, s in enumerate(subs) if (existing[t].id, s) not in have
+    ])
+    db.commit()
+
+    prereqs = [
+        ("Corporate Finance","Time Value of Money","Corporate Finance","NPV"),
+        ("Corporate Finance","NPV","Corporate Finance","IRR"),
+        ("Corporate Finance","IRR","Corporate Finance","WACC"),
+        ("Corporate Finance","Capital Structure","Corporate Finance","WACC"),
+        ("Corporate Finance","WACC","Corporate Finance","CAPM"),
+    ]
+    have = set(db.query(Prerequisite.prereq_topic, Prerequisite.prereq_subtopic,
+                        Prerequisite.target_topic, Prerequisite.target_subtopic).all())
+    db.add_all([
+        Prerequisite(prereq_topic=pt, prereq_subtopic=ps, target_topic=tt, target_subtopic=ts)
+        for pt, ps, tt, ts in prereqs if (pt, ps, tt, ts) not in have
+    ])
+    db.commit()
@@ -0,0 +1,139 @@
+import json
+import time
+import argparse
+from typing import Dict, Optional
+import numpy as np
+from .db import SessionLocal
+from .item_bank import ItemMatrix, load_item_matrix
+from .irt import prob_correct_2pl_vec
+from .embeddings import SeenMatrix
+from .theta import AbilityEstimator, get_estimator, initial_loglik, update_loglik
+from .stopping import StoppingRule
+from .config import QUIZ_LENGTH, COSINE_THRESHOLD_HARD, INIT_THETA, THETA_PRIOR_SD
+
+# Offline CAT simulator: selection goes through the live ItemMatrix.select (binned information ranking
+# and cosine dedup), with the same ability estimator and stopping rule objects as the adaptive graph.
+# No LLM or embedding calls.
+
+def synthetic_bank(n_items: int = 2000, dim: int = 64, seed: int = 0) -> ItemMatrix:
+    rng = np.random.default_rng(seed)
+    a = rng.lognormal(0.0, 0.3, n_items)
+    b = rng.normal(0.0, 1.0, n_items)
+    emb = rng.normal(size=(n_items, dim)).astype(np.float32)
+    payloads = [{"question": f"synthetic {i}", "choices": [], "answer_index": 0} for i in range(n_items)]
+    return ItemMatrix([f"syn-{i}" for i in range(n_items)], a, b, emb, payloads)
+
+def snapshot_bank(topic: str, subtopic: str, difficulty: str) -> ItemMatrix:
+    db = SessionLocal()
+    try:
+        return load_item_matrix(db, topic, subtopic, difficulty)
+    finally:
+        db.close()
+
+def simulate(bank: ItemMatrix, n_examinees: int = 10000, needed: int = QUIZ_LENGTH,
+             estimator: Optional[AbilityEstimator] = None, stopping: Optional[StoppingRule] = None,
+             threshold: float = COSINE_THRESHOLD_HARD, block: int = 1024, seed: int = 1) -> Dict:
+    # Examinees are run `block` at a time: each one's next item comes from bank.select (the live
+    # selector, with its own served ids and SeenMatrix), and responses, ability updates and the
+    # stopping rule are batched over the block. Memory beyond the bank is O(block * needed).
+    rng = np.random.default_rng(seed)
+    estimator = estimator or get_estimator()
+    stopping = stopping or StoppingRule()
+    N, I = n_examinees, len(bank)
+    if not I:
+        raise ValueError("Cannot simulate against an empty item bank")
+    needed = min(needed, I)
+    true_theta = rng.normal(INIT_THETA, THETA_PRIOR_SD, N)
+    has_emb = bank.emb.shape[1] > 0
+
+    theta = np.full(N, INIT_THETA)
+    se = np.full(N, THETA_PRIOR_SD)
+    answered = np.zeros(N, dtype=np.int32)
+    exposure = np.zeros(I, dtype=np.int64)
+    t_select = t_update = 0.0
+    examinee_steps = 0
+
+    t0 = time.perf_counter()
+    for start in range(0, N, block):
+        e = np.arange(start, min(start + block, N))
+        loglik = initial_loglik(len(e))
+        served = [[] for _ in e]
+        seen = [SeenMatrix() for _ in e]
+        live = np.arange(len(e))  # block positions still being tested
+        while len(live):
+            ts = time.perf_counter()
+            chosen = np.empty(len(live), dtype=np.int64)
+            for j, k in enumerate(live):
+                best = bank.select(float(theta[e[k]]), served[k], seen[k], threshold)
+                chosen[j] = -1 if best is None else best
+                if best is not None:
+                    served[k].append(bank.ids[best])
+                    if has_emb:
+                        seen[k].add(bank.emb[best], normalized=True)
+            t_select += time.perf_counter() - ts
+
+            # Pool exhausted for these examinees: end their attempt without serving anything
+            valid = chosen >= 0
+            live, chosen = live[valid], chosen[valid]
+            if not len(live):
+                break
+            tu = time.perf_counter()
+            idx = e[live]
+            a, b = bank.a[chosen], bank.b[chosen]
+            y = (rng.random(len(idx)) < prob_correct_2pl_vec(true_theta[idx], a, b)).astype(np.int8)
+            loglik[live] = update_loglik(loglik[live], a, b, y)
+            th, sd = estimator.estimate(theta[idx], loglik[live], a, b, y)
+            theta[idx], se[idx] = th, sd
+            answered[idx] += 1
+            np.add.at(exposure, chosen, 1)
+            live = live[~stopping.should_stop(answered[idx], se[idx], needed)]
+            t_update += time.perf_counter() - tu
+            examinee_steps += len(idx)
+    elapsed = time.perf_counter() - t0
+
+    err = theta - true_theta
+    return {
+        "examinees": N,
+        "bank_items": I,
+        "estimator": estimator.name,
+        "max_items": needed,
+        "avg_length": float(answered.mean()),
+        "median_length": float(np.median(answered)),
+        "avg_reduction_pct": float(100.0 * (1.0 - answered.mean() / needed)),
+        "rmse": float(np.sqrt(np.mean(err * err))),
+        "bias": float(err.mean()),
+        "avg_final_se": float(se.mean()),
+        "max_exposure_rate": float(exposure.max() / N),
+        "elapsed_s": elapsed,
+        "examinees_per_s": N / elapsed,
+        "select_us_per_step": 1e6 * t_select / max(1, examinee_steps),
+        "update_us_per_step": 1e6 * t_update / max(1, examinee_steps),
+    }
+
+def main():
+    ap = argparse.ArgumentParser(description="Simulate adaptive quizzes offline.")
+    ap.add_argument("--examinees", type=int, default=10000)
+    ap.add_argument("--items", type=int, default=2000, help="synthetic bank size")
+    ap.add_argument("--dim", type=int, default=64, help="synthetic embedding dim")
+    ap.add_argument("--snapshot", nargs=3, metavar=("TOPIC", "SUBTOPIC", "DIFFICULTY"),
+                    help="use the QuestionItem pool instead of a synthetic bank")
+    ap.add_argument("--max-items", type=int, default=QUIZ_LENGTH)
+    ap.add_argument("--estimator", default=None, help="eap | mle | step (default THETA_ESTIMATOR)")
+    ap.add_argument("--se-threshold", type=float, default=None)
+    ap.add_argument("--min-items", type=int, default=None)
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--block", type=int, default=1024, help="examinees simulated together")
+    args = ap.parse_args()
+
+    bank = snapshot_bank(*args.snapshot) if args.snapshot else synthetic_bank(args.items, args.dim, args.seed)
+    rule = StoppingRule()
+    if args.se_threshold is not None:
+        rule.se_threshold = args.se_threshold
+    if args.min_items is not None:
+        rule.min_items = args.min_items
+    report = simulate(bank, args.examinees, args.max_items, get_estimator(args.estimator), rule,
+                      block=args.block, seed=args.seed)
+    print(json.dumps(report, indent=2))
+
+if __name__ == "__main__":
+    main()
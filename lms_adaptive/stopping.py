@@ -0,0 +1,94 @@
+import argparse
+from typing import Dict, Iterable, List, Optional
+import numpy as np
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+from .db import SessionLocal, QuizAttempt, AttemptResponse
+from .config import QUIZ_LENGTH, STOP_SE_THRESHOLD, STOP_MIN_ITEMS, STOP_MAX_ITEMS
+
+class StoppingRule:
+    def __init__(self, se_threshold: float = STOP_SE_THRESHOLD, min_items: int = STOP_MIN_ITEMS,
+                 max_items: int = STOP_MAX_ITEMS):
+        self.se_threshold = se_threshold
+        self.min_items = min_items
+        self.max_items = max_items  # 0 -> the attempt's `needed`
+
+    def should_stop(self, answered, se, needed):
+        # Works elementwise on arrays too (used by the CAT simulator)
+        max_items = np.minimum(self.max_items, needed) if self.max_items else needed
+        return (answered >= max_items) | ((answered >= self.min_items) & (se <= self.se_threshold))
+
+    def is_complete(self, answered: int, se: float, needed: int) -> bool:
+        return bool(self.should_stop(answered, se, needed))
+
+    def route(self, s: Dict) -> str:
+        # Conditional edge out of validate_update_and_advance, which sets `complete` from this rule
+        # (edges cannot write state); re-checked here for states advanced before it did
+        if s["complete"] or self.is_complete(s["current_index"], s.get("theta_se", float("inf")), s["needed"]):
+            return "end"
+        return "loop"
+
+SE_TRADEOFF_FIELDS = ("avg_length", "avg_reduction_pct", "rmse", "bias", "avg_final_se")
+
+def se_tradeoff(bank, thresholds: Iterable[float], n_examinees: int = 2000, needed: int = QUIZ_LENGTH,
+                min_items: int = STOP_MIN_ITEMS, seed: int = 1) -> List[Dict]:
+    # Simulated test length vs. accuracy at each SE threshold, same examinees for every threshold
+    from .simulate import simulate  # simulate imports this module
+    rows = []
+    for t in thresholds:
+        r = simulate(bank, n_examinees, needed, stopping=StoppingRule(t, min_items), seed=seed)
+        rows.append({"se_threshold": t, **{k: r[k] for k in SE_TRADEOFF_FIELDS}})
+    return rows
+
+def test_length_report(db: Optional[Session] = None, topic: Optional[str] = None, subtopic: Optional[str] = None,
+                       fixed_length: int = QUIZ_LENGTH, se_thresholds: Optional[Iterable[float]] = None,
+                       bank=None, examinees: int = 2000) -> Dict:
+    # Observed lengths of finished attempts; with `se_thresholds`, also the simulated SE/length
+    # trade-off on `bank` (an ItemMatrix; a synthetic bank if omitted)
+    db = db or SessionLocal()
+    q = (
+        db.query(AttemptResponse.attempt_id, func.count(AttemptResponse.id))
+        .join(QuizAttempt, QuizAttempt.id == AttemptResponse.attempt_id)
+        .filter(QuizAttempt.finished_at.isnot(None))
+    )
+    if topic:
+        q = q.filter(QuizAttempt.topic == topic)
+    if subtopic:
+        q = q.filter(QuizAttempt.subtopic == subtopic)
+    lengths = [n for _, n in q.group_by(AttemptResponse.attempt_id).all()]
+    report = {"attempts": len(lengths), "fixed_length": fixed_length}
+    if lengths:
+        avg = sum(lengths) / len(lengths)
+        report.update({
+            "avg_length": avg,
+            "min_length": min(lengths),
+            "max_length": max(lengths),
+            "stopped_early": sum(1 for n in lengths if n < fixed_length),
+            "avg_reduction_items": fixed_length - avg,
+            "avg_reduction_pct": 100.0 * (1.0 - avg / fixed_length),
+        })
+    if se_thresholds:
+        if bank is None:
+            from .simulate import synthetic_bank
+            bank = synthetic_bank()
+        report["se_tradeoff"] = se_tradeoff(bank, se_thresholds, examinees, fixed_length)
+    return report
+
+def main():
+    ap = argparse.ArgumentParser(description="Average adaptive test length vs. the fixed QUIZ_LENGTH.")
+    ap.add_argument("--topic")
+    ap.add_argument("--subtopic")
+    ap.add_argument("--difficulty", help="with --topic/--subtopic: simulate on that pool instead of a synthetic bank")
+    ap.add_argument("--se-thresholds", type=float, nargs="+",
+                    help="also report simulated length and accuracy at each SE threshold")
+    ap.add_argument("--examinees", type=int, default=2000, help="simulated examinees per SE threshold")
+    args = ap.parse_args()
+    bank = None
+    if args.se_thresholds and args.topic and args.subtopic and args.difficulty:
+        from .simulate import snapshot_bank
+        bank = snapshot_bank(args.topic, args.subtopic, args.difficulty)
+    print(test_length_report(topic=args.topic, subtopic=args.subtopic, se_thresholds=args.se_thresholds,
+                             bank=bank, examinees=args.examinees))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+from abc import ABC, abstractmethod
+from typing import Dict, List, Tuple
+import numpy as np
+from .irt import log_sigmoid
+from .config import (
+    INIT_THETA, THETA_LR, THETA_ESTIMATOR, THETA_PRIOR_SD, THETA_GRID_POINTS, THETA_GRID_MIN, THETA_GRID_MAX
+)
+
+# Precomputed quadrature tables shared by every estimator
+THETA_GRID = np.linspace(THETA_GRID_MIN, THETA_GRID_MAX, THETA_GRID_POINTS)
+THETA_GRID_SQ = THETA_GRID * THETA_GRID
+LOG_PRIOR = -0.5 * ((THETA_GRID - INIT_THETA) / THETA_PRIOR_SD) ** 2
+
+# All functions below accept a single log-likelihood vector of shape (G,) or a batch of shape (N, G),
+# with a, b, y broadcasting over the leading axis.
+
+def initial_loglik(n: int | None = None) -> np.ndarray:
+    return np.zeros(THETA_GRID_POINTS) if n is None else np.zeros((n, THETA_GRID_POINTS))
+
+def update_loglik(loglik: np.ndarray, a, b, y) -> np.ndarray:
+    a = np.asarray(a, dtype=np.float64)[..., None]
+    b = np.asarray(b, dtype=np.float64)[..., None]
+    sign = np.where(np.asarray(y)[..., None] == 1, 1.0, -1.0)
+    return loglik + log_sigmoid(sign * a * (THETA_GRID - b))
+
+def posterior(loglik: np.ndarray) -> np.ndarray:
+    lp = loglik + LOG_PRIOR
+    w = np.exp(lp - lp.max(axis=-1, keepdims=True))
+    return w / w.sum(axis=-1, keepdims=True)
+
+def eap(loglik: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    w = posterior(loglik)
+    mean = (w * THETA_GRID).sum(axis=-1)
+    var = (w * THETA_GRID_SQ).sum(axis=-1) - mean * mean
+    return mean, np.sqrt(np.maximum(var, 0.0))
+
+def mle(loglik: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    # Grid argmax refined by a parabola through its neighbours; SE from the observed curvature.
+    # Response patterns without a finite interior maximum (all right / all wrong) fall back to EAP.
+    G = THETA_GRID_POINTS
+    h = THETA_GRID[1] - THETA_GRID[0]
+    k = np.clip(np.argmax(loglik, axis=-1), 1, G - 2)
+    l0 = np.take_along_axis(loglik, (k - 1)[..., None], axis=-1)[..., 0]
+    l1 = np.take_along_axis(loglik, k[..., None], axis=-1)[..., 0]
+    l2 = np.take_along_axis(loglik, (k + 1)[..., None], axis=-1)[..., 0]
+    curv = (l0 - 2.0 * l1 + l2) / (h * h)
+    interior = (curv < 0) & (l1 >= l0) & (l1 >= l2)
+    safe = np.where(interior, curv, -1.0)
+    theta = THETA_GRID[k] + (l0 - l2) / (2.0 * h * safe)
+    se = 1.0 / np.sqrt(-safe)
+    eap_theta, eap_se = eap(loglik)
+    return np.where(interior, theta, eap_theta), np.where(interior, se, eap_se)
+
+class AbilityEstimator(ABC):
+    name = "base"
+
+    def update(self, theta: float, loglik: List[float], a: float, b: float, y: int) -> Dict:
+        ll = update_loglik(np.asarray(loglik, dtype=np.float64), a, b, y)
+        theta, se = self.estimate(theta, ll, a, b, y)
+        return {"theta": float(theta), "theta_se": float(se), "theta_loglik": ll.tolist()}
+
+    @abstractmethod
+    def estimate(self, theta: float, loglik: np.ndarray, a: float, b: float, y: int):
+        ...
+
+class EAPEstimator(AbilityEstimator):
+    name = "eap"
+
+    def estimate(self, theta, loglik, a, b, y):
+        return eap(loglik)
+
+class MLEEstimator(AbilityEstimator):
+    name = "mle"
+
+    def estimate(self, theta, loglik, a, b, y):
+        return mle(loglik)
+
+class StepEstimator(AbilityEstimator):
+    # Legacy fixed-rate gradient step; SE is still reported from the grid posterior
+    name = "step"
+
+    def estimate(self, theta, loglik, a, b, y):
+        p = 1.0 / (1.0 + np.exp(-a * (theta - b)))
+        return theta + THETA_LR * a * (y - p), eap(loglik)[1]
+
+ESTIMATORS = {cls.name: cls for cls in (EAPEstimator, MLEEstimator, StepEstimator)}
+
+def get_estimator(name: str | None = None) -> AbilityEstimator:
+    name = (name or THETA_ESTIMATOR).lower()
+    if name not in ESTIMATORS:
+        raise ValueError(f"Unknown THETA_ESTIMATOR '{name}'; expected one of {sorted(ESTIMATORS)}")
+    return ESTIMATORS[name]()